@@ -1,3 +1,4 @@
 from tabun_stat import main
 
-main.main()
+if __name__ == "__main__":
+    main.main()
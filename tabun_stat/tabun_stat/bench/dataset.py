@@ -0,0 +1,405 @@
+"""Генератор синтетической базы данных Табуна для бенчмарков.
+
+Создаёт sqlite3 базу данных со схемой, которую ожидает Sqlite3DataSource
+(как в demo.sql), и заполняет её правдоподобными данными: авторы постов
+и комментов и слова в текстах распределены по закону Ципфа (немногие пишут
+и употребляются очень часто, большинство — редко), тексты содержат HTML
+с переносами строк, ссылками, картинками и дайсами, часть постов лежит
+в закрытых и полузакрытых блогах. При одинаковых параметрах и seed
+результат всегда одинаковый.
+
+    python -m tabun_stat.bench.dataset bench.sqlite3 --users 10000 --posts 50000 --comments 1000000
+"""
+
+import argparse
+import random
+import sqlite3
+import sys
+import time
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timedelta, timezone
+from itertools import accumulate
+from pathlib import Path
+from typing import Sequence
+
+from tabun_stat.datasource.sqlite3 import INDEXES
+
+SCHEMA = """
+CREATE TABLE users(
+    id int not null primary key,
+    username varchar(32) not null,
+    realname text default null,
+    skill real not null,
+    rating real not null,
+    gender char(1) default null,
+    birthday date default null,
+    registered_at datetime not null,
+    description mediumtext default null
+);
+
+CREATE TABLE blogs(
+    id int not null primary key,
+    slug text not null,
+    name text not null,
+    creator_id int not null,
+    rating real not null,
+    status int not null,
+    description mediumtext default null,
+    vote_count int not null,
+    created_at datetime not null
+);
+
+CREATE TABLE posts(
+    id int not null primary key,
+    created_at datetime not null,
+    blog_id int default null,
+    blog_status int not null,
+    author_id int not null,
+    title text not null,
+    vote_count int not null,
+    vote_value int default null,
+    body mediumtext not null,
+    tags text not null,
+    favorites_count int not null
+);
+
+CREATE TABLE comments(
+    id int not null primary key,
+    post_id int default null,
+    parent_id int default null,
+    author_id int not null,
+    created_at datetime not null,
+    vote_value int not null,
+    body mediumtext not null,
+    favorites_count int not null
+);
+"""
+
+SYLLABLES_RU = ("по", "ни", "ка", "ра", "ду", "га", "ло", "ми", "ше", "ть", "ск", "ва", "ре", "то", "ёж")
+SYLLABLES_EN = ("po", "ny", "ra", "in", "bow", "twi", "light", "spar", "kle", "de", "ash")
+PUNCTUATION = (" ", " ", " ", " ", " ", ", ", ". ", "! ", "? ", " — ", "\n")
+IMAGE_HOSTS = ("i.imgur.com", "files.everypony.ru", "cdn.everypony.ru", "derpicdn.net", "pp.userapi.com")
+
+# Какую долю сообщений украшать той или иной разметкой
+IMAGE_RATE = 0.08
+DICE_RATE = 0.005
+LINK_RATE = 0.05
+# Какая доля постов в личных блогах и какие статусы у остальных блогов
+PERSONAL_RATE = 0.15
+BLOG_STATUSES = (0, 0, 0, 0, 0, 0, 0, 1, 1, 2)
+# Какая доля комментов является ответом на другой коммент
+REPLY_RATE = 0.6
+# Сколько комментов обычно в одном посте
+COMMENTS_PER_POST_ZIPF = 1.1
+
+
+class Zipf:
+    """Выбирает случайные элементы так, что вероятность k-го по популярности
+    элемента пропорциональна 1 / k ** s.
+    """
+
+    def __init__(
+        self,
+        items: Sequence[int],
+        s: float,
+        rnd: random.Random,
+        ranks: Sequence[int] | None = None,
+    ):
+        """
+        :param ranks: места элементов по популярности (начиная с единицы);
+          по умолчанию элементы уже отсортированы по популярности
+        """
+        self.items = items
+        self.rnd = rnd
+        if ranks is None:
+            ranks = range(1, len(items) + 1)
+        self.cum_weights = list(accumulate(1.0 / (k**s) for k in ranks))
+        self.total = self.cum_weights[-1]
+
+    def choice(self, count: int | None = None) -> int:
+        """Выбирает элемент из первых count элементов (по умолчанию из всех)."""
+        if count is None:
+            return self.items[bisect_left(self.cum_weights, self.rnd.random() * self.total)]
+        total = self.cum_weights[count - 1]
+        return self.items[bisect_left(self.cum_weights, self.rnd.random() * total, 0, count - 1)]
+
+
+def make_vocabulary(size: int, rnd: random.Random) -> list[str]:
+    """Создаёт словарь из size различных слов (в основном кириллицей)."""
+    words: list[str] = []
+    seen: set[str] = set()
+    while len(words) < size:
+        syllables = SYLLABLES_RU if rnd.random() < 0.85 else SYLLABLES_EN
+        word = "".join(rnd.choice(syllables) for _ in range(rnd.randint(1, 4)))
+        if rnd.random() < 0.05:
+            word = word.capitalize()
+        if word not in seen:
+            seen.add(word)
+            words.append(word)
+    return words
+
+
+def format_datetime(dt: datetime) -> str:
+    return dt.strftime("%Y-%m-%d %H:%M:%S")
+
+
+def random_datetimes(
+    count: int, min_date: datetime, max_date: datetime, rnd: random.Random
+) -> list[datetime]:
+    """Отсортированные случайные моменты времени; со временем активность
+    растёт, как растёт и сам сайт.
+    """
+    span = (max_date - min_date).total_seconds()
+    return sorted(min_date + timedelta(seconds=int(span * rnd.random() ** 0.7)) for _ in range(count))
+
+
+def random_ranks(count: int, rnd: random.Random) -> list[int]:
+    """Случайные места по популярности для count элементов, чтобы самыми
+    популярными были не обязательно самые первые.
+    """
+    ranks = list(range(1, count + 1))
+    rnd.shuffle(ranks)
+    return ranks
+
+
+class BodyGenerator:
+    def __init__(self, vocabulary: list[str], rnd: random.Random):
+        self.rnd = rnd
+        self.words = Zipf(range(len(vocabulary)), 1.05, rnd)
+        self.vocabulary = vocabulary
+
+    def make(self, words_count: int) -> str:
+        rnd = self.rnd
+        parts: list[str] = []
+        for _ in range(words_count):
+            parts.append(self.vocabulary[self.words.choice()])
+            sep = rnd.choice(PUNCTUATION)
+            parts.append("<br/>\n" if sep == "\n" else sep)
+
+        if rnd.random() < LINK_RATE:
+            idx = rnd.randrange(len(parts))
+            url = f"https://tabun.everypony.ru/blog/{rnd.randint(1, 200000)}.html"
+            parts[idx] = f'<a href="{url}" rel="nofollow">{parts[idx]}</a>'
+
+        if rnd.random() < IMAGE_RATE:
+            for _ in range(rnd.randint(1, 3)):
+                host = rnd.choice(IMAGE_HOSTS)
+                # Немного одинаковых картинок, чтобы было что считать
+                name = f"{rnd.randint(1, 5000):08x}"
+                parts.insert(rnd.randrange(len(parts) + 1), f'<img src="https://{host}/{name}.png" alt=""/>')
+
+        if rnd.random() < DICE_RATE:
+            n, m = rnd.randint(1, 6), rnd.choice((6, 20, 100))
+            values = [rnd.randint(1, m) for _ in range(n)]
+            parts.append(
+                f'<span class="dice"><span class="blue">{n}d{m}</span>: '
+                f'<span class="green">[{" + ".join(map(str, values))}]</span> | '
+                f'<span class="red">[{sum(values)}]</span></span>'
+            )
+
+        return "".join(parts).strip()
+
+
+def generate(
+    path: Path,
+    *,
+    users: int,
+    blogs: int,
+    posts: int,
+    comments: int,
+    vocabulary_size: int,
+    min_date: datetime,
+    max_date: datetime,
+    seed: int,
+) -> None:
+    rnd = random.Random(seed)
+    conn = sqlite3.connect(path)
+    try:
+        conn.executescript(SCHEMA)
+        body_gen = BodyGenerator(make_vocabulary(vocabulary_size, rnd), rnd)
+
+        # Пользователи: id с пропусками, как у удалённых аккаунтов; первый
+        # пользователь (создатель сайта) регистрируется в самом начале,
+        # чтобы у любого сообщения был возможный автор
+        registered = random_datetimes(users, min_date, max_date, rnd)
+        if registered:
+            registered[0] = min_date
+        user_ids: list[int] = []
+        user_id = 0
+        for i in range(users):
+            user_id += 1 if rnd.random() < 0.9 else rnd.randint(2, 5)
+            user_ids.append(user_id)
+            conn.execute(
+                "INSERT INTO users VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    user_id,
+                    f"user{user_id}",
+                    None,
+                    round(rnd.expovariate(1 / 300), 2),
+                    round(rnd.gauss(20, 200), 2),
+                    rnd.choice(("M", "F", None)),
+                    (
+                        f"{rnd.randint(1970, 2005):04d}-{rnd.randint(1, 12):02d}-{rnd.randint(1, 28):02d}"
+                        if rnd.random() < 0.3
+                        else None
+                    ),
+                    format_datetime(registered[i]),
+                    None,
+                ),
+            )
+
+        # Авторы: пользователи по порядку регистрации, но самые активные
+        # выбираются из случайных пользователей, а не из первых
+        # зарегистрированных. Автором сообщения или создателем блога может
+        # быть только пользователь, зарегистрированный до его создания
+        authors = Zipf(user_ids, 1.0, rnd, random_ranks(users, rnd))
+
+        def choose_author(created_at: datetime) -> int:
+            return authors.choice(bisect_right(registered, created_at))
+
+        # Блоги создаются постепенно (первый — в самом начале)
+        blog_dates = random_datetimes(blogs, min_date, max_date, rnd)
+        if blog_dates:
+            blog_dates[0] = min_date
+        blog_statuses: dict[int, int] = {}
+        for blog_id, created_at in enumerate(blog_dates, 1):
+            status = rnd.choice(BLOG_STATUSES)
+            blog_statuses[blog_id] = status
+            conn.execute(
+                "INSERT INTO blogs VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    blog_id,
+                    f"blog{blog_id}",
+                    f"Блог {blog_id}",
+                    choose_author(created_at),
+                    round(rnd.expovariate(1 / 100), 2),
+                    status,
+                    body_gen.make(20),
+                    rnd.randint(0, 500),
+                    format_datetime(created_at),
+                ),
+            )
+
+        # Посты пишутся только в уже созданные блоги
+        blogs_zipf = Zipf(range(1, blogs + 1), 0.8, rnd, random_ranks(blogs, rnd)) if blogs else None
+
+        post_dates = random_datetimes(posts, min_date, max_date, rnd)
+        post_ids: list[int] = []
+        for i, created_at in enumerate(post_dates):
+            post_id = i + 1
+            post_ids.append(post_id)
+            post_blog_id = (
+                blogs_zipf.choice(bisect_right(blog_dates, created_at))
+                if blogs_zipf and rnd.random() >= PERSONAL_RATE
+                else None
+            )
+            conn.execute(
+                "INSERT INTO posts VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    post_id,
+                    format_datetime(created_at),
+                    post_blog_id,
+                    blog_statuses[post_blog_id] if post_blog_id is not None else 0,
+                    choose_author(created_at),
+                    body_gen.make(rnd.randint(2, 8)),
+                    rnd.randint(0, 100),
+                    rnd.randint(-5, 100) if rnd.random() < 0.9 else None,
+                    body_gen.make(int(rnd.lognormvariate(4.5, 1.0)) + 1),
+                    ",".join(body_gen.make(1) for _ in range(rnd.randint(1, 4))),
+                    rnd.randint(0, 20),
+                ),
+            )
+
+        # Комменты: популярность постов тоже по Ципфу, комменты пишутся
+        # в основном в первые дни после поста; id комментов, как и на сайте,
+        # возрастают вместе со временем
+        if posts:
+            post_popularity = Zipf(range(posts), COMMENTS_PER_POST_ZIPF, rnd)
+            popular_posts = list(range(posts))
+            rnd.shuffle(popular_posts)
+            last_date = max_date - timedelta(seconds=1)
+            comment_posts: list[tuple[datetime, int]] = []
+            for _ in range(comments):
+                post_idx = popular_posts[post_popularity.choice()]
+                created_at = post_dates[post_idx] + timedelta(seconds=int(rnd.expovariate(1 / 86400)))
+                comment_posts.append((min(created_at, last_date), post_idx))
+            comment_posts.sort()
+
+            last_comment: dict[int, int] = {}
+            for comment_id, (created_at, post_idx) in enumerate(comment_posts, 1):
+                parent_id = last_comment.get(post_idx) if rnd.random() < REPLY_RATE else None
+                last_comment[post_idx] = comment_id
+                conn.execute(
+                    "INSERT INTO comments VALUES(?, ?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        comment_id,
+                        post_ids[post_idx],
+                        parent_id,
+                        choose_author(created_at),
+                        format_datetime(created_at),
+                        rnd.randint(-3, 10),
+                        body_gen.make(int(rnd.lognormvariate(2.5, 1.0)) + 1),
+                        rnd.randint(0, 2),
+                    ),
+                )
+
+        for table, columns in INDEXES:
+            conn.execute(f"CREATE INDEX {table}_{'_'.join(columns)} ON {table}({', '.join(columns)})")
+
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def parse_date(value: str) -> datetime:
+    return datetime.strptime(value, "%Y-%m-%d").replace(tzinfo=timezone.utc)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Generates a synthetic Tabun database for benchmarks")
+    parser.add_argument("path", help="path to new sqlite3 database")
+    parser.add_argument("--users", type=int, default=2000, help="number of users (default: %(default)s)")
+    parser.add_argument("--blogs", type=int, default=100, help="number of blogs (default: %(default)s)")
+    parser.add_argument("--posts", type=int, default=5000, help="number of posts (default: %(default)s)")
+    parser.add_argument(
+        "--comments", type=int, default=100000, help="number of comments (default: %(default)s)"
+    )
+    parser.add_argument(
+        "--vocabulary", type=int, default=50000, help="number of distinct words (default: %(default)s)"
+    )
+    parser.add_argument(
+        "--min-date", type=parse_date, default="2011-08-10", help="first date (default: %(default)s)"
+    )
+    parser.add_argument(
+        "--max-date", type=parse_date, default="2024-01-01", help="last date (default: %(default)s)"
+    )
+    parser.add_argument("--seed", type=int, default=1, help="random seed (default: %(default)s)")
+    parser.add_argument("-f", "--force", action="store_true", help="overwrite existing database")
+
+    args = parser.parse_args()
+
+    path = Path(args.path)
+    if path.exists():
+        if not args.force:
+            print(f"{str(path)!r} already exists", file=sys.stderr)
+            return 1
+        path.unlink()
+
+    tm = time.monotonic()
+    generate(
+        path,
+        users=args.users,
+        blogs=args.blogs,
+        posts=args.posts,
+        comments=args.comments,
+        vocabulary_size=args.vocabulary,
+        min_date=args.min_date,
+        max_date=args.max_date,
+        seed=args.seed,
+    )
+    print(f"Generated {str(path)!r} in {time.monotonic() - tm:.1f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
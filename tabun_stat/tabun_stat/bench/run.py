@@ -0,0 +1,174 @@
+"""Бенчмарк обработчиков и источника данных на sqlite3 базе данных
+(обычно сгенерированной через ``tabun_stat.bench.dataset``).
+
+Запускает tabun_stat с обработчиками из указанного конфига несколько раз,
+берёт замеры из perf.json каждого запуска (лучшее время из всех запусков)
+и при необходимости сохраняет их как эталон или сравнивает с сохранённым
+эталоном. Если что-то стало медленнее эталона больше допустимого, код
+возврата 1.
+
+    python -m tabun_stat.bench.dataset bench.sqlite3
+    python -m tabun_stat.bench.run bench.sqlite3 -c config.toml --save baseline.json
+    python -m tabun_stat.bench.run bench.sqlite3 -c config.toml --baseline baseline.json
+"""
+
+import argparse
+import json
+import sys
+import tempfile
+from pathlib import Path
+from typing import Any
+
+from tabun_stat.config import Config
+from tabun_stat.datasource.sqlite3 import Sqlite3DataSource
+from tabun_stat.main import load_processor
+from tabun_stat.stat import TabunStat
+
+
+def run_once(config: Config, db_path: Path, *, workers: int, shards: int) -> dict[str, Any]:
+    """Один запуск tabun_stat, возвращает содержимое perf.json."""
+    source = Sqlite3DataSource(path=db_path, read_only=True)
+    with tempfile.TemporaryDirectory(prefix="tabun_stat_bench_") as tmp:
+        stat = TabunStat(
+            source=source,
+            destination=tmp,
+            min_date=config.min_date,
+            max_date=config.max_date,
+            tz=config.timezone,
+            workers=workers,
+            shards=shards,
+            prefetch_threads=config.prefetch_threads,
+            prefetch_queue_size=config.prefetch_queue_size,
+            prefetch_rows=config.prefetch_rows,
+            perf_json=True,
+            output_compression=config.output_compression,
+            parquet_tables=config.parquet_tables,
+        )
+        for params in config.processors:
+            kwargs = dict(params)
+            worker = kwargs.pop("worker", None)
+            stat.add_processor(load_processor(kwargs), worker=worker if isinstance(worker, int) else None)
+
+        try:
+            stat.go()
+            with (Path(tmp) / "perf.json").open("r", encoding="utf-8") as fp:
+                result: dict[str, Any] = json.load(fp)
+        finally:
+            stat.destroy()
+            source.destroy()
+    return result
+
+
+def summarize(runs: list[dict[str, Any]]) -> dict[str, float]:
+    """Сводит замеры нескольких запусков в плоский словарь {название: секунды},
+    беря для каждого замера лучшее время (оно меньше всего зависит от шума).
+    """
+    result: dict[str, float] = {}
+    for perf in runs:
+        items = {
+            "total": perf["duration"],
+            "source": perf["source"]["queries"],
+            "source (thread)": perf["source"]["queries_threaded"],
+        }
+        for phase, duration in perf["phases"].items():
+            items[f"phase {phase}"] = duration
+        for p in perf["processors"]:
+            items[f"{p['index']:02d} {p['name']}"] = p["total"]
+
+        for name, duration in items.items():
+            result[name] = min(result.get(name, duration), duration)
+    return result
+
+
+def compare(
+    current: dict[str, float],
+    baseline: dict[str, float],
+    *,
+    tolerance: float,
+    min_delta: float,
+) -> bool:
+    """Печатает сравнение с эталоном. Возвращает False, если что-то стало
+    медленнее больше чем на tolerance (доля) и при этом больше чем
+    на min_delta секунд (чтобы не ругаться на шум в быстрых обработчиках).
+    """
+    ok = True
+    width = max(len(x) for x in current)
+    print(f"{'':<{width}} {'baseline':>10} {'current':>10} {'change':>8}")
+    for name, duration in current.items():
+        base = baseline.get(name)
+        if base is None:
+            print(f"{name:<{width}} {'-':>10} {duration:10.3f} {'new':>8}")
+            continue
+
+        change = (duration - base) / base if base > 0 else 0.0
+        mark = ""
+        if change > tolerance and duration - base > min_delta:
+            mark = "  SLOWER"
+            ok = False
+        elif change < -tolerance and base - duration > min_delta:
+            mark = "  faster"
+        print(f"{name:<{width}} {base:10.3f} {duration:10.3f} {change * 100:+7.1f}%{mark}")
+
+    for name in baseline:
+        if name not in current:
+            print(f"{name:<{width}} {baseline[name]:10.3f} {'-':>10} {'gone':>8}")
+    return ok
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmarks tabun_stat processors on a sqlite3 database")
+    parser.add_argument("path", help="path to sqlite3 database (see tabun_stat.bench.dataset)")
+    parser.add_argument("-c", "--config", help="config file with processors (TOML)", required=True)
+    parser.add_argument("-r", "--repeat", type=int, default=3, help="number of runs (default: %(default)s)")
+    parser.add_argument("-j", "--workers", type=int, default=0, help="number of worker processes")
+    parser.add_argument("--shards", type=int, default=0, help="number of shards for mergeable processors")
+    parser.add_argument("--save", help="save results to this JSON file (to use as baseline later)")
+    parser.add_argument("--baseline", help="compare results with this JSON file")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.1,
+        help="allowed slowdown compared to baseline, fraction (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--min-delta",
+        type=float,
+        default=0.05,
+        help="ignore slowdowns smaller than this many seconds (default: %(default)s)",
+    )
+
+    args = parser.parse_args()
+
+    config = Config.from_file(args.config)
+    db_path = Path(args.path)
+    if not db_path.is_file():
+        print(f"{str(db_path)!r} not found", file=sys.stderr)
+        return 1
+
+    runs: list[dict[str, Any]] = []
+    for i in range(max(1, args.repeat)):
+        perf = run_once(config, db_path, workers=args.workers, shards=args.shards)
+        print(f"Run #{i + 1}: {perf['duration']:.2f}s", file=sys.stderr)
+        runs.append(perf)
+
+    result = summarize(runs)
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as fp:
+            json.dump(result, fp, ensure_ascii=False, indent=2)
+            fp.write("\n")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as fp:
+            baseline = json.load(fp)
+        ok = compare(result, baseline, tolerance=args.tolerance, min_delta=args.min_delta)
+        return 0 if ok else 1
+
+    width = max(len(x) for x in result)
+    for name, duration in result.items():
+        print(f"{name:<{width}} {duration:10.3f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
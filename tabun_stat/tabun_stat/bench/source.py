@@ -0,0 +1,136 @@
+"""Бенчмарк источника данных sqlite3: сколько времени занимает загрузка
+постов и комментов пачками по дням (так, как их загружает TabunStat, если
+источник не умеет iter_messages) и одним потоком через iter_messages.
+
+Все замеры в миллисекундах. Результаты можно сохранить как эталон и сравнить
+с ним так же, как в ``tabun_stat.bench.run``:
+
+    python -m tabun_stat.bench.source bench.sqlite3 --save before.json
+    python -m tabun_stat.bench.source bench.sqlite3 --baseline before.json
+"""
+
+import argparse
+import json
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Any, Callable, Iterator
+
+from tabun_stat.bench.run import compare
+from tabun_stat.datasource.sqlite3 import Sqlite3DataSource
+from tabun_stat.perf import quantile
+
+
+def iter_days(first: datetime, last: datetime) -> Iterator[tuple[datetime, datetime]]:
+    """Границы суток в UTC, покрывающие диапазон от first до last."""
+    day = first.astimezone(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+    while day <= last:
+        yield day, day + timedelta(days=1)
+        day += timedelta(days=1)
+
+
+def bench_days(
+    iter_func: Callable[..., Iterator[list[Any]]],
+    days: list[tuple[datetime, datetime]],
+) -> tuple[list[float], int]:
+    """Загружает данные по дням, возвращает время загрузки каждого дня
+    и общее число загруженных объектов.
+    """
+    durations: list[float] = []
+    count = 0
+    for day_start, day_end in days:
+        filters = {"created_at__gte": day_start, "created_at__lt": day_end}
+        tm = time.perf_counter()
+        for items in iter_func(filters=filters, burst=True):
+            count += len(items)
+        durations.append(time.perf_counter() - tm)
+    return durations, count
+
+
+def run_once(db_path: Path) -> dict[str, float]:
+    """Один прогон на свежем источнике (с пустыми кэшами). Все замеры
+    в миллисекундах.
+    """
+    source = Sqlite3DataSource(path=db_path, read_only=True)
+    source.reconnect()
+    try:
+        result: dict[str, float] = {}
+        for name, iter_func, limits in (
+            ("posts", source.iter_posts, source.get_posts_limits()),
+            ("comments", source.iter_comments, source.get_comments_limits()),
+        ):
+            if limits.first_created_at is None or limits.last_created_at is None:
+                continue
+            days = list(iter_days(limits.first_created_at, limits.last_created_at))
+            durations, count = bench_days(iter_func, days)
+            durations.sort()
+            result[f"{name} by days: total"] = sum(durations) * 1000
+            result[f"{name} by days: median day"] = (quantile(durations, 0.5) or 0.0) * 1000
+            result[f"{name} by days: p99 day"] = (quantile(durations, 0.99) or 0.0) * 1000
+            result[f"{name} by days: per 1000 items"] = sum(durations) * 1000 * 1000 / count if count else 0.0
+
+        tm = time.perf_counter()
+        for _ in source.iter_messages():
+            pass
+        result["iter_messages: total"] = (time.perf_counter() - tm) * 1000
+    finally:
+        source.destroy()
+    return result
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description="Benchmarks loading posts and comments from a sqlite3 database"
+    )
+    parser.add_argument("path", help="path to sqlite3 database (see tabun_stat.bench.dataset)")
+    parser.add_argument("-r", "--repeat", type=int, default=3, help="number of runs (default: %(default)s)")
+    parser.add_argument("--save", help="save results to this JSON file (to use as baseline later)")
+    parser.add_argument("--baseline", help="compare results with this JSON file")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.1,
+        help="allowed slowdown compared to baseline, fraction (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--min-delta",
+        type=float,
+        default=1.0,
+        help="ignore slowdowns smaller than this many milliseconds (default: %(default)s)",
+    )
+
+    args = parser.parse_args()
+
+    db_path = Path(args.path)
+    if not db_path.is_file():
+        print(f"{str(db_path)!r} not found", file=sys.stderr)
+        return 1
+
+    # Для каждого замера берём лучшее время из всех прогонов
+    result: dict[str, float] = {}
+    for i in range(max(1, args.repeat)):
+        tm = time.perf_counter()
+        for name, duration in run_once(db_path).items():
+            result[name] = min(result.get(name, duration), duration)
+        print(f"Run #{i + 1}: {time.perf_counter() - tm:.2f}s", file=sys.stderr)
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as fp:
+            json.dump(result, fp, ensure_ascii=False, indent=2)
+            fp.write("\n")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as fp:
+            baseline = json.load(fp)
+        ok = compare(result, baseline, tolerance=args.tolerance, min_delta=args.min_delta)
+        return 0 if ok else 1
+
+    width = max(len(x) for x in result)
+    for name, duration in result.items():
+        print(f"{name:<{width}} {duration:10.3f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,141 @@
+"""Микробенчмарк деления сообщений на слова в WordsProcessor.
+
+Сравнивает WordsProcessor.split_words со старой реализацией (вырезание
+тегов циклом со склейкой строк, а потом translate) на сообщениях разного
+размера и проверяет, что результат совпадает. Время на килобайт текста
+у линейного алгоритма не должно расти с размером сообщения.
+
+    python -m tabun_stat.bench.tokenizer
+"""
+
+import argparse
+import random
+import sys
+import time
+from typing import Callable
+
+from tabun_stat.processors.words import WordsProcessor
+
+WORDS = ("Привет", "ПОНИ", "Твайлайт", "Спаркл", "мир", "Hello", "world", "42", "ёлка")
+
+# Разные виды сообщений: куски, из которых они склеиваются
+KINDS: dict[str, tuple[str, ...]] = {
+    # Обычный текст почти без разметки
+    "plain": (" ", " ", " ", ", ", ". ", "! ", "\n"),
+    # Разметка через слово: ссылки, картинки, переносы строк, спойлеры
+    "tags": (
+        '<a href="https://tabun.everypony.ru/blog/1.html">',
+        "</a> ",
+        "<br/>",
+        '<img src="https://i.imgur.com/abcdef.png" alt="">',
+        '<span class="spoiler"><span class="spoiler-title">',
+        "</span></span>",
+        " <strong>",
+        "</strong> ",
+    ),
+    # Много «<» без пары (сердечки), тег только в самом начале
+    "hearts": (" <3 ", " <<3 ", ", ", " "),
+}
+
+
+def legacy_split_words(body: str, trans_table: dict[int, int]) -> list[bytes]:
+    """Прежний алгоритм из WordsProcessor._process."""
+    while True:
+        f1 = body.find("<")
+        if f1 < 0:
+            break
+        f2 = body.find(">", f1 + 1)
+        if f2 < 0:
+            break
+        body = body[:f1] + " " + body[f2 + 1 :]
+
+    return body.translate(trans_table).lower().encode("utf-8").split()
+
+
+def make_body(kind: str, size: int, rnd: random.Random) -> str:
+    parts: list[str] = ["<p>"] if kind == "hearts" else []
+    length = 0
+    separators = KINDS[kind]
+    while length < size:
+        word = rnd.choice(WORDS)
+        sep = rnd.choice(separators)
+        parts.append(word)
+        parts.append(sep)
+        length += len(word) + len(sep)
+    return "".join(parts)[:size]
+
+
+def measure(func: Callable[[], object], min_time: float) -> float:
+    """Возвращает среднее время одного вызова в секундах."""
+    count = 0
+    started_at = time.perf_counter()
+    while True:
+        func()
+        count += 1
+        elapsed = time.perf_counter() - started_at
+        if elapsed >= min_time:
+            return elapsed / count
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmarks the WordsProcessor tokenizer")
+    parser.add_argument(
+        "-s",
+        "--sizes",
+        default="1000,10000,100000,1000000",
+        help="comma-separated message sizes in characters (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--legacy-max-size",
+        type=int,
+        default=100000,
+        help="do not run the old quadratic algorithm on larger messages (default: %(default)s)",
+    )
+    parser.add_argument(
+        "-t",
+        "--min-time",
+        type=float,
+        default=0.2,
+        help="minimum measuring time per case in seconds (default: %(default)s)",
+    )
+    parser.add_argument("--seed", type=int, default=1, help="random seed (default: %(default)s)")
+
+    args = parser.parse_args()
+    sizes = [int(x) for x in args.sizes.split(",")]
+
+    processor = WordsProcessor()
+    trans_table = str.maketrans({x: 32 for x in processor.delimiters + processor.whitespaces})
+    rnd = random.Random(args.seed)
+    failed = False
+
+    print(f"{'kind':<8} {'size':>9} {'new, us/KB':>12} {'old, us/KB':>12} {'speedup':>8}")
+    for kind in KINDS:
+        per_kb: list[float] = []
+        for size in sizes:
+            body = make_body(kind, size, rnd)
+            kb = len(body) / 1024
+
+            new_tm = measure(lambda: processor.split_words(body), args.min_time)
+            per_kb.append(new_tm / kb)
+
+            if len(body) <= args.legacy_max_size:
+                if processor.split_words(body) != legacy_split_words(body, trans_table):
+                    print(f"ERROR: {kind}/{size}: results differ", file=sys.stderr)
+                    failed = True
+                old_tm = measure(lambda: legacy_split_words(body, trans_table), args.min_time)
+                old_str = f"{old_tm / kb * 1e6:12.1f}"
+                speedup_str = f"{old_tm / new_tm:7.1f}x"
+            else:
+                old_str = f"{'-':>12}"
+                speedup_str = f"{'-':>8}"
+
+            print(f"{kind:<8} {size:>9} {new_tm / kb * 1e6:12.1f} {old_str} {speedup_str}")
+
+        # У линейного алгоритма время на килобайт примерно постоянное
+        print(f"{kind:<8} growth of time per KB: {max(per_kb) / min(per_kb):.2f}x")
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,89 @@
+import os
+import pickle
+from dataclasses import dataclass, field
+from datetime import datetime
+from pathlib import Path
+from typing import Any
+
+# Меняется при несовместимых изменениях формата файла
+CHECKPOINT_VERSION = 2
+
+
+@dataclass(slots=True)
+class Checkpoint:
+    """Сохранённое состояние обработчиков, работу которых можно продолжить
+    (см. processors.base.can_resume), после обработки всех данных
+    до определённой даты. Позволяет в следующий раз обработать этими
+    обработчиками только новые данные.
+    """
+
+    # Минимальная дата постов и комментов, с которой считалась статистика
+    min_date: datetime | None
+    # Дата, до которой обработаны посты и комменты и зарегистрированные
+    # пользователи (не включительно)
+    max_date: datetime
+    # Часовой пояс (влияет на статистику многих обработчиков)
+    tz: str
+    # Полные имена классов обработчиков в том порядке, в котором они
+    # добавлены в TabunStat
+    processors: list[str] = field(default_factory=list)
+    # Параметры, с которыми были созданы обработчики (см. add_processor
+    # у TabunStat)
+    params: list[dict[str, Any]] = field(default_factory=list)
+    # Состояния обработчиков (результат export_state), сериализованные pickle
+    states: list[bytes] = field(default_factory=list)
+
+    version: int = CHECKPOINT_VERSION
+
+    def check_compatible(
+        self,
+        min_date: datetime | None,
+        tz: str,
+        processors: list[str],
+        params: list[dict[str, Any]],
+    ) -> None:
+        """Проверяет, что контрольную точку можно использовать с текущими
+        настройками. Если нельзя, выбрасывает ValueError.
+        """
+        if self.version != CHECKPOINT_VERSION:
+            raise ValueError(f"Unsupported checkpoint version {self.version}")
+        if self.min_date != min_date:
+            raise ValueError(f"Checkpoint min_date {self.min_date} does not match min_date {min_date}")
+        if self.tz != tz:
+            raise ValueError(f"Checkpoint timezone {self.tz!r} does not match timezone {tz!r}")
+        if self.processors != processors:
+            raise ValueError(
+                "Checkpoint processors do not match configured processors: "
+                f"{', '.join(self.processors)} != {', '.join(processors)}"
+            )
+        for name, old_params, new_params in zip(processors, self.params, params):
+            if old_params != new_params:
+                raise ValueError(
+                    f"Checkpoint parameters of processor {name} do not match configured parameters: "
+                    f"{old_params!r} != {new_params!r}"
+                )
+
+
+def get_processor_name(processor: object) -> str:
+    cls = type(processor)
+    return f"{cls.__module__}.{cls.__qualname__}"
+
+
+def load_checkpoint(path: str | Path) -> Checkpoint:
+    with open(path, "rb") as fp:
+        checkpoint = pickle.load(fp)
+    if not isinstance(checkpoint, Checkpoint):
+        raise ValueError(f"{str(path)!r} is not a checkpoint file")
+    return checkpoint
+
+
+def save_checkpoint(path: str | Path, checkpoint: Checkpoint) -> None:
+    # Пишем во временный файл и потом переименовываем, чтобы прерванная
+    # запись не испортила предыдущую контрольную точку
+    path = Path(path)
+    tmp_path = path.with_name(path.name + ".tmp")
+    with tmp_path.open("wb") as fp:
+        pickle.dump(checkpoint, fp, protocol=pickle.HIGHEST_PROTOCOL)
+        fp.flush()
+        os.fsync(fp.fileno())
+    os.replace(tmp_path, path)
@@ -13,6 +13,14 @@ class Config:
     min_date: datetime | None = None
     max_date: datetime | None = None
     timezone: str = "Europe/Moscow"
+    workers: int = 0
+    shards: int = 0
+    checkpoint: str = ""
+    prefetch_threads: int = 1
+    prefetch_queue_size: int = 4
+    prefetch_rows: int = 10000
+    output_compression: str = ""
+    parquet_tables: bool = False
 
     @staticmethod
     def from_file(path: str | Path) -> "Config":
@@ -4,6 +4,7 @@ import typing
 from typing import Any, Collection, Iterator
 
 from tabun_stat import types
+from tabun_stat.datasource.cache import CacheStats
 from tabun_stat.utils import filter_act, filter_split
 
 if typing.TYPE_CHECKING:
@@ -21,6 +22,12 @@ class BaseDataSource:
     def destroy(self) -> None:
         pass
 
+    def get_cache_stats(self) -> dict[str, CacheStats]:
+        """Возвращает статистику внутренних кэшей источника (попадания
+        и промахи) по их названиям для отчёта о производительности.
+        """
+        return {}
+
     # Табунчане
 
     def get_user_by_id(self, user_id: int) -> types.User:
@@ -67,6 +74,18 @@ class BaseDataSource:
         """Возвращает имя пользователя по его id."""
         return self.get_user_by_id(user_id).username
 
+    def get_usernames_by_ids(self, user_ids: Collection[int]) -> dict[int, str]:
+        """Возвращает имена пользователей по их id. Если пользователь
+        не существует, то в итоговом словаре его вообще не будет.
+        """
+        result = {}
+        for user_id in user_ids:
+            try:
+                result[user_id] = self.get_username_by_user_id(user_id)
+            except DataNotFound:
+                pass
+        return result
+
     def get_users_limits(self, filters: dict[str, Any] | None = None) -> types.UsersLimits:
         """Возвращает статистику о существующих пользователях. Если указаны
         фильтры, то с учётом их ограничений.
@@ -244,6 +263,10 @@ class BaseDataSource:
           ``created_at__gte``: аналогично для времени создания коммента
           (datetime)
 
+        Если поста коммента нет в базе, то у коммента blog_id и blog_status
+        равны None. Если пост есть, но его блога нет, то blog_id — id блога
+        из поста, а blog_status — None (блог неизвестен).
+
         Параметр burst — подсказка, что вызывающая сторона предполагает, что
         комментов в результате должно быть немного и можно выдать их все за раз.
         Это позволяет, например, использовать более оптимальный SQL-запрос.
@@ -276,3 +299,27 @@ class BaseDataSource:
         фильтры, то с учётом их ограничений.
         """
         raise NotImplementedError
+
+    # Посты и комменты вместе
+
+    def iter_messages(
+        self,
+        *,
+        filters: dict[str, Any] | None = None,
+        chunk_size: int = 10000,
+    ) -> Iterator[list[types.Post | types.Comment]]:
+        """По очереди yield'ит посты и комменты вперемешку, отсортированные
+        по времени создания (при совпадении времени сперва посты, потом
+        комменты, и дальше по id). Поддерживаются только фильтры
+        ``created_at__lt``, ``created_at__lte``, ``created_at__gt``
+        и ``created_at__gte``. Каждый yield'имый список содержит примерно
+        chunk_size сообщений.
+
+        Метод необязательный: если источник может отдать посты и комменты
+        одним упорядоченным потоком (например, одним SQL-запросом), то это
+        избавляет от запросов по дням и сортировки в Python. Стандартная
+        реализация (не генератор!) сразу выбрасывает NotImplementedError,
+        и тогда tabun_stat загружает посты и комменты по дням через
+        iter_posts и iter_comments.
+        """
+        raise NotImplementedError
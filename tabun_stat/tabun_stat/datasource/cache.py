@@ -0,0 +1,146 @@
+import array
+from collections import OrderedDict
+from dataclasses import dataclass
+from threading import Lock
+from typing import Any, Generic, TypeVar
+
+K = TypeVar("K")
+V = TypeVar("V")
+
+# Посты с id больше этого хранятся в обычном словаре, а не в массиве
+# (на случай очень разреженных id, чтобы массив не разрастался)
+MAX_DENSE_POST_ID = 1 << 24
+
+# Сколько имён пользователей помнят источники данных
+USERNAMES_CACHE_SIZE = 10000
+
+# Значения в массиве PostBlogsMap (кроме id блогов и -1)
+_UNKNOWN = -2  # блог поста ещё не запрашивался
+_PERSONAL = 0  # личный блог (blog_id is None)
+_INT32_MAX = 2**31 - 1
+
+
+@dataclass(slots=True)
+class CacheStats:
+    """Статистика использования кэша источника данных."""
+
+    hits: int = 0
+    misses: int = 0
+    # Сколько записей сейчас в кэше
+    size: int = 0
+    # Максимальное число записей (None — не ограничено)
+    capacity: int | None = None
+
+    @property
+    def hit_rate(self) -> float | None:
+        total = self.hits + self.misses
+        return self.hits / total if total else None
+
+
+class PostBlogsMap:
+    """Блоги постов по их id. Id постов идут почти подряд, поэтому они
+    хранятся в массиве int32 по id поста (4 байта на пост вместо ~100 байт
+    на запись в словаре). Поддерживает ту же часть интерфейса словаря,
+    что использовалась раньше: значение None — личный блог, -1 — поста
+    не существует; отсутствие в кэше — KeyError.
+    """
+
+    def __init__(self) -> None:
+        self._blogs = array.array("i")
+        self._sparse: dict[int, int | None] = {}
+        self._size = 0
+        self.stats = CacheStats()
+
+    def __len__(self) -> int:
+        return self._size + len(self._sparse)
+
+    def __contains__(self, post_id: int) -> bool:
+        if 0 <= post_id < len(self._blogs):
+            return self._blogs[post_id] != _UNKNOWN
+        return post_id in self._sparse
+
+    def __getitem__(self, post_id: int) -> int | None:
+        if 0 <= post_id < len(self._blogs):
+            value = self._blogs[post_id]
+            if value != _UNKNOWN:
+                self.stats.hits += 1
+                return value if value != _PERSONAL else None
+        elif post_id in self._sparse:
+            self.stats.hits += 1
+            return self._sparse[post_id]
+
+        self.stats.misses += 1
+        raise KeyError(post_id)
+
+    def __setitem__(self, post_id: int, blog_id: int | None) -> None:
+        # Всё, что не помещается в массив как есть, кладём в словарь
+        if not 0 <= post_id < MAX_DENSE_POST_ID or not (
+            blog_id is None or blog_id == -1 or 0 < blog_id <= _INT32_MAX
+        ):
+            self._sparse[post_id] = blog_id
+            return
+
+        if post_id >= len(self._blogs):
+            # Растём с запасом, чтобы не копировать массив на каждый новый пост
+            size = min(MAX_DENSE_POST_ID, max(post_id + 1, len(self._blogs) * 3 // 2))
+            self._blogs.extend(array.array("i", [_UNKNOWN]) * (size - len(self._blogs)))
+        if self._blogs[post_id] == _UNKNOWN:
+            self._size += 1
+        self._blogs[post_id] = blog_id if blog_id is not None else _PERSONAL
+
+    def get_stats(self) -> CacheStats:
+        self.stats.size = len(self)
+        return self.stats
+
+
+class LRUCache(Generic[K, V]):
+    """Словарь ограниченного размера: при переполнении выбрасываются
+    записи, которые дольше всего не запрашивались. Им могут пользоваться
+    несколько потоков сразу.
+    """
+
+    def __init__(self, capacity: int):
+        if capacity <= 0:
+            raise ValueError("capacity must be positive")
+        self.capacity = capacity
+        self._items: OrderedDict[K, V] = OrderedDict()
+        self._lock = Lock()
+        self.stats = CacheStats(capacity=capacity)
+
+    def __getstate__(self) -> dict[str, Any]:
+        # Блокировку нельзя передать в другой процесс
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state: dict[str, Any]) -> None:
+        self.__dict__.update(state)
+        self._lock = Lock()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def __contains__(self, key: K) -> bool:
+        return key in self._items
+
+    def __getitem__(self, key: K) -> V:
+        with self._lock:
+            try:
+                value = self._items[key]
+            except KeyError:
+                self.stats.misses += 1
+                raise
+            self._items.move_to_end(key)
+            self.stats.hits += 1
+            return value
+
+    def __setitem__(self, key: K, value: V) -> None:
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            if len(self._items) > self.capacity:
+                self._items.popitem(last=False)
+
+    def get_stats(self) -> CacheStats:
+        self.stats.size = len(self)
+        return self.stats
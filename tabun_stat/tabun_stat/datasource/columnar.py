@@ -0,0 +1,505 @@
+import array
+import heapq
+import json
+import mmap
+import os
+import shutil
+import sys
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timezone
+from itertools import chain
+from pathlib import Path
+from typing import Any, Iterator, Sequence
+
+from tabun_stat import types
+from tabun_stat.datasource.sqlite3 import Sqlite3DataSource, _parse_utc_datetime
+from tabun_stat.stat import TabunStat
+from tabun_stat.utils import filter_act, filter_split
+
+# Меняется при несовместимых изменениях формата кэша
+CACHE_VERSION = 1
+
+# Значение, которым в колонках хранится NULL
+NULL = -(2**63)
+
+# Числовые колонки и текстовые колонки (в виде смещений в общем блобе)
+POST_COLUMNS = (
+    "id",
+    "created_at",
+    "author_id",
+    "blog_id",
+    "blog_status",
+    "vote_count",
+    "vote_value",
+    "favorites_count",
+)
+POST_TEXT_COLUMNS = ("title", "body", "tags")
+
+COMMENT_COLUMNS = (
+    "id",
+    "created_at",
+    "author_id",
+    "post_id",
+    "blog_id",
+    "blog_status",
+    "parent_id",
+    "vote_value",
+    "favorites_count",
+)
+COMMENT_TEXT_COLUMNS = ("body",)
+
+
+class ColumnarTable:
+    """Таблица, хранящаяся по колонкам в отдельных файлах и отображаемая
+    в память через mmap. Строки отсортированы по (created_at, id), что
+    позволяет искать диапазоны дат бинарным поиском.
+
+    Числовые колонки — массивы int64 (даты хранятся как unix timestamp
+    в секундах), текстовые колонки — массивы смещений концов текстов в общем
+    UTF-8 блобе (с нулём в начале, поэтому длиной на один элемент больше
+    числа строк).
+    """
+
+    def __init__(self, path: Path, name: str, columns: Sequence[str], text_columns: Sequence[str]):
+        self.path = path
+        self.name = name
+        self.columns = tuple(columns)
+        self.text_columns = tuple(text_columns)
+
+        self.count = 0
+        self.data: dict[str, Sequence[int]] = {}
+        self.offsets: dict[str, Sequence[int]] = {}
+        self.blob: bytes | mmap.mmap = b""
+
+        self._mmaps: list[mmap.mmap] = []
+        self._views: list[memoryview] = []
+
+    def _column_path(self, column: str) -> Path:
+        return self.path / f"{self.name}.{column}.bin"
+
+    def _blob_path(self) -> Path:
+        return self.path / f"{self.name}.blob"
+
+    def _map(self, path: Path) -> mmap.mmap | None:
+        with path.open("rb") as fp:
+            if os.fstat(fp.fileno()).st_size == 0:
+                return None  # Пустой файл отобразить в память нельзя
+            mm = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        self._mmaps.append(mm)
+        return mm
+
+    def _map_int64(self, path: Path) -> Sequence[int]:
+        mm = self._map(path)
+        if mm is None:
+            return array.array("q")
+        view = memoryview(mm).cast("q")
+        self._views.append(view)
+        return view
+
+    def open(self) -> None:
+        self.close()
+        for column in self.columns:
+            self.data[column] = self._map_int64(self._column_path(column))
+        for column in self.text_columns:
+            self.offsets[column] = self._map_int64(self._column_path(column))
+        self.blob = self._map(self._blob_path()) or b""
+        self.count = len(self.data["id"])
+
+    def close(self) -> None:
+        # memoryview нужно отпустить до закрытия mmap, иначе будет BufferError
+        for view in self._views:
+            view.release()
+        self._views.clear()
+        for mm in self._mmaps:
+            mm.close()
+        self._mmaps.clear()
+        self.data.clear()
+        self.offsets.clear()
+        self.blob = b""
+        self.count = 0
+
+    def write(self, rows: Iterator[list[tuple[Any, ...]]]) -> int:
+        """Записывает строки в файлы колонок. Каждая строка — кортеж из
+        числовых колонок (None означает NULL) и затем текстовых колонок
+        в порядке, указанном при создании таблицы. Строки должны быть уже
+        отсортированы. Возвращает число записанных строк.
+        """
+        files = [self._column_path(c).open("wb") for c in self.columns + self.text_columns]
+        blob_fp = self._blob_path().open("wb")
+        count = 0
+        blob_offset = 0
+
+        try:
+            ncols = len(self.columns)
+            # Начальные смещения текстовых колонок
+            for fp in files[ncols:]:
+                array.array("q", [0]).tofile(fp)
+
+            for chunk in rows:
+                buffers = [array.array("q") for _ in files]
+                blob_parts: list[bytes] = []
+                for row in chunk:
+                    for i in range(ncols):
+                        value = row[i]
+                        buffers[i].append(NULL if value is None else value)
+                    for i in range(ncols, len(files)):
+                        data = (row[i] or "").encode("utf-8")
+                        blob_parts.append(data)
+                        blob_offset += len(data)
+                        buffers[i].append(blob_offset)
+                for fp, buf in zip(files, buffers):
+                    buf.tofile(fp)
+                blob_fp.write(b"".join(blob_parts))
+                count += len(chunk)
+
+        finally:
+            for fp in files:
+                fp.close()
+            blob_fp.close()
+
+        return count
+
+    def get_text(self, column: str, idx: int) -> str:
+        # Тексты строки лежат в блобе подряд, поэтому начало текста — это
+        # конец предыдущей текстовой колонки этой же строки (или последней
+        # колонки предыдущей строки)
+        pos = self.text_columns.index(column)
+        if pos > 0:
+            start = self.offsets[self.text_columns[pos - 1]][idx + 1]
+        else:
+            start = self.offsets[self.text_columns[-1]][idx]
+        return self.blob[start : self.offsets[column][idx + 1]].decode("utf-8")
+
+    def find_range(
+        self, filters: dict[str, Any] | None
+    ) -> tuple[int, int, list[tuple[Sequence[int], str, Any]]]:
+        """Переводит фильтры в диапазон строк [lo, hi) по дате и список
+        остальных условий, которые нужно проверять для каждой строки.
+        """
+        lo, hi = 0, self.count
+        conditions: list[tuple[Sequence[int], str, Any]] = []
+
+        for k, v in (filters or {}).items():
+            key, act = filter_split(k)
+            if key.startswith(self.name[:-1] + "_"):
+                # Правильное имя для первичного ключа (post_id -> id)
+                key = key[len(self.name[:-1]) + 1 :]
+            if key not in self.data:
+                raise ValueError(f"Invalid {self.name[:-1]} filter: {k!r}")
+            if isinstance(v, datetime):
+                v = v.timestamp()
+
+            if key == "created_at":
+                created_at = self.data["created_at"]
+                if act == "gte":
+                    lo = max(lo, bisect_left(created_at, v, lo, hi))
+                elif act == "gt":
+                    lo = max(lo, bisect_right(created_at, v, lo, hi))
+                elif act == "lt":
+                    hi = min(hi, bisect_left(created_at, v, lo, hi))
+                elif act == "lte":
+                    hi = min(hi, bisect_right(created_at, v, lo, hi))
+                else:
+                    raise ValueError(f"Invalid {self.name[:-1]} filter: {k!r}")
+                hi = max(lo, hi)
+            else:
+                filter_act(act, 0, 0)  # Проверка правильности операции
+                conditions.append((self.data[key], act, v))
+
+        return lo, hi, conditions
+
+    def iter_indexes(self, filters: dict[str, Any] | None, *, chunk_size: int) -> Iterator[list[int]]:
+        """Yield'ит номера подходящих под фильтры строк пачками."""
+        lo, hi, conditions = self.find_range(filters)
+        for start in range(lo, hi, chunk_size):
+            indexes = range(start, min(hi, start + chunk_size))
+            if not conditions:
+                yield list(indexes)
+                continue
+            result = [
+                i
+                for i in indexes
+                if all(column[i] != NULL and filter_act(act, column[i], v) for column, act, v in conditions)
+            ]
+            if result:
+                yield result
+
+
+class ColumnarCacheDataSource(Sqlite3DataSource):
+    """Источник данных, который при первом запуске один раз выгружает посты
+    и комменты из sqlite3 базы данных в колоночный кэш и дальше отдаёт их
+    оттуда без SQL-запросов и без парсинга дат. Статусы блогов комментов
+    вычисляются при построении кэша. Пользователи и блоги по-прежнему
+    читаются из базы данных.
+
+    Кэш перестраивается автоматически, если у файла базы данных (или у его
+    файла -wal) изменились размер или время изменения, а также если
+    изменились максимальные id постов или комментов.
+    """
+
+    def __init__(self, *, path: str | Path, cache_path: str | Path | None = None, **kwargs: Any):
+        """
+        :param path: путь к sqlite3 базе данных
+        :param cache_path: каталог для кэша (по умолчанию рядом с базой данных
+          с суффиксом ``.columns``)
+        :param kwargs: параметры подключения к базе данных (read_only,
+          mmap_size и т.п., см. Sqlite3DataSource)
+        """
+        # Посты и комменты по датам из базы данных не выбираются,
+        # поэтому индексы для этого не нужны
+        super().__init__(path=path, **kwargs)
+        self._indexes_checked = True
+        self._cache_path = Path(cache_path) if cache_path is not None else Path(str(path) + ".columns")
+
+        self._posts = ColumnarTable(self._cache_path, "posts", POST_COLUMNS, POST_TEXT_COLUMNS)
+        self._comments = ColumnarTable(self._cache_path, "comments", COMMENT_COLUMNS, COMMENT_TEXT_COLUMNS)
+
+    def close(self) -> None:
+        if hasattr(self, "_posts"):
+            self._posts.close()
+            self._comments.close()
+        super().close()
+
+    def __getstate__(self) -> dict[str, Any]:
+        # Отображённые в память файлы откроются заново в методе start
+        state = super().__getstate__()
+        state["_posts"] = ColumnarTable(self._cache_path, "posts", POST_COLUMNS, POST_TEXT_COLUMNS)
+        state["_comments"] = ColumnarTable(
+            self._cache_path, "comments", COMMENT_COLUMNS, COMMENT_TEXT_COLUMNS
+        )
+        return state
+
+    def start(self, stat: TabunStat) -> None:
+        super().start(stat)
+        if self._posts.data:
+            return  # Кэш уже открыт
+
+        if not self._is_cache_valid():
+            stat.log(1, f"Building columnar cache {str(self._cache_path)!r}...")
+            self._build_cache()
+
+        self._posts.open()
+        self._comments.open()
+
+    # Построение кэша
+
+    def _get_source_meta(self) -> dict[str, Any]:
+        st = os.stat(self._path)
+        meta: dict[str, Any] = {
+            "version": CACHE_VERSION,
+            "byteorder": sys.byteorder,
+            "sqlite_size": st.st_size,
+            "sqlite_mtime_ns": st.st_mtime_ns,
+            "wal_size": None,
+            "wal_mtime_ns": None,
+        }
+
+        # В режиме WAL изменения пишутся сначала в файл -wal, а сам файл
+        # базы данных не меняется до чекпойнта
+        try:
+            wal_st = os.stat(str(self._path) + "-wal")
+        except FileNotFoundError:
+            pass
+        else:
+            meta["wal_size"] = wal_st.st_size
+            meta["wal_mtime_ns"] = wal_st.st_mtime_ns
+
+        # И на всякий случай последние id (например, если файл скопирован
+        # с сохранением времени изменения). PRAGMA data_version тут
+        # не подходит: она сравнима только в пределах одного соединения
+        meta["posts_max_id"] = self.fetchall("select max(id) from posts")[0][0]
+        meta["comments_max_id"] = self.fetchall("select max(id) from comments")[0][0]
+        return meta
+
+    def _is_cache_valid(self) -> bool:
+        try:
+            with (self._cache_path / "meta.json").open("r", encoding="utf-8") as fp:
+                meta = json.load(fp)
+        except (OSError, ValueError):
+            return False
+        source_meta = self._get_source_meta()
+        return all(meta.get(k) == v for k, v in source_meta.items())
+
+    def _build_cache(self) -> None:
+        # Собираем во временном каталоге и потом переименовываем, чтобы
+        # прерванная сборка не оставила после себя битый кэш
+        tmp_path = self._cache_path.with_name(self._cache_path.name + ".tmp")
+        if tmp_path.exists():
+            shutil.rmtree(tmp_path)
+        tmp_path.mkdir(parents=True)
+
+        meta = self._get_source_meta()
+
+        posts = ColumnarTable(tmp_path, "posts", POST_COLUMNS, POST_TEXT_COLUMNS)
+        meta["posts_count"] = posts.write(
+            self._iter_rows(
+                "select id, created_at, author_id, blog_id, blog_status, vote_count, vote_value, "
+                "favorites_count, title, body, tags from posts order by created_at, id"
+            )
+        )
+
+        # Блог коммента определяется через его пост; если поста нет,
+        # то блог и его статус неизвестны (NULL)
+        comments = ColumnarTable(tmp_path, "comments", COMMENT_COLUMNS, COMMENT_TEXT_COLUMNS)
+        meta["comments_count"] = comments.write(
+            self._iter_rows(
+                "select c.id, c.created_at, c.author_id, c.post_id, p.blog_id, "
+                "case when p.id is null then null when p.blog_id is null then 0 else b.status end, "
+                "c.parent_id, c.vote_value, c.favorites_count, c.body "
+                "from comments c left join posts p on p.id = c.post_id left join blogs b on b.id = p.blog_id "
+                "order by c.created_at, c.id"
+            )
+        )
+
+        with (tmp_path / "meta.json").open("w", encoding="utf-8") as fp:
+            json.dump(meta, fp)
+
+        if self._cache_path.exists():
+            shutil.rmtree(self._cache_path)
+        tmp_path.rename(self._cache_path)
+
+    def _iter_rows(self, sql: str, chunk_size: int = 10000) -> Iterator[list[tuple[Any, ...]]]:
+        cur = self._execute(sql)
+        try:
+            while True:
+                rows = cur.fetchmany(chunk_size)
+                if not rows:
+                    break
+                # Даты переводим в timestamp (второй столбец)
+                yield [(r[0], int(_parse_utc_datetime(r[1]).timestamp())) + r[2:] for r in rows]
+        finally:
+            cur.close()
+
+    # Посты
+
+    def iter_posts(
+        self,
+        *,
+        filters: dict[str, Any] | None = None,
+        burst: bool = False,
+    ) -> Iterator[list[types.Post]]:
+        table = self._posts
+        cols = [table.data[c] for c in POST_COLUMNS]
+        chunk_size = table.count if burst else 1000
+
+        for indexes in table.iter_indexes(filters, chunk_size=max(1, chunk_size)):
+            result = []
+            for i in indexes:
+                post_id, created_at, author_id, blog_id, blog_status, vote_count, vote_value, fav = (
+                    c[i] for c in cols
+                )
+                result.append(
+                    types.Post(
+                        id=post_id,
+                        created_at=datetime.fromtimestamp(created_at, timezone.utc),
+                        author_id=author_id,
+                        blog_id=blog_id if blog_id != NULL else None,
+                        blog_status=blog_status,
+                        title=table.get_text("title", i),
+                        vote_count=vote_count,
+                        vote_value=vote_value if vote_value != NULL else None,
+                        body=table.get_text("body", i),
+                        tags=table.get_text("tags", i).split(","),
+                        favorites_count=fav,
+                    )
+                )
+            yield result
+
+    def get_posts_limits(self, filters: dict[str, Any] | None = None) -> types.PostsLimits:
+        return types.PostsLimits(**self._get_limits(self._posts, filters))
+
+    # Комменты
+
+    def iter_comments(
+        self,
+        *,
+        filters: dict[str, Any] | None = None,
+        burst: bool = False,
+    ) -> Iterator[list[types.Comment]]:
+        table = self._comments
+        cols = [table.data[c] for c in COMMENT_COLUMNS]
+        chunk_size = table.count if burst else 10000
+
+        for indexes in table.iter_indexes(filters, chunk_size=max(1, chunk_size)):
+            result = []
+            for i in indexes:
+                comment_id, created_at, author_id, post_id, blog_id, blog_status, parent_id, vote, fav = (
+                    c[i] for c in cols
+                )
+                result.append(
+                    types.Comment(
+                        id=comment_id,
+                        created_at=datetime.fromtimestamp(created_at, timezone.utc),
+                        author_id=author_id,
+                        post_id=post_id if post_id != NULL else None,
+                        blog_id=blog_id if blog_id != NULL else None,
+                        blog_status=blog_status if blog_status != NULL else None,
+                        parent_id=parent_id if parent_id != NULL else None,
+                        vote_value=vote,
+                        body=table.get_text("body", i),
+                        favorites_count=fav,
+                    )
+                )
+            yield result
+
+    def get_comments_limits(self, filters: dict[str, Any] | None = None) -> types.CommentsLimits:
+        return types.CommentsLimits(**self._get_limits(self._comments, filters))
+
+    # Посты и комменты вместе
+
+    def iter_messages(
+        self,
+        *,
+        filters: dict[str, Any] | None = None,
+        chunk_size: int = 10000,
+    ) -> Iterator[list[types.Post | types.Comment]]:
+        # Обе таблицы уже отсортированы по (created_at, id), так что
+        # достаточно слить их вместе
+        messages: Iterator[types.Post | types.Comment] = heapq.merge(
+            chain.from_iterable(self.iter_posts(filters=filters)),
+            chain.from_iterable(self.iter_comments(filters=filters)),
+            key=lambda x: (x.created_at, isinstance(x, types.Comment), x.id),
+        )
+
+        result: list[types.Post | types.Comment] = []
+        for message in messages:
+            result.append(message)
+            if len(result) >= chunk_size:
+                yield result
+                result = []
+        if result:
+            yield result
+
+    def _get_limits(self, table: ColumnarTable, filters: dict[str, Any] | None) -> dict[str, Any]:
+        ids = table.data["id"]
+        created_at = table.data["created_at"]
+
+        lo, hi, conditions = table.find_range(filters)
+        if not conditions:
+            # Частый случай: фильтр только по датам, id смотрим срезом
+            count = hi - lo
+            first_id = min(ids[lo:hi]) if count else None
+            last_id = max(ids[lo:hi]) if count else None
+            first_idx, last_idx = lo, hi - 1
+        else:
+            count = 0
+            first_id = last_id = None
+            first_idx = last_idx = -1
+            for indexes in table.iter_indexes(filters, chunk_size=100000):
+                count += len(indexes)
+                chunk_ids = [ids[i] for i in indexes]
+                first_id = min(chunk_ids) if first_id is None else min(first_id, min(chunk_ids))
+                last_id = max(chunk_ids) if last_id is None else max(last_id, max(chunk_ids))
+                if first_idx < 0:
+                    first_idx = indexes[0]
+                last_idx = indexes[-1]
+
+        return {
+            "count": count,
+            "first_id": first_id,
+            "last_id": last_id,
+            "first_created_at": (
+                datetime.fromtimestamp(created_at[first_idx], timezone.utc) if count else None
+            ),
+            "last_created_at": datetime.fromtimestamp(created_at[last_idx], timezone.utc) if count else None,
+        }
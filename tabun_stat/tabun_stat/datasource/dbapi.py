@@ -0,0 +1,557 @@
+from datetime import date, datetime, timezone
+from threading import Lock, local
+from typing import Any, Collection, Iterator
+
+from tabun_stat import types
+from tabun_stat.datasource.base import BaseDataSource, DataNotFound
+from tabun_stat.datasource.cache import USERNAMES_CACHE_SIZE, CacheStats, LRUCache, PostBlogsMap
+from tabun_stat.stat import TabunStat
+from tabun_stat.utils import filter_split
+
+# Сколько id подставлять в один запрос при выборке по списку id
+IDS_CHUNK_SIZE = 1000
+
+
+class DBAPIDataSource(BaseDataSource):
+    """Общая часть источников данных для серверных СУБД, драйверы которых
+    следуют DB-API 2.0 и принимают параметры запросов в виде ``%s``.
+    Ожидается та же схема таблиц, что и в demo.sql; время хранится в UTC.
+
+    У каждого потока два соединения: обычное (в режиме autocommit) для
+    мелких запросов и отдельное для потокового чтения больших выборок, чтобы
+    не держать открытую транзакцию и не блокировать мелкие запросы (например,
+    за блогами постов) во время чтения. Наследники реализуют подключение
+    (_connect) и курсор, читающий результат с сервера по частям
+    (_stream_cursor).
+    """
+
+    # Кавычки для имён колонок
+    identifier_quote = '"'
+
+    def __init__(self, *, chunk_size: int = 10000):
+        """
+        :param chunk_size: сколько строк забирать с сервера за раз при
+          потоковом чтении пользователей, постов и комментов
+        """
+        self.chunk_size = max(1, chunk_size)
+
+        self._connected = False
+        self._connections: list[Any] = []
+        self._local = local()
+        self._lock = Lock()
+
+        # Кэш статусов блогов по их id
+        self._blog_status_by_id: dict[int, int] = {}
+        # Кэш блогов постов (массив по id поста)
+        self._post_blogs = PostBlogsMap()
+        # Кэш имён пользователей по их id; основную часть имён TabunStat
+        # берёт из stat.users, так что хватает небольшого кэша
+        self._usernames: LRUCache[int, str] = LRUCache(USERNAMES_CACHE_SIZE)
+
+    def close(self) -> None:
+        with self._lock:
+            self._connected = False
+            for conn in self._connections:
+                try:
+                    conn.close()
+                except Exception:  # pylint: disable=broad-exception-caught
+                    pass
+            self._connections.clear()
+            self._local = local()
+
+    def destroy(self) -> None:
+        self.close()
+
+    def __del__(self) -> None:
+        self.close()
+
+    def get_cache_stats(self) -> dict[str, CacheStats]:
+        return {
+            "post_blogs": self._post_blogs.get_stats(),
+            "usernames": self._usernames.get_stats(),
+        }
+
+    def __getstate__(self) -> dict[str, Any]:
+        # Соединения и блокировку нельзя передать в другой процесс,
+        # там источник подключится заново в методе start
+        state = self.__dict__.copy()
+        state["_connected"] = False
+        state["_connections"] = []
+        del state["_local"]
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state: dict[str, Any]) -> None:
+        self.__dict__.update(state)
+        self._local = local()
+        self._lock = Lock()
+
+    def reconnect(self) -> None:
+        self.close()
+        with self._lock:
+            self._connected = True
+
+        # Подключаемся сразу, чтобы ошибки подключения были видны здесь,
+        # а не при первом запросе
+        try:
+            self._get_conn()
+        except Exception:
+            self.close()
+            raise
+
+        self._fetch_blog_info()
+
+    def start(self, stat: TabunStat) -> None:
+        if not self._connected:
+            self.reconnect()
+
+    def _fetch_blog_info(self) -> None:
+        blogs_status = self.fetchall("select id, status from blogs")
+        with self._lock:
+            self._blog_status_by_id = dict(blogs_status)
+
+    # Соединения и запросы
+
+    def _connect(self, *, autocommit: bool) -> Any:
+        """Создаёт новое соединение с базой данных. Сессия должна работать
+        в часовом поясе UTC.
+        """
+        raise NotImplementedError
+
+    def _stream_cursor(self, conn: Any) -> Any:
+        """Создаёт курсор, который не загружает результат запроса в память
+        целиком, а забирает его с сервера по частям при вызовах fetchmany.
+        """
+        raise NotImplementedError
+
+    def _get_conn(self, *, stream: bool = False) -> Any:
+        attr = "stream_conn" if stream else "conn"
+        conn = getattr(self._local, attr, None)
+        if conn is not None:
+            return conn
+
+        with self._lock:
+            if not self._connected:
+                raise RuntimeError("Not connected")
+            conn = self._connect(autocommit=not stream)
+            self._connections.append(conn)
+            setattr(self._local, attr, conn)
+        return conn
+
+    def fetchall(self, sql: str, args: tuple[Any, ...] = ()) -> list[tuple[Any, ...]]:
+        cur = self._get_conn().cursor()
+        try:
+            cur.execute(sql, args)
+            return list(cur.fetchall())
+        finally:
+            cur.close()
+
+    def fetchall_dict(self, sql: str, args: tuple[Any, ...] = ()) -> list[dict[str, Any]]:
+        cur = self._get_conn().cursor()
+        try:
+            cur.execute(sql, args)
+            colnames = [x[0] for x in cur.description]
+            return [dict(zip(colnames, x)) for x in cur.fetchall()]
+        finally:
+            cur.close()
+
+    def stream_dict(
+        self,
+        sql: str,
+        args: tuple[Any, ...] = (),
+        *,
+        chunk_size: int | None = None,
+    ) -> Iterator[list[dict[str, Any]]]:
+        """Выполняет запрос и yield'ит его результат пачками по chunk_size
+        строк (по умолчанию self.chunk_size), не загружая его в память
+        целиком. Такие запросы в одном потоке нельзя вкладывать друг в друга.
+        """
+        chunk_size = max(1, chunk_size or self.chunk_size)
+        if getattr(self._local, "streaming", False):
+            raise RuntimeError("Nested streaming queries are not supported")
+
+        conn = self._get_conn(stream=True)
+        self._local.streaming = True
+        try:
+            cur = self._stream_cursor(conn)
+            try:
+                cur.execute(sql, args)
+                colnames: list[str] | None = None
+                while True:
+                    rows = cur.fetchmany(chunk_size)
+                    if not rows:
+                        break
+                    # Некоторые драйверы заполняют description только после
+                    # первого fetch у серверного курсора
+                    if colnames is None:
+                        colnames = [x[0] for x in cur.description]
+                    yield [dict(zip(colnames, x)) for x in rows]
+            finally:
+                cur.close()
+                # Заканчиваем транзакцию, в которой жил курсор
+                conn.rollback()
+        finally:
+            self._local.streaming = False
+
+    def _ids_condition(self, column: str, ids: list[int]) -> tuple[str, tuple[Any, ...]]:
+        """Условие «значение колонки входит в список» для запроса."""
+        return f"{column} in ({', '.join(['%s'] * len(ids))})", tuple(ids)
+
+    def _fetch_by_ids(self, sql: str, column: str, ids: Collection[int]) -> list[tuple[Any, ...]]:
+        """Выполняет запрос с условием на вхождение колонки в список id
+        (вместо ``{where}`` в sql) пачками по IDS_CHUNK_SIZE id.
+        """
+        ids_list = list(ids)
+        result: list[tuple[Any, ...]] = []
+        for i in range(0, len(ids_list), IDS_CHUNK_SIZE):
+            where, args = self._ids_condition(column, ids_list[i : i + IDS_CHUNK_SIZE])
+            result.extend(self.fetchall(sql.format(where=where), args))
+        return result
+
+    def _q(self, name: str) -> str:
+        return self.identifier_quote + name + self.identifier_quote
+
+    def _build_filter(
+        self,
+        type: str,
+        filters: dict[str, Any] | None,
+        *,
+        prefix: str = "",
+    ) -> tuple[str, tuple[Any, ...]]:
+        # pylint: disable=redefined-builtin
+        if not filters:
+            return "", ()
+
+        where = []
+        where_args = []
+        ops = {"lt": "<", "lte": "<=", "gt": ">", "gte": ">="}
+
+        for k, v in filters.items():
+            if isinstance(v, datetime):
+                # В базе данных предполагается хранение UTC
+                v = v.astimezone(timezone.utc).replace(tzinfo=None)
+
+            key, act = filter_split(k)
+            if key.startswith(type + "_"):
+                # Используем правильное имя для первичного ключа таблицы (post_id -> id)
+                key = key[len(type) + 1 :]
+
+            if act not in ops:
+                raise ValueError(f"Invalid {type} filter: {k!r}")
+            where.append(f"{self._q(key)} {ops[act]} %s")
+            where_args.append(v)
+
+        return prefix + " AND ".join(where), tuple(where_args)
+
+    def _limits_query(self, type: str, filters: dict[str, Any] | None) -> tuple[str, tuple[Any, ...]]:
+        # pylint: disable=redefined-builtin
+        where, where_args = self._build_filter(type, filters, prefix=" where ")
+        return (
+            f"select min(id) first_id, max(id) last_id, count(id) {self._q('count')}, "
+            "min(created_at) first_created_at, max(created_at) last_created_at "
+            f"from {type}s{where}",
+            where_args,
+        )
+
+    # Табунчане
+
+    def get_user_by_id(self, user_id: int) -> types.User:
+        item = self.fetchall_dict("select * from users where id = %s", (user_id,))
+        if not item:
+            raise DataNotFound
+        return self._dict2user(item[0])
+
+    def iter_users(self, filters: dict[str, Any] | None = None) -> Iterator[list[types.User]]:
+        where, where_args = self._build_filter("user", filters, prefix=" where ")
+        for users in self.stream_dict(f"select * from users{where} order by id", where_args):
+            yield [self._dict2user(x) for x in users]
+
+    def get_users_limits(self, filters: dict[str, Any] | None = None) -> types.UsersLimits:
+        where, where_args = self._build_filter("user", filters, prefix=" where ")
+        return types.UsersLimits(
+            **self.fetchall_dict(
+                f"select min(id) first_id, max(id) last_id, count(id) {self._q('count')} from users{where}",
+                where_args,
+            )[0]
+        )
+
+    def get_username_by_user_id(self, user_id: int) -> str:
+        try:
+            return self._usernames[user_id]
+        except KeyError:
+            return self.get_user_by_id(user_id).username
+
+    def get_usernames_by_ids(self, user_ids: Collection[int]) -> dict[int, str]:
+        result = {}
+        missing = []
+        for user_id in user_ids:
+            try:
+                result[user_id] = self._usernames[user_id]
+            except KeyError:
+                missing.append(user_id)
+
+        for user_id, username in self._fetch_by_ids(
+            "select id, username from users where {where}", "id", missing
+        ):
+            self._usernames[user_id] = username
+            result[user_id] = username
+
+        return result
+
+    def _dict2user(self, raw_item: dict[str, Any]) -> types.User:
+        # Попутно заполняем кэш юзернеймов
+        self._usernames[raw_item["id"]] = raw_item["username"]
+
+        item = raw_item.copy()
+        item["registered_at"] = _to_utc_datetime(item["registered_at"])
+        if isinstance(item["birthday"], datetime):
+            item["birthday"] = item["birthday"].date()
+        elif item["birthday"] and not isinstance(item["birthday"], date):
+            item["birthday"] = date.fromisoformat(str(item["birthday"]))
+        return types.User(**item)
+
+    # Блоги
+
+    def get_blog_by_id(self, blog_id: int) -> types.Blog:
+        item = self.fetchall_dict("select * from blogs where id = %s", (blog_id,))
+        if not item:
+            raise DataNotFound
+        return self._dict2blog(item[0])
+
+    def get_blog_status_by_id(self, blog_id: int | None) -> int:
+        if blog_id is None:
+            return 0
+        if not self._blog_status_by_id:
+            self._fetch_blog_info()
+        try:
+            return self._blog_status_by_id[blog_id]
+        except KeyError as exc:
+            raise DataNotFound from exc
+
+    def get_blog_statuses_by_ids(self, blog_ids: Collection[int]) -> dict[int, int]:
+        if not self._blog_status_by_id:
+            self._fetch_blog_info()
+
+        result = {}
+        for blog_id in blog_ids:
+            try:
+                result[blog_id] = self._blog_status_by_id[blog_id]
+            except KeyError:
+                pass
+        return result
+
+    def get_blog_id_of_post(self, post_id: int) -> int | None:
+        result = self.get_blog_ids_of_posts((post_id,))
+        if post_id not in result:
+            raise DataNotFound
+        return result[post_id]
+
+    def get_blog_ids_of_posts(self, post_ids: Collection[int]) -> dict[int, int | None]:
+        missing_post_ids = []
+        result = {}
+
+        # Сперва проверяем наличие блогов в кэше
+        for post_id in post_ids:
+            try:
+                blog_id = self._post_blogs[post_id]
+            except KeyError:
+                missing_post_ids.append(post_id)
+            else:
+                if blog_id != -1:  # -1 означает, что пост не существует
+                    result[post_id] = blog_id
+
+        # Чего не оказалось в кэше, то запрашиваем из базы одним запросом
+        # на пачку постов
+        if missing_post_ids:
+            blog_ids = dict(
+                self._fetch_by_ids("select id, blog_id from posts where {where}", "id", missing_post_ids)
+            )
+            for post_id in missing_post_ids:
+                try:
+                    blog_id = blog_ids[post_id] or None
+                except KeyError:
+                    self._post_blogs[post_id] = -1
+                else:
+                    self._post_blogs[post_id] = blog_id
+                    result[post_id] = blog_id
+
+        return result
+
+    def iter_blogs(self, filters: dict[str, Any] | None = None) -> Iterator[list[types.Blog]]:
+        where, where_args = self._build_filter("blog", filters, prefix=" where ")
+        blogs = self.fetchall_dict(f"select * from blogs{where} order by id", where_args)
+        for i in range(0, len(blogs), 1000):
+            yield [self._dict2blog(x) for x in blogs[i : i + 1000]]
+
+    def get_blogs_limits(self, filters: dict[str, Any] | None = None) -> types.BlogsLimits:
+        where, where_args = self._build_filter("blog", filters, prefix=" where ")
+        return types.BlogsLimits(
+            **self.fetchall_dict(
+                f"select min(id) first_id, max(id) last_id, count(id) {self._q('count')} from blogs{where}",
+                where_args,
+            )[0]
+        )
+
+    def _dict2blog(self, raw_item: dict[str, Any]) -> types.Blog:
+        item = raw_item.copy()
+        item["created_at"] = _to_utc_datetime(item["created_at"])
+        return types.Blog(**item)
+
+    # Посты (опционально с комментами)
+
+    def get_post_by_id(self, post_id: int) -> types.Post:
+        item = self.fetchall_dict("select * from posts where id = %s", (post_id,))
+        if not item:
+            raise DataNotFound
+        return self._dict2post(item[0])
+
+    def iter_posts(
+        self,
+        *,
+        filters: dict[str, Any] | None = None,
+        burst: bool = False,
+    ) -> Iterator[list[types.Post]]:
+        where, where_args = self._build_filter("post", filters, prefix=" where ")
+        sql = f"select * from posts{where} order by id"
+
+        # Небольшую выборку проще забрать одним запросом
+        if burst:
+            posts = self.fetchall_dict(sql, where_args)
+            if posts:
+                yield [self._dict2post(x) for x in posts]
+            return
+
+        for posts in self.stream_dict(sql, where_args):
+            yield [self._dict2post(x) for x in posts]
+
+    def get_posts_limits(self, filters: dict[str, Any] | None = None) -> types.PostsLimits:
+        result = self.fetchall_dict(*self._limits_query("post", filters))[0]
+        if result["first_created_at"] is not None:
+            result["first_created_at"] = _to_utc_datetime(result["first_created_at"])
+        if result["last_created_at"] is not None:
+            result["last_created_at"] = _to_utc_datetime(result["last_created_at"])
+        return types.PostsLimits(**result)
+
+    def _dict2post(self, raw_item: dict[str, Any]) -> types.Post:
+        # Попутно заполняем кэш блогов
+        self._post_blogs[raw_item["id"]] = raw_item["blog_id"] or None
+
+        item = raw_item.copy()
+        item["created_at"] = _to_utc_datetime(item["created_at"])
+        if isinstance(item["tags"], str):
+            item["tags"] = item["tags"].split(",")
+        return types.Post(**item)
+
+    # Комменты
+
+    def get_comment_by_id(self, comment_id: int) -> types.Comment:
+        item = self.fetchall_dict("select * from comments where id = %s", (comment_id,))
+        if not item:
+            raise DataNotFound
+        return self._dict2comment_multi(item)[0]
+
+    def iter_comments(
+        self,
+        *,
+        filters: dict[str, Any] | None = None,
+        burst: bool = False,
+    ) -> Iterator[list[types.Comment]]:
+        where, where_args = self._build_filter("comment", filters, prefix=" where ")
+        sql = f"select * from comments{where} order by id"
+
+        if burst:
+            comments = self.fetchall_dict(sql, where_args)
+            if comments:
+                yield self._dict2comment_multi(comments)
+            return
+
+        for comments in self.stream_dict(sql, where_args):
+            yield self._dict2comment_multi(comments)
+
+    def get_comments_limits(self, filters: dict[str, Any] | None = None) -> types.CommentsLimits:
+        result = self.fetchall_dict(*self._limits_query("comment", filters))[0]
+        if result["first_created_at"] is not None:
+            result["first_created_at"] = _to_utc_datetime(result["first_created_at"])
+        if result["last_created_at"] is not None:
+            result["last_created_at"] = _to_utc_datetime(result["last_created_at"])
+        return types.CommentsLimits(**result)
+
+    def _dict2comment_multi(self, raw_items: list[dict[str, Any]]) -> list[types.Comment]:
+        # Блоги всех постов пачки запрашиваются одним запросом
+        blog_ids = self.get_blog_ids_of_posts({x["post_id"] for x in raw_items if x["post_id"] is not None})
+        blog_statuses = self.get_blog_statuses_by_ids({x for x in blog_ids.values() if x is not None})
+
+        result = []
+        for raw_item in raw_items:
+            try:
+                blog_id = blog_ids[raw_item["post_id"]]
+            except KeyError:
+                # Блог неизвестен (то есть пост в базе не существует)
+                blog_id = None
+                blog_status = None
+            else:
+                # Пост есть, но его блога в базе нет: статус блога неизвестен
+                blog_status = blog_statuses.get(blog_id) if blog_id is not None else 0
+
+            item = raw_item.copy()
+            item["created_at"] = _to_utc_datetime(item["created_at"])
+            result.append(types.Comment(**item, blog_id=blog_id, blog_status=blog_status))
+
+        return result
+
+    # Посты и комменты вместе
+
+    def iter_messages(
+        self,
+        *,
+        filters: dict[str, Any] | None = None,
+        chunk_size: int = 10000,
+    ) -> Iterator[list[types.Post | types.Comment]]:
+        posts_where, posts_args = self._build_filter("post", filters, prefix=" where ")
+        comments_where, comments_args = self._build_filter("comment", filters, prefix=" where ")
+
+        # Один серверный курсор на всё время вместо пары запросов на каждый день
+        sql = (
+            "select 0 kind, id, created_at, author_id, vote_value, body, favorites_count, "
+            "blog_id, blog_status, title, vote_count, tags, null post_id, null parent_id "
+            f"from posts{posts_where} "
+            "union all "
+            "select 1, id, created_at, author_id, vote_value, body, favorites_count, "
+            "null, null, null, null, null, post_id, parent_id "
+            f"from comments{comments_where} "
+            "order by created_at, kind, id"
+        )
+
+        for rows in self.stream_dict(sql, posts_args + comments_args, chunk_size=chunk_size):
+            kinds = [row.pop("kind") for row in rows]
+
+            # Посты разбираем первыми, чтобы они попали в кэш блогов
+            # постов до разбора комментов к ним
+            posts: list[types.Post] = []
+            raw_comments: list[dict[str, Any]] = []
+            for kind, row in zip(kinds, rows):
+                if kind == 0:
+                    del row["post_id"], row["parent_id"]
+                    posts.append(self._dict2post(row))
+                else:
+                    for key in ("blog_id", "blog_status", "title", "vote_count", "tags"):
+                        del row[key]
+                    raw_comments.append(row)
+
+            # Восстанавливаем общий порядок
+            posts_iter = iter(posts)
+            comments_iter = iter(self._dict2comment_multi(raw_comments))
+            result: list[types.Post | types.Comment] = [
+                next(comments_iter) if kind else next(posts_iter) for kind in kinds
+            ]
+            yield result
+
+
+def _to_utc_datetime(value: datetime | str) -> datetime:
+    # Драйверы обычно сами отдают datetime; время без часового пояса
+    # считается временем в UTC
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
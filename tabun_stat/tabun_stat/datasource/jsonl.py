@@ -0,0 +1,909 @@
+import gzip
+import heapq
+import json
+import multiprocessing
+import os
+import queue
+from bisect import bisect_left, bisect_right
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from datetime import date, datetime, timezone
+from itertools import chain
+from multiprocessing.process import BaseProcess
+from pathlib import Path
+from typing import Any, BinaryIO, Iterable, Iterator
+
+from tabun_stat import types
+from tabun_stat.datasource.base import BaseDataSource, DataNotFound
+from tabun_stat.stat import TabunStat
+from tabun_stat.utils import filter_act, filter_split
+
+# Меняется при несовместимых изменениях формата индекса
+INDEX_VERSION = 1
+
+# Виды файлов дампа (по началу имени файла)
+KINDS = ("users", "blogs", "posts", "comments")
+
+# Длина интервала времени (в секундах), по которым индекс считает сообщения
+BUCKET_SECONDS = 3600
+
+# Сколько пачек сообщений процесс, читающий файл, может прочитать заранее
+QUEUE_SIZE = 4
+
+# Размер пачки сообщений, передаваемой из процесса, читающего файл
+FILE_CHUNK_SIZE = 2000
+
+# Ключ сортировки сообщений: по времени, при совпадении сперва посты, потом
+# комменты, и дальше по id
+MessageKey = tuple[datetime, bool, int]
+
+
+@dataclass(slots=True)
+class DumpFile:
+    """Файл дампа с постами или комментами и его сводка из индекса."""
+
+    path: Path
+    kind: str
+    count: int = 0
+    first_id: int | None = None
+    last_id: int | None = None
+    first_created_at: datetime | None = None
+    last_created_at: datetime | None = None
+    # Отсортированы ли сообщения в файле по времени; если нет, то файл
+    # при чтении сортируется в памяти целиком
+    sorted: bool = True
+
+
+class JSONLDataSource(BaseDataSource):
+    """Источник данных, читающий дампы в формате JSON Lines или JSON (например,
+    выгрузки tbackup) без загрузки их в базу данных.
+
+    Дамп — это каталог с файлами ``users*``, ``blogs*``, ``posts*``
+    и ``comments*`` с расширением ``.jsonl`` (по объекту на строку) или
+    ``.json`` (массив объектов), возможно сжатыми gzip (``.gz``) или zstd
+    (``.zst``). Поля объектов такие же, как колонки таблиц в demo.sql; время —
+    строка в UTC (``2011-08-13 13:18:41``), ISO 8601 с часовым поясом или
+    unix timestamp. Постов и комментов может быть сколько угодно файлов
+    (например, по годам).
+
+    Пользователи и блоги загружаются в память целиком. Посты и комменты
+    читаются потоково: каждый файл распаковывается и разбирается в отдельном
+    процессе, а их содержимое сливается по времени (k-way merge). При первом
+    запуске файлы постов и комментов читаются целиком, чтобы построить
+    небольшой индекс рядом с дампом (диапазоны id и дат каждого файла, число
+    сообщений по часам и блоги постов); из него считаются get_*_limits
+    (часы на границах запрошенного интервала дочитываются из файлов).
+    Индекс перестраивается, если изменился набор файлов, их размер или время
+    изменения.
+    """
+
+    def __init__(
+        self,
+        *,
+        path: str | Path,
+        index_path: str | Path | None = None,
+        processes: int = 0,
+    ):
+        """
+        :param path: каталог с файлами дампа
+        :param index_path: файл индекса (по умолчанию рядом с каталогом
+          с суффиксом ``.index.json``)
+        :param processes: сколько файлов распаковывать одновременно
+          в отдельных процессах (0 — по числу ядер процессора, 1 — всё
+          в текущем процессе)
+        """
+        self._path = Path(path)
+        self._index_path = (
+            Path(index_path)
+            if index_path is not None
+            else Path(str(self._path).rstrip("/\\") + ".index.json")
+        )
+        self._processes = processes if processes > 0 else (os.cpu_count() or 1)
+
+        self._loaded = False
+        self._users: dict[int, types.User] = {}
+        self._blogs: dict[int, types.Blog] = {}
+        self._files: dict[str, list[DumpFile]] = {"posts": [], "comments": []}
+        # Число сообщений по часам: начала часов (отсортированные)
+        # и для каждого часа [число сообщений, min id, max id, время первого
+        # и последнего сообщения]
+        self._buckets: dict[str, tuple[list[int], list[list[int]]]] = {}
+        # Блоги постов (None — личный блог)
+        self._post_blogs: dict[int, int | None] = {}
+
+    def start(self, stat: TabunStat) -> None:
+        if self._loaded:
+            return
+
+        files = find_dump_files(self._path)
+
+        index = self._load_index(files)
+        if index is None:
+            stat.log(1, f"Building dump index {str(self._index_path)!r}...")
+            index = self._build_index(files)
+
+        for kind in ("posts", "comments"):
+            self._files[kind] = [
+                DumpFile(
+                    path=self._path / name,
+                    kind=kind,
+                    count=info["count"],
+                    first_id=info["first_id"],
+                    last_id=info["last_id"],
+                    first_created_at=_from_timestamp(info["first_ts"]),
+                    last_created_at=_from_timestamp(info["last_ts"]),
+                    sorted=info["sorted"],
+                )
+                for name, info in sorted(index["files"].items())
+                if info["kind"] == kind and info["count"] > 0
+            ]
+            buckets = index["buckets"][kind]
+            self._buckets[kind] = ([x[0] for x in buckets], [x[1:] for x in buckets])
+        self._post_blogs = {post_id: blog_id for post_id, blog_id in index["post_blogs"]}
+
+        # Пользователей и блогов немного, их проще держать в памяти
+        for path in files["users"]:
+            for record in iter_records(path, "users"):
+                user = _record2user(record)
+                self._users[user.id] = user
+        for path in files["blogs"]:
+            for record in iter_records(path, "blogs"):
+                blog = _record2blog(record)
+                self._blogs[blog.id] = blog
+
+        self._loaded = True
+
+    # Индекс
+
+    def _files_meta(self, files: dict[str, list[Path]]) -> dict[str, dict[str, Any]]:
+        result = {}
+        for kind in ("posts", "comments"):
+            for path in files[kind]:
+                st = path.stat()
+                result[path.name] = {"kind": kind, "size": st.st_size, "mtime_ns": st.st_mtime_ns}
+        return result
+
+    def _load_index(self, files: dict[str, list[Path]]) -> dict[str, Any] | None:
+        try:
+            with self._index_path.open("r", encoding="utf-8") as fp:
+                index: dict[str, Any] = json.load(fp)
+        except (OSError, ValueError):
+            return None
+
+        if index.get("version") != INDEX_VERSION:
+            return None
+        meta = self._files_meta(files)
+        if set(meta) != set(index["files"]):
+            return None
+        for name, file_meta in meta.items():
+            if any(index["files"][name].get(k) != v for k, v in file_meta.items()):
+                return None
+        return index
+
+    def _build_index(self, files: dict[str, list[Path]]) -> dict[str, Any]:
+        meta = self._files_meta(files)
+        tasks = [(path, kind) for kind in ("posts", "comments") for path in files[kind]]
+
+        # Файлы читаются параллельно в отдельных процессах (если можно)
+        processes = min(self._processes, len(tasks))
+        if processes > 1 and not multiprocessing.current_process().daemon:
+            with ProcessPoolExecutor(processes, mp_context=multiprocessing.get_context("spawn")) as executor:
+                results = list(executor.map(scan_file, *zip(*tasks)))
+        else:
+            results = [scan_file(path, kind) for path, kind in tasks]
+
+        buckets: dict[str, dict[int, list[int]]] = {"posts": {}, "comments": {}}
+        post_blogs: list[tuple[int, int | None]] = []
+        for (path, kind), result in zip(tasks, results):
+            meta[path.name].update(result["file"])
+            kind_buckets = buckets[kind]
+            for start, count, min_id, max_id, first_ts, last_ts in result["buckets"]:
+                bucket = kind_buckets.get(start)
+                if bucket is None:
+                    kind_buckets[start] = [count, min_id, max_id, first_ts, last_ts]
+                else:
+                    bucket[0] += count
+                    bucket[1] = min(bucket[1], min_id)
+                    bucket[2] = max(bucket[2], max_id)
+                    bucket[3] = min(bucket[3], first_ts)
+                    bucket[4] = max(bucket[4], last_ts)
+            post_blogs.extend(result["post_blogs"])
+
+        index = {
+            "version": INDEX_VERSION,
+            "files": meta,
+            "buckets": {kind: [[start] + b for start, b in sorted(x.items())] for kind, x in buckets.items()},
+            "post_blogs": post_blogs,
+        }
+
+        # Пишем во временный файл и потом переименовываем, чтобы прерванная
+        # сборка не оставила после себя битый индекс
+        tmp_path = self._index_path.with_name(self._index_path.name + ".tmp")
+        with tmp_path.open("w", encoding="utf-8") as fp:
+            json.dump(index, fp)
+        tmp_path.replace(self._index_path)
+        return index
+
+    # Табунчане
+
+    def get_user_by_id(self, user_id: int) -> types.User:
+        try:
+            return self._users[user_id]
+        except KeyError as exc:
+            raise DataNotFound from exc
+
+    def iter_users(self, filters: dict[str, Any] | None = None) -> Iterator[list[types.User]]:
+        users = _filter_objects(sorted(self._users.values(), key=lambda x: x.id), "user", filters)
+        for i in range(0, len(users), 1000):
+            yield users[i : i + 1000]
+
+    def get_usernames_by_ids(self, user_ids: Iterable[int]) -> dict[int, str]:
+        return {x: self._users[x].username for x in user_ids if x in self._users}
+
+    def get_users_limits(self, filters: dict[str, Any] | None = None) -> types.UsersLimits:
+        users = _filter_objects(self._users.values(), "user", filters)
+        return types.UsersLimits(
+            count=len(users),
+            first_id=min(x.id for x in users) if users else None,
+            last_id=max(x.id for x in users) if users else None,
+        )
+
+    # Блоги
+
+    def get_blog_by_id(self, blog_id: int) -> types.Blog:
+        try:
+            return self._blogs[blog_id]
+        except KeyError as exc:
+            raise DataNotFound from exc
+
+    def get_blog_id_of_post(self, post_id: int) -> int | None:
+        try:
+            return self._post_blogs[post_id]
+        except KeyError as exc:
+            raise DataNotFound from exc
+
+    def get_blog_ids_of_posts(self, post_ids: Iterable[int]) -> dict[int, int | None]:
+        return {x: self._post_blogs[x] for x in post_ids if x in self._post_blogs}
+
+    def iter_blogs(self, filters: dict[str, Any] | None = None) -> Iterator[list[types.Blog]]:
+        blogs = _filter_objects(sorted(self._blogs.values(), key=lambda x: x.id), "blog", filters)
+        for i in range(0, len(blogs), 1000):
+            yield blogs[i : i + 1000]
+
+    def get_blogs_limits(self, filters: dict[str, Any] | None = None) -> types.BlogsLimits:
+        blogs = _filter_objects(self._blogs.values(), "blog", filters)
+        return types.BlogsLimits(
+            count=len(blogs),
+            first_id=min(x.id for x in blogs) if blogs else None,
+            last_id=max(x.id for x in blogs) if blogs else None,
+        )
+
+    # Посты (опционально с комментами)
+
+    def get_post_by_id(self, post_id: int) -> types.Post:
+        # Отдельного индекса по id нет, поэтому читаем подходящие файлы
+        # целиком; для статистики этот метод не нужен
+        for message in self._find_by_id("posts", post_id):
+            assert isinstance(message, types.Post)
+            return message
+        raise DataNotFound
+
+    def iter_posts(
+        self,
+        *,
+        filters: dict[str, Any] | None = None,
+        burst: bool = False,
+    ) -> Iterator[list[types.Post]]:
+        for messages in self._iter_merged(("posts",), filters, chunk_size=1000):
+            yield [x for x in messages if isinstance(x, types.Post)]
+
+    def get_posts_limits(self, filters: dict[str, Any] | None = None) -> types.PostsLimits:
+        return types.PostsLimits(**self._get_limits("posts", filters))
+
+    # Комменты
+
+    def get_comment_by_id(self, comment_id: int) -> types.Comment:
+        for message in self._find_by_id("comments", comment_id):
+            assert isinstance(message, types.Comment)
+            return message
+        raise DataNotFound
+
+    def iter_comments(
+        self,
+        *,
+        filters: dict[str, Any] | None = None,
+        burst: bool = False,
+    ) -> Iterator[list[types.Comment]]:
+        for messages in self._iter_merged(("comments",), filters, chunk_size=10000):
+            yield [x for x in messages if isinstance(x, types.Comment)]
+
+    def get_comments_limits(self, filters: dict[str, Any] | None = None) -> types.CommentsLimits:
+        return types.CommentsLimits(**self._get_limits("comments", filters))
+
+    # Посты и комменты вместе
+
+    def iter_messages(
+        self,
+        *,
+        filters: dict[str, Any] | None = None,
+        chunk_size: int = 10000,
+    ) -> Iterator[list[types.Post | types.Comment]]:
+        for k in filters or {}:
+            if filter_split(k)[0] != "created_at":
+                raise ValueError(f"Invalid messages filter: {k!r}")
+        yield from self._iter_merged(("posts", "comments"), filters, chunk_size=chunk_size)
+
+    def _iter_merged(
+        self,
+        kinds: tuple[str, ...],
+        filters: dict[str, Any] | None,
+        *,
+        chunk_size: int,
+    ) -> Iterator[list[types.Post | types.Comment]]:
+        """Сливает сообщения из всех подходящих файлов указанных видов
+        в один отсортированный по времени поток и yield'ит его пачками.
+        """
+        files = [x for kind in kinds for x in self._files[kind] if _file_matches(x, _prefixed(kind, filters))]
+        files.sort(key=lambda x: (x.first_created_at, x.kind == "comments"))
+
+        # Файлы распаковываются в отдельных процессах, начиная с самых
+        # ранних; процессы читают файлы заранее, пока не заполнят очередь.
+        # Если процессов не хватает на все файлы, которые пересекаются
+        # по времени, то лишние файлы читаются в текущем процессе
+        ctx = None
+        if self._processes > 1 and not multiprocessing.current_process().daemon:
+            ctx = multiprocessing.get_context("spawn")
+
+        streams: list[FileStream] = []
+        heap: list[
+            tuple[MessageKey, int, types.Post | types.Comment, Iterator[types.Post | types.Comment]]
+        ] = []
+        next_file = 0  # Следующий файл для добавления в слияние
+        result: list[types.Post | types.Comment] = []
+
+        running = 0  # Сколько файлов сейчас читается в других процессах
+
+        try:
+            while True:
+                while ctx is not None and running < self._processes and len(streams) < len(files):
+                    f = files[len(streams)]
+                    streams.append(FileStream(f, _prefixed(f.kind, filters), ctx=ctx))
+                    running += 1
+
+                # Добавляем в слияние все файлы, которые начинаются не позже
+                # самого раннего из уже сливаемых сообщений
+                while next_file < len(files):
+                    f = files[next_file]
+                    assert f.first_created_at is not None
+                    if heap and f.first_created_at > heap[0][0][0]:
+                        break
+                    if next_file >= len(streams):
+                        streams.append(FileStream(f, _prefixed(f.kind, filters), ctx=None))
+                    items = iter(streams[next_file])
+                    for message in items:
+                        heapq.heappush(heap, (_message_key(message), next_file, message, items))
+                        break
+                    else:
+                        # После фильтрации в файле ничего не осталось
+                        if streams[next_file].process is not None:
+                            running -= 1
+                        streams[next_file].close()
+                    next_file += 1
+
+                if not heap:
+                    break
+
+                _, idx, message, items = heap[0]
+                result.append(message)
+                for message in items:
+                    heapq.heapreplace(heap, (_message_key(message), idx, message, items))
+                    break
+                else:
+                    heapq.heappop(heap)
+                    if streams[idx].process is not None:
+                        running -= 1
+                    streams[idx].close()
+
+                if len(result) >= chunk_size:
+                    yield self._fill_blogs(result)
+                    result = []
+
+            if result:
+                yield self._fill_blogs(result)
+
+        finally:
+            for stream in streams:
+                stream.close()
+
+    def _fill_blogs(self, messages: list[types.Post | types.Comment]) -> list[types.Post | types.Comment]:
+        # Блог коммента определяется через его пост; если поста нет,
+        # то блог и его статус неизвестны
+        for message in messages:
+            if isinstance(message, types.Comment):
+                if message.post_id is None or message.post_id not in self._post_blogs:
+                    continue
+                message.blog_id = self._post_blogs[message.post_id]
+                message.blog_status = self._get_blog_status(message.blog_id)
+            elif message.blog_status < 0:
+                message.blog_status = self._get_blog_status(message.blog_id) or 0
+        return messages
+
+    def _get_blog_status(self, blog_id: int | None) -> int | None:
+        if blog_id is None:
+            return 0
+        blog = self._blogs.get(blog_id)
+        return blog.status if blog is not None else None
+
+    def _find_by_id(self, kind: str, message_id: int) -> Iterator[types.Post | types.Comment]:
+        for f in self._files[kind]:
+            if f.first_id is None or f.last_id is None or not f.first_id <= message_id <= f.last_id:
+                continue
+            for chunk in iter_file_chunks(f, {"id__gte": message_id, "id__lte": message_id}):
+                yield from self._fill_blogs(list(chunk))
+
+    def _get_limits(self, kind: str, filters: dict[str, Any] | None) -> dict[str, Any]:
+        # Фильтры не только по датам считаем честно, читая все файлы
+        date_range = _date_range(filters)
+        if date_range is None:
+            count = 0
+            first_id = last_id = None
+            first_created_at = last_created_at = None
+            for messages in self._iter_merged((kind,), filters, chunk_size=10000):
+                count += len(messages)
+                ids = [x.id for x in messages]
+                first_id = min(ids) if first_id is None else min(first_id, min(ids))
+                last_id = max(ids) if last_id is None else max(last_id, max(ids))
+                if first_created_at is None:
+                    first_created_at = messages[0].created_at
+                last_created_at = messages[-1].created_at
+            return {
+                "count": count,
+                "first_id": first_id,
+                "last_id": last_id,
+                "first_created_at": first_created_at,
+                "last_created_at": last_created_at,
+            }
+
+        # По датам считаем по индексу: часы, целиком попадающие в интервал,
+        # берутся из него как есть, а часы на его границах досчитываются
+        # чтением подходящих файлов
+        lo, hi = date_range
+        starts, buckets = self._buckets[kind]
+        parts: list[list[int]] = []
+        for i in range(max(0, bisect_right(starts, lo) - 1), bisect_left(starts, hi)):
+            b_first_ts, b_last_ts = buckets[i][3], buckets[i][4]
+            if b_last_ts < lo or b_first_ts >= hi:
+                continue
+            if b_first_ts >= lo and b_last_ts < hi:
+                parts.append(buckets[i])
+                continue
+            part = self._scan_limits(kind, max(lo, starts[i]), min(hi, starts[i] + BUCKET_SECONDS))
+            if part is not None:
+                parts.append(part)
+
+        if not parts:
+            return {
+                "count": 0,
+                "first_id": None,
+                "last_id": None,
+                "first_created_at": None,
+                "last_created_at": None,
+            }
+        return {
+            "count": sum(x[0] for x in parts),
+            "first_id": min(x[1] for x in parts),
+            "last_id": max(x[2] for x in parts),
+            "first_created_at": _from_timestamp(min(x[3] for x in parts)),
+            "last_created_at": _from_timestamp(max(x[4] for x in parts)),
+        }
+
+    def _scan_limits(self, kind: str, lo: int, hi: int) -> list[int] | None:
+        """Читает из файлов сообщения в полуинтервале [lo, hi) unix
+        timestamp'ов и возвращает [число сообщений, min id, max id, время
+        первого и последнего сообщения] (как у часов в индексе) или None,
+        если сообщений нет.
+        """
+        filters = {"created_at__gte": _from_timestamp(lo), "created_at__lt": _from_timestamp(hi)}
+        result: list[int] | None = None
+        for f in self._files[kind]:
+            if not _file_matches(f, filters):
+                continue
+            for chunk in iter_file_chunks(f, filters):
+                for message in chunk:
+                    ts = int(message.created_at.timestamp())
+                    if result is None:
+                        result = [1, message.id, message.id, ts, ts]
+                        continue
+                    result[0] += 1
+                    result[1] = min(result[1], message.id)
+                    result[2] = max(result[2], message.id)
+                    result[3] = min(result[3], ts)
+                    result[4] = max(result[4], ts)
+        return result
+
+
+class FileStream:
+    """Сообщения одного файла дампа по порядку. Если передан контекст
+    multiprocessing, то файл читается в отдельном процессе, который
+    передаёт сообщения пачками через очередь.
+    """
+
+    def __init__(self, file: DumpFile, filters: dict[str, Any] | None, *, ctx: Any = None):
+        self.file = file
+        self.process: BaseProcess | None = None
+        self._queue: "multiprocessing.Queue[tuple[list[Any] | None, str | None]] | None" = None
+        self._chunks: Iterator[list[types.Post | types.Comment]]
+
+        if ctx is not None:
+            self._queue = ctx.Queue(QUEUE_SIZE)
+            self.process = ctx.Process(
+                target=_file_stream_main,
+                args=(file, filters, self._queue),
+                name=f"tabun_stat-dump-{file.path.name}",
+                daemon=True,
+            )
+            self.process.start()
+            self._chunks = self._iter_queue()
+        else:
+            self._chunks = iter_file_chunks(file, filters)
+
+    def __iter__(self) -> Iterator[types.Post | types.Comment]:
+        return chain.from_iterable(self._chunks)
+
+    def _iter_queue(self) -> Iterator[list[types.Post | types.Comment]]:
+        assert self._queue is not None and self.process is not None
+        while True:
+            try:
+                chunk, error = self._queue.get(timeout=1.0)
+            except queue.Empty:
+                if not self.process.is_alive():
+                    raise RuntimeError(f"Process reading {str(self.file.path)!r} died unexpectedly") from None
+                continue
+            if error is not None:
+                raise RuntimeError(f"Error reading {str(self.file.path)!r}: {error}")
+            if chunk is None:
+                return
+            yield chunk
+
+    def close(self) -> None:
+        if self.process is not None:
+            if self.process.is_alive():
+                self.process.terminate()
+            self.process.join()
+            self.process = None
+
+
+def _file_stream_main(
+    file: DumpFile,
+    filters: dict[str, Any] | None,
+    result_queue: "multiprocessing.Queue[tuple[list[Any] | None, str | None]]",
+) -> None:
+    try:
+        for chunk in iter_file_chunks(file, filters):
+            result_queue.put((chunk, None))
+        result_queue.put((None, None))
+    except Exception as exc:  # pylint: disable=broad-exception-caught
+        result_queue.put((None, f"{type(exc).__name__}: {exc}"))
+
+
+# Чтение файлов
+
+
+def find_dump_files(path: Path) -> dict[str, list[Path]]:
+    """Находит файлы дампа в каталоге и раскладывает их по видам."""
+    result: dict[str, list[Path]] = {kind: [] for kind in KINDS}
+    for p in sorted(path.iterdir()):
+        name = p.name
+        for suffix in (".gz", ".zst"):
+            name = name.removesuffix(suffix)
+        if not p.is_file() or not name.endswith((".jsonl", ".json")):
+            continue
+        for kind in KINDS:
+            if name.startswith(kind):
+                result[kind].append(p)
+                break
+    return result
+
+
+def open_dump(path: Path) -> BinaryIO:
+    """Открывает файл дампа на чтение, распаковывая его, если нужно."""
+    if path.name.endswith(".gz"):
+        return gzip.open(path, "rb")  # type: ignore[return-value]
+
+    if path.name.endswith(".zst"):
+        # pylint: disable=import-outside-toplevel
+        try:
+            from compression import zstd  # type: ignore[import-not-found]
+
+            return zstd.open(path, "rb")  # type: ignore[no-any-return]
+        except ImportError:
+            pass
+        try:
+            import zstandard  # type: ignore[import-not-found]
+        except ImportError as exc:
+            raise RuntimeError("zstd decompression requires Python 3.14+ or zstandard package") from exc
+        return zstandard.open(path, "rb")  # type: ignore[no-any-return]
+
+    return path.open("rb", buffering=1024 * 1024)
+
+
+def iter_records(path: Path, kind: str) -> Iterator[dict[str, Any]]:
+    """Yield'ит объекты из файла дампа: по одному на строку для JSON Lines;
+    для JSON — из массива (или из массива под ключом kind, если файл
+    содержит объект).
+    """
+    name = path.name.removesuffix(".gz").removesuffix(".zst")
+    with open_dump(path) as fp:
+        if name.endswith(".json"):
+            data = json.load(fp)
+            if isinstance(data, dict):
+                data = data[kind]
+            yield from data
+            return
+
+        for line in fp:
+            if line.strip():
+                yield json.loads(line)
+
+
+def iter_file_chunks(
+    file: DumpFile,
+    filters: dict[str, Any] | None,
+    *,
+    chunk_size: int = FILE_CHUNK_SIZE,
+) -> Iterator[list[types.Post | types.Comment]]:
+    """Читает посты или комменты из файла по порядку (сортируя их, если
+    файл не отсортирован) и yield'ит подходящие под фильтры пачками.
+    Блоги комментов не заполняются.
+    """
+    convert = _record2post if file.kind == "posts" else _record2comment
+    conditions: list[tuple[str, str, Any]] = []
+    date_conditions: list[tuple[str, str, Any]] = []
+    for k, v in (filters or {}).items():
+        key, act = filter_split(k)
+        filter_act(act, 0, 0)  # Проверка правильности операции
+        (date_conditions if key == "created_at" else conditions).append((key, act, v))
+
+    messages: Iterable[types.Post | types.Comment] = (convert(x) for x in iter_records(file.path, file.kind))
+    if not file.sorted:
+        messages = sorted(messages, key=_message_key)
+
+    chunk: list[types.Post | types.Comment] = []
+    for message in messages:
+        if not all(filter_act(act, message.created_at, v) for _, act, v in date_conditions):
+            # В отсортированном файле после верхней границы дат уже
+            # ничего подходящего не будет
+            if any(
+                act in ("lt", "lte") and not filter_act(act, message.created_at, v)
+                for _, act, v in date_conditions
+            ):
+                break
+            continue
+        if not all(_check(getattr(message, key), act, v) for key, act, v in conditions):
+            continue
+
+        chunk.append(message)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+
+    if chunk:
+        yield chunk
+
+
+def scan_file(path: Path, kind: str) -> dict[str, Any]:
+    """Читает файл с постами или комментами целиком и собирает для индекса
+    его сводку, число сообщений по часам и (для постов) их блоги.
+    """
+    count = 0
+    first_id = last_id = first_ts = last_ts = None
+    is_sorted = True
+    prev_key: tuple[int, int] | None = None
+    buckets: dict[int, list[int]] = {}
+    post_blogs: list[tuple[int, int | None]] = []
+
+    for record in iter_records(path, kind):
+        message_id = int(record["id"])
+        ts = int(_parse_datetime(record["created_at"]).timestamp())
+
+        count += 1
+        first_id = message_id if first_id is None else min(first_id, message_id)
+        last_id = message_id if last_id is None else max(last_id, message_id)
+        first_ts = ts if first_ts is None else min(first_ts, ts)
+        last_ts = ts if last_ts is None else max(last_ts, ts)
+        if prev_key is not None and (ts, message_id) < prev_key:
+            is_sorted = False
+        prev_key = (ts, message_id)
+
+        start = ts - ts % BUCKET_SECONDS
+        bucket = buckets.get(start)
+        if bucket is None:
+            buckets[start] = [1, message_id, message_id, ts, ts]
+        else:
+            bucket[0] += 1
+            bucket[1] = min(bucket[1], message_id)
+            bucket[2] = max(bucket[2], message_id)
+            bucket[3] = min(bucket[3], ts)
+            bucket[4] = max(bucket[4], ts)
+
+        if kind == "posts":
+            post_blogs.append((message_id, record.get("blog_id") or None))
+
+    return {
+        "file": {
+            "count": count,
+            "first_id": first_id,
+            "last_id": last_id,
+            "first_ts": first_ts,
+            "last_ts": last_ts,
+            "sorted": is_sorted,
+        },
+        "buckets": [[start] + b for start, b in buckets.items()],
+        "post_blogs": post_blogs,
+    }
+
+
+# Разбор объектов
+
+
+def _parse_datetime(value: str | int | float) -> datetime:
+    # Время без часового пояса считается временем в UTC
+    if isinstance(value, (int, float)):
+        return datetime.fromtimestamp(value, timezone.utc)
+    if value.endswith("Z"):
+        value = value[:-1] + "+00:00"
+    result = datetime.fromisoformat(value)
+    if result.tzinfo is None:
+        return result.replace(tzinfo=timezone.utc)
+    return result.astimezone(timezone.utc)
+
+
+def _from_timestamp(ts: int | None) -> datetime | None:
+    return datetime.fromtimestamp(ts, timezone.utc) if ts is not None else None
+
+
+def _record2user(r: dict[str, Any]) -> types.User:
+    birthday = r.get("birthday")
+    return types.User(
+        id=r["id"],
+        username=r["username"],
+        skill=r["skill"],
+        rating=r["rating"],
+        registered_at=_parse_datetime(r["registered_at"]),
+        realname=r.get("realname"),
+        gender=r.get("gender"),
+        birthday=date.fromisoformat(birthday[:10]) if birthday else None,
+        description=r.get("description"),
+    )
+
+
+def _record2blog(r: dict[str, Any]) -> types.Blog:
+    return types.Blog(
+        id=r["id"],
+        slug=r["slug"],
+        name=r["name"],
+        creator_id=r["creator_id"],
+        rating=r["rating"],
+        status=r["status"],
+        description=r.get("description") or "",
+        vote_count=r["vote_count"],
+        created_at=_parse_datetime(r["created_at"]),
+    )
+
+
+def _record2post(r: dict[str, Any]) -> types.Post:
+    tags = r.get("tags") or ""
+    blog_status = r.get("blog_status")
+    return types.Post(
+        id=r["id"],
+        created_at=_parse_datetime(r["created_at"]),
+        author_id=r["author_id"],
+        blog_id=r.get("blog_id") or None,
+        # -1 — статус неизвестен, он определяется потом по блогу
+        blog_status=blog_status if blog_status is not None else -1,
+        title=r["title"],
+        vote_count=r["vote_count"],
+        vote_value=r.get("vote_value"),
+        body=r["body"],
+        tags=tags.split(",") if isinstance(tags, str) else list(tags),
+        favorites_count=r.get("favorites_count", 0),
+    )
+
+
+def _record2comment(r: dict[str, Any]) -> types.Comment:
+    return types.Comment(
+        id=r["id"],
+        created_at=_parse_datetime(r["created_at"]),
+        author_id=r["author_id"],
+        post_id=r.get("post_id"),
+        blog_id=None,
+        blog_status=None,
+        parent_id=r.get("parent_id"),
+        vote_value=r["vote_value"],
+        body=r["body"],
+        favorites_count=r.get("favorites_count", 0),
+    )
+
+
+def _message_key(message: types.Post | types.Comment) -> MessageKey:
+    return (message.created_at, isinstance(message, types.Comment), message.id)
+
+
+# Фильтры
+
+
+def _check(value: Any, act: str, filter_value: Any) -> bool:
+    return value is not None and filter_act(act, value, filter_value)
+
+
+def _prefixed(kind: str, filters: dict[str, Any] | None) -> dict[str, Any] | None:
+    # Правильное имя для id сообщения (post_id для постов -> id); post_id
+    # для комментов остаётся id поста
+    if not filters:
+        return None
+    prefix = kind[:-1] + "_"
+    result = {}
+    for k, v in filters.items():
+        key, act = filter_split(k)
+        if key == prefix + "id":
+            key = "id"
+        result[f"{key}__{act}"] = v
+    return result
+
+
+def _filter_objects(items: Iterable[Any], type: str, filters: dict[str, Any] | None) -> list[Any]:
+    # pylint: disable=redefined-builtin
+    conditions = []
+    for k, v in (filters or {}).items():
+        key, act = filter_split(k)
+        if key == type + "_id":
+            key = "id"
+        filter_act(act, 0, 0)  # Проверка правильности операции
+        conditions.append((key, act, v))
+    return [x for x in items if all(_check(getattr(x, key), act, v) for key, act, v in conditions)]
+
+
+def _file_matches(file: DumpFile, filters: dict[str, Any] | None) -> bool:
+    """Может ли в файле быть что-то подходящее под фильтры (по датам и id
+    из индекса).
+    """
+    first: Any
+    last: Any
+    for k, v in (filters or {}).items():
+        key, act = filter_split(k)
+        if key == "created_at":
+            first, last = file.first_created_at, file.last_created_at
+        elif key == "id":
+            first, last = file.first_id, file.last_id
+        else:
+            continue
+        if first is None or last is None:
+            return False
+        # Для lt/lte важно начало файла, для gt/gte — конец
+        if not filter_act(act, first if act in ("lt", "lte") else last, v):
+            return False
+    return True
+
+
+def _date_range(filters: dict[str, Any] | None) -> tuple[int, int] | None:
+    """Переводит фильтры по датам в полуинтервал [lo, hi) unix timestamp'ов
+    (в дампах время с точностью до секунды). Если есть фильтры не по датам,
+    возвращает None.
+    """
+    lo, hi = -(2**62), 2**62
+    for k, v in (filters or {}).items():
+        key, act = filter_split(k)
+        if key != "created_at":
+            return None
+        ts = v.timestamp()
+        if act == "gte":
+            lo = max(lo, -int(-ts // 1))
+        elif act == "gt":
+            lo = max(lo, int(ts // 1) + 1)
+        elif act == "lt":
+            hi = min(hi, -int(-ts // 1))
+        elif act == "lte":
+            hi = min(hi, int(ts // 1) + 1)
+        else:
+            raise ValueError(f"Invalid filter: {k!r}")
+    return lo, hi
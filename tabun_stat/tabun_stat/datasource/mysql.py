@@ -0,0 +1,50 @@
+from typing import Any
+
+from tabun_stat.datasource.dbapi import DBAPIDataSource
+
+
+class MySQLDataSource(DBAPIDataSource):
+    """Источник данных для MySQL и MariaDB (нужен пакет PyMySQL). Большие
+    выборки читаются через небуферизованный курсор (SSCursor), который
+    забирает строки с сервера по мере чтения.
+    """
+
+    identifier_quote = "`"
+
+    def __init__(self, *, chunk_size: int = 10000, **connect_kwargs: Any):
+        """
+        :param chunk_size: сколько строк забирать с сервера за раз при
+          потоковом чтении пользователей, постов и комментов
+        :param connect_kwargs: параметры подключения (host, port, user,
+          password, database и т.п.) передаются в pymysql.connect как есть
+        """
+        super().__init__(chunk_size=chunk_size)
+        self._connect_kwargs = connect_kwargs
+
+    def _connect(self, *, autocommit: bool) -> Any:
+        # pylint: disable=import-outside-toplevel
+        try:
+            import pymysql  # type: ignore[import-untyped,unused-ignore]
+        except ImportError as exc:
+            raise RuntimeError("MySQL data source requires PyMySQL package") from exc
+
+        kwargs = {"charset": "utf8mb4", **self._connect_kwargs, "autocommit": autocommit}
+        conn = pymysql.connect(**kwargs)
+        try:
+            # Время в базе хранится в UTC, и сравниваться с ним должно
+            # время в UTC
+            with conn.cursor() as cur:
+                cur.execute("set time_zone = '+00:00'")
+        except Exception:
+            conn.close()
+            raise
+        return conn
+
+    def _stream_cursor(self, conn: Any) -> Any:
+        # pylint: disable=import-outside-toplevel
+        import pymysql.cursors  # type: ignore[import-untyped,unused-ignore]
+
+        # Пока такой курсор не дочитан, соединение нельзя использовать для
+        # других запросов, поэтому потоковое чтение идёт в отдельном
+        # соединении (см. DBAPIDataSource)
+        return conn.cursor(pymysql.cursors.SSCursor)
@@ -0,0 +1,60 @@
+from typing import Any
+
+from tabun_stat.datasource.dbapi import DBAPIDataSource
+
+
+class PostgreSQLDataSource(DBAPIDataSource):
+    """Источник данных для PostgreSQL (нужен пакет psycopg или psycopg2).
+    Большие выборки читаются через именованные (серверные) курсоры, а блоги
+    постов запрашиваются пачками через ``= ANY(%s)``.
+    """
+
+    def __init__(self, *, dsn: str = "", chunk_size: int = 10000, **connect_kwargs: Any):
+        """
+        :param dsn: строка подключения (например,
+          ``postgresql://user@localhost/tabun``)
+        :param chunk_size: сколько строк забирать с сервера за раз при
+          потоковом чтении пользователей, постов и комментов
+        :param connect_kwargs: остальные параметры подключения (host, port,
+          dbname, user, password и т.п.) передаются драйверу как есть
+        """
+        super().__init__(chunk_size=chunk_size)
+        self._dsn = dsn
+        self._connect_kwargs = connect_kwargs
+
+    def _connect(self, *, autocommit: bool) -> Any:
+        # pylint: disable=import-outside-toplevel
+        try:
+            import psycopg  # type: ignore[import-not-found,unused-ignore]
+        except ImportError:
+            try:
+                import psycopg2 as psycopg  # type: ignore[import-untyped,no-redef,unused-ignore]
+            except ImportError as exc:
+                raise RuntimeError("PostgreSQL data source requires psycopg or psycopg2 package") from exc
+
+        conn = psycopg.connect(self._dsn, **self._connect_kwargs)
+        try:
+            # Время в базе хранится в UTC, и сравниваться с ним должно
+            # время в UTC
+            with conn.cursor() as cur:
+                cur.execute("set time zone 'UTC'")
+            conn.commit()
+            conn.autocommit = autocommit
+        except Exception:
+            conn.close()
+            raise
+        return conn
+
+    def _stream_cursor(self, conn: Any) -> Any:
+        # Именованный курсор живёт на сервере, и fetchmany забирает
+        # с сервера только запрошенное число строк. Имя может быть одним
+        # на всех: такие курсоры не вкладываются друг в друга, а у каждого
+        # потока своё соединение для них
+        cur = conn.cursor(name="tabun_stat_stream")
+        cur.itersize = self.chunk_size
+        return cur
+
+    def _ids_condition(self, column: str, ids: list[int]) -> tuple[str, tuple[Any, ...]]:
+        # Список передаётся одним параметром-массивом, поэтому текст запроса
+        # не зависит от числа id
+        return f"{column} = ANY(%s)", (ids,)
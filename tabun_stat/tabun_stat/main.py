@@ -42,24 +42,71 @@ def load_processor(params: dict[str, object]) -> BaseProcessor:
     return processor
 
 
-def load_processors(params_list: list[dict[str, object]]) -> list[BaseProcessor]:
-    processors = []
-    for params in params_list:
-        processors.append(load_processor(params))
-    return processors
-
-
 def main() -> int:
     parser = argparse.ArgumentParser(description="Statistics calculator for Tabun")
     parser.add_argument("-c", "--config", help="path to config file (TOML)", required=True)
     parser.add_argument("-o", "--destination", help="override destination directory", default=None)
     parser.add_argument("-v", "--verbosity", action="count", help="verbose output", default=0)
+    parser.add_argument(
+        "-j",
+        "--workers",
+        type=int,
+        help="override number of processes to distribute processors between",
+        default=None,
+    )
+    parser.add_argument(
+        "--shards",
+        type=int,
+        help="override number of shards to split data between for mergeable processors",
+        default=None,
+    )
+    parser.add_argument(
+        "--checkpoint",
+        help="override path to checkpoint file with saved state of mergeable processors",
+        default=None,
+    )
+    parser.add_argument(
+        "--resume",
+        "--since-checkpoint",
+        action="store_true",
+        help="load checkpoint and process only data after it by mergeable processors",
+        default=False,
+    )
+
+    parser.add_argument(
+        "--prefetch-threads",
+        type=int,
+        help=(
+            "override number of threads loading windows of posts and comments"
+            " (used only if data source does not implement iter_messages)"
+        ),
+        default=None,
+    )
+
+    parser.add_argument(
+        "--compress",
+        choices=["gzip", "zstd"],
+        help="override compression of csv files",
+        default=None,
+    )
+
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="profile processors with cProfile and save results to destination (implies --perf-json)",
+        default=False,
+    )
+    parser.add_argument(
+        "--perf-json",
+        action="store_true",
+        help="save detailed performance info to perf.json in destination",
+        default=False,
+    )
 
     args = parser.parse_args()
 
     config = Config.from_file(args.config)
     source = load_datasource(config.datasource)
-    processors = load_processors(config.processors)
 
     stat = TabunStat(
         source=source,
@@ -68,9 +115,30 @@ def main() -> int:
         min_date=config.min_date,
         max_date=config.max_date,
         tz=config.timezone,
+        workers=args.workers if args.workers is not None else config.workers,
+        shards=args.shards if args.shards is not None else config.shards,
+        checkpoint=args.checkpoint or config.checkpoint or None,
+        resume=args.resume,
+        prefetch_threads=(
+            args.prefetch_threads if args.prefetch_threads is not None else config.prefetch_threads
+        ),
+        prefetch_queue_size=config.prefetch_queue_size,
+        prefetch_rows=config.prefetch_rows,
+        profile=args.profile,
+        perf_json=args.perf_json,
+        output_compression=args.compress or config.output_compression,
+        parquet_tables=config.parquet_tables,
     )
-    for p in processors:
-        stat.add_processor(p)
+
+    for params in config.processors:
+        # Номер процесса для обработчика не является параметром самого
+        # обработчика, поэтому забираем его отдельно
+        kwargs = dict(params)
+        worker = kwargs.pop("worker", None)
+        if worker is not None and not isinstance(worker, int):
+            raise TypeError(f"Processor worker number must be int (got {worker!r})")
+        processor_params = {k: v for k, v in kwargs.items() if k != "name"}
+        stat.add_processor(load_processor(kwargs), worker=worker, params=processor_params)
 
     stat.go()
 
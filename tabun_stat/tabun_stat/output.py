@@ -0,0 +1,200 @@
+import csv
+import gzip
+from pathlib import Path
+from types import TracebackType
+from typing import IO, Any, Iterable
+
+# Расширения файлов для поддерживаемых видов сжатия
+COMPRESSION_SUFFIXES: dict[str, str] = {
+    "": "",
+    "gzip": ".gz",
+    "zstd": ".zst",
+}
+
+# Сколько строк копится в памяти перед записью в файл
+BATCH_SIZE = 1000
+
+
+def open_text(path: Path, compression: str = "") -> IO[str]:
+    """Открывает текстовый файл на запись, при необходимости со сжатием.
+    Для zstd нужен Python 3.14+ или пакет zstandard.
+
+    :param path: путь к файлу (расширение для сжатия не добавляется)
+    :param compression: вид сжатия ("", "gzip" или "zstd")
+    """
+    if compression == "":
+        return path.open("w", encoding="utf-8", newline="", buffering=1024 * 1024)
+
+    if compression == "gzip":
+        return gzip.open(path, "wt", encoding="utf-8", newline="", compresslevel=6)
+
+    if compression == "zstd":
+        # pylint: disable=import-outside-toplevel
+        try:
+            from compression import zstd  # type: ignore[import-not-found]
+
+            return zstd.open(path, "wt", encoding="utf-8", newline="")  # type: ignore[no-any-return]
+        except ImportError:
+            pass
+        try:
+            import zstandard  # type: ignore[import-not-found]
+        except ImportError as exc:
+            raise RuntimeError("zstd compression requires Python 3.14+ or zstandard package") from exc
+        return zstandard.open(path, "wt", encoding="utf-8", newline="")  # type: ignore[no-any-return]
+
+    raise ValueError(f"Unknown compression: {compression!r}")
+
+
+class RowWriter:
+    """Пишет таблицу построчно; первая строка — заголовок. Строки копятся
+    в памяти и записываются пачками.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._rows: list[Iterable[Any]] = []
+        self._closed = False
+
+    def write(self, *values: Any) -> None:
+        """Добавляет строку. Значения приводятся к строке так же,
+        как в utils.csvline (кроме None, который становится пустой строкой).
+        """
+        self._rows.append(values)
+        if len(self._rows) >= BATCH_SIZE:
+            self.flush()
+
+    def write_rows(self, rows: Iterable[Iterable[Any]]) -> None:
+        for row in rows:
+            self._rows.append(row)
+            if len(self._rows) >= BATCH_SIZE:
+                self.flush()
+
+    def flush(self) -> None:
+        rows = self._rows
+        self._rows = []
+        if rows:
+            self._write(rows)
+
+    def close(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            self.flush()
+        finally:
+            self._close()
+
+    def _write(self, rows: list[Iterable[Any]]) -> None:
+        raise NotImplementedError
+
+    def _close(self) -> None:
+        raise NotImplementedError
+
+    def __enter__(self) -> "RowWriter":
+        return self
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc_value: BaseException | None,
+        traceback: TracebackType | None,
+    ) -> None:
+        self.close()
+
+
+class CsvRowWriter(RowWriter):
+    """Пишет csv-файл через модуль csv (в том же формате, что
+    и utils.csvline, но поля с запятыми тоже заключаются в кавычки).
+    """
+
+    def __init__(self, path: Path, compression: str = ""):
+        super().__init__(path)
+        self._fp = open_text(path, compression)
+        self._writer = csv.writer(self._fp, lineterminator="\n")
+
+    def _write(self, rows: list[Iterable[Any]]) -> None:
+        self._writer.writerows(rows)
+
+    def _close(self) -> None:
+        self._fp.close()
+
+
+class ParquetRowWriter(RowWriter):
+    """Пишет таблицу в формате Parquet (нужен пакет pyarrow). Все колонки
+    строковые, с теми же значениями, что были бы в csv, а названия колонок
+    берутся из первой строки. Каждая пачка строк становится группой строк.
+    """
+
+    def __init__(self, path: Path, *, batch_size: int = 100000):
+        super().__init__(path)
+        # pylint: disable=import-outside-toplevel
+        try:
+            import pyarrow  # type: ignore[import-not-found]
+            import pyarrow.parquet  # type: ignore[import-not-found]
+        except ImportError as exc:
+            raise RuntimeError("Parquet output requires pyarrow package") from exc
+
+        self._pa = pyarrow
+        self._pq = pyarrow.parquet
+        self._batch_size = batch_size
+        self._columns: list[str] | None = None
+        self._writer: Any = None
+        self._pending: list[list[str]] = []
+
+    def _write(self, rows: list[Iterable[Any]]) -> None:
+        for row in rows:
+            values = ["" if x is None else str(x) for x in row]
+            if self._columns is None:
+                self._columns = values
+                schema = self._pa.schema([(name, self._pa.string()) for name in values])
+                self._writer = self._pq.ParquetWriter(self.path, schema, compression="zstd")
+            else:
+                self._pending.append(values)
+
+        if len(self._pending) >= self._batch_size:
+            self._write_group()
+
+    def _write_group(self) -> None:
+        if not self._pending or self._columns is None:
+            return
+        columns = list(zip(*self._pending))
+        self._pending = []
+        table = self._pa.table(
+            {
+                name: self._pa.array(values, type=self._pa.string())
+                for name, values in zip(self._columns, columns)
+            }
+        )
+        self._writer.write_table(table)
+
+    def _close(self) -> None:
+        if self._writer is None:
+            return
+        try:
+            self._write_group()
+        finally:
+            self._writer.close()
+
+
+def open_writer(
+    directory: Path,
+    filename: str,
+    *,
+    compression: str = "",
+    parquet: bool = False,
+) -> RowWriter:
+    """Открывает таблицу на запись.
+
+    :param directory: каталог, в котором создаётся файл
+    :param filename: имя файла с расширением .csv
+    :param compression: сжатие csv-файла ("", "gzip" или "zstd"); к имени
+      файла добавляется соответствующее расширение
+    :param parquet: писать в формате Parquet вместо csv (расширение .csv
+      заменяется на .parquet, сжатие встроено в сам формат)
+    """
+    if compression not in COMPRESSION_SUFFIXES:
+        raise ValueError(f"Unknown compression: {compression!r}")
+
+    if parquet:
+        return ParquetRowWriter(directory / (filename.removesuffix(".csv") + ".parquet"))
+    return CsvRowWriter(directory / (filename + COMPRESSION_SUFFIXES[compression]), compression)
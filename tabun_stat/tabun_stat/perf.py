@@ -0,0 +1,97 @@
+import cProfile
+import json
+import pstats
+from dataclasses import dataclass, field
+from datetime import date
+from pathlib import Path
+from typing import Any, Iterable
+
+# Этапы работы, к которым относятся методы обработчиков, вызываемые
+# через TabunStat._call_processors (process_* и stop учитываются отдельно)
+PHASES: dict[str, str] = {
+    "start": "start",
+    "begin_users": "users",
+    "end_users": "users",
+    "begin_blogs": "blogs",
+    "end_blogs": "blogs",
+    "begin_messages": "messages",
+    "end_messages": "messages",
+}
+
+
+@dataclass(slots=True)
+class ProcessorPerf:
+    """Подробные замеры времени работы одного обработчика."""
+
+    # Число вызовов и суммарное время по этапам (см. PHASES); вызовом
+    # считается обработка целой пачки пользователей или блогов либо
+    # сообщений за одни локальные сутки из пачки
+    calls: dict[str, int] = field(default_factory=dict)
+    total: dict[str, float] = field(default_factory=dict)
+    # Время обработки сообщений по локальным суткам
+    days: dict[date, float] = field(default_factory=dict)
+
+    def put(self, phase: str, duration: float, day: date | None = None) -> None:
+        self.calls[phase] = self.calls.get(phase, 0) + 1
+        self.total[phase] = self.total.get(phase, 0.0) + duration
+        if day is not None:
+            self.days[day] = self.days.get(day, 0.0) + duration
+
+    def merge(self, other: "ProcessorPerf") -> None:
+        """Добавляет замеры из другого процесса (например, из куска)."""
+        for phase, calls in other.calls.items():
+            self.calls[phase] = self.calls.get(phase, 0) + calls
+        for phase, duration in other.total.items():
+            self.total[phase] = self.total.get(phase, 0.0) + duration
+        for day, duration in other.days.items():
+            self.days[day] = self.days.get(day, 0.0) + duration
+
+    def to_json(self) -> dict[str, Any]:
+        days = sorted(self.days.values())
+        return {
+            "phases": {
+                phase: {"calls": self.calls[phase], "total": self.total[phase]} for phase in self.total
+            },
+            "day_latency": {
+                "days": len(days),
+                "p50": quantile(days, 0.5),
+                "p99": quantile(days, 0.99),
+                "max": days[-1] if days else None,
+            },
+        }
+
+
+def quantile(sorted_values: list[float], q: float) -> float | None:
+    """Квантиль уже отсортированного списка (ближайшее значение сверху)."""
+    if not sorted_values:
+        return None
+    idx = min(len(sorted_values) - 1, max(0, int(len(sorted_values) * q + 0.5) - 1))
+    return sorted_values[idx]
+
+
+def get_profile_stats(profiler: cProfile.Profile) -> dict[Any, Any]:
+    """Возвращает сырую статистику профилировщика в виде, пригодном для
+    передачи между процессами через pickle.
+    """
+    profiler.create_stats()
+    return dict(profiler.stats)
+
+
+def dump_profile_stats(path: Path, stats_list: Iterable[dict[Any, Any]]) -> None:
+    """Объединяет сырую статистику профилировщиков (например, одного
+    обработчика из разных кусков) и сохраняет её в .prof файл, который
+    читается модулем pstats, snakeviz и другими просмотрщиками.
+    """
+    result = pstats.Stats()
+    for stats in stats_list:
+        item = pstats.Stats()
+        item.stats = stats  # type: ignore[attr-defined]
+        item.get_top_level_stats()
+        result.add(item)
+    result.dump_stats(path)
+
+
+def write_perf_json(path: Path, data: dict[str, Any]) -> None:
+    with path.open("w", encoding="utf-8") as fp:
+        json.dump(data, fp, ensure_ascii=False, indent=2, default=str)
+        fp.write("\n")
@@ -0,0 +1,425 @@
+import multiprocessing
+import pickle
+import signal
+import time
+import traceback
+import typing
+from dataclasses import dataclass, field
+from multiprocessing.process import BaseProcess
+from queue import Empty, Full
+from typing import Any
+
+from tabun_stat.perf import ProcessorPerf
+from tabun_stat.processors.base import BaseProcessor
+
+if typing.TYPE_CHECKING:
+    from multiprocessing.queues import Queue
+
+
+@dataclass(slots=True)
+class WorkerInfo:
+    # Индексы обработчиков (в списке обработчиков TabunStat), которые
+    # выполняются в этом процессе
+    processors: list[int]
+
+    process: BaseProcess | None = None
+    queue: "Queue[bytes | None] | None" = None
+
+    # Время работы процесса целиком (от запуска до завершения)
+    wall_time: float = 0.0
+    # Сколько из этого времени процесс провёл в обработчиках
+    busy_time: float = 0.0
+    # Сколько процесс простаивал в ожидании данных
+    idle_time: float = 0.0
+
+    done: bool = False
+    error: str | None = None
+    # Была ли ошибка уже выброшена в основном процессе
+    error_raised: bool = False
+
+    names: list[str] = field(default_factory=list)
+
+
+class ProcessorsPool:
+    """Пул процессов, между которыми распределены обработчики. Каждый
+    процесс владеет своим подмножеством обработчиков и получает от основного
+    процесса тот же самый поток вызовов в том же самом порядке, что позволяет
+    сохранить гарантию хронологического порядка постов и комментов.
+
+    Данные сериализуются через pickle один раз и рассылаются всем процессам
+    как есть. Источник данных тоже передаётся в процессы через pickle, поэтому
+    он должен это поддерживать (и переподключаться в методе ``start``).
+    """
+
+    def __init__(
+        self,
+        processors: list[BaseProcessor],
+        assignment: list[list[int]],
+        stat_kwargs: dict[str, Any],
+        *,
+        queue_size: int = 8,
+    ):
+        """
+        :param processors: все обработчики
+        :param assignment: распределение обработчиков по процессам: список
+          процессов, каждый элемент которого — список индексов обработчиков
+        :param stat_kwargs: аргументы для создания объекта TabunStat внутри
+          каждого процесса (включая источник данных)
+        :param queue_size: сколько пачек данных может стоять в очереди
+          к каждому процессу
+        """
+        self.processors = processors
+        self.workers = [WorkerInfo(processors=list(x)) for x in assignment if x]
+        self.stat_kwargs = stat_kwargs
+        self.queue_size = queue_size
+
+        # Время работы каждого обработчика по его индексу; заполняется
+        # по завершении работы процессов
+        self.perf: dict[int, float] = {}
+        # Подробные замеры и статистика профилировщиков (если профилирование
+        # включено) каждого обработчика по его индексу
+        self.perf_details: dict[int, ProcessorPerf] = {}
+        self.profile_stats: dict[int, dict[Any, Any]] = {}
+
+        # Сколько времени основной процесс провёл в ожидании места в очередях
+        # (если он больше нуля, то процессы-обработчики не успевают за источником)
+        self.send_time = 0.0
+
+        # spawn вместо fork, чтобы процессы не унаследовали открытые
+        # соединения с базой данных и потоки основного процесса
+        self._ctx = multiprocessing.get_context("spawn")
+        self._results: "Queue[tuple[Any, ...]] | None" = None
+        self._started = False
+
+    def start(self) -> None:
+        if self._started:
+            raise RuntimeError("Pool is already started")
+        self._started = True
+
+        self._results = self._ctx.Queue()
+
+        for worker_idx, worker in enumerate(self.workers):
+            processors = [self.processors[i] for i in worker.processors]
+            worker.names = [type(p).__name__ for p in processors]
+            worker.queue = self._ctx.Queue(self.queue_size)
+            worker.process = self._ctx.Process(
+                target=_worker_main,
+                args=(worker_idx, self.stat_kwargs, processors, worker.queue, self._results),
+                name=f"tabun_stat-worker-{worker_idx}",
+                daemon=True,
+            )
+            worker.process.start()
+
+    def send(self, name: str, *args: object) -> None:
+        """Отправляет всем процессам вызов метода TabunStat с указанными
+        аргументами. Сериализация выполняется один раз для всех процессов.
+        """
+        payload = pickle.dumps((name, args), protocol=pickle.HIGHEST_PROTOCOL)
+
+        tm = time.monotonic()
+        for worker in self.workers:
+            self._put(worker, payload)
+        self.send_time += time.monotonic() - tm
+
+        self._check_results(block=False)
+
+    def finish(self) -> None:
+        """Завершает работу всех процессов и собирает с них замеры
+        производительности. Если в каком-то процессе произошла ошибка,
+        выбрасывает RuntimeError с её описанием.
+        """
+        if not self._started:
+            return
+
+        for worker in self.workers:
+            if not worker.done:
+                self._put(worker, None)
+
+        while not all(w.done for w in self.workers):
+            self._check_results(block=True)
+
+        for worker in self.workers:
+            assert worker.process is not None
+            worker.process.join()
+
+        errors = [
+            f"Worker #{i}:\n{w.error}"
+            for i, w in enumerate(self.workers)
+            if w.error is not None and not w.error_raised
+        ]
+        if errors:
+            raise RuntimeError("Processors failed in worker processes:\n" + "\n".join(errors))
+
+    def _put(self, worker: WorkerInfo, payload: bytes | None) -> None:
+        assert worker.queue is not None and worker.process is not None
+
+        # Если процесс умер, то очередь никогда не освободится, поэтому
+        # не ждём вечно, а периодически проверяем его состояние
+        while True:
+            try:
+                worker.queue.put(payload, timeout=1.0)
+                return
+            except Full:
+                if not worker.process.is_alive():
+                    worker.done = True
+                    raise RuntimeError(
+                        f"Worker process {worker.process.name} died (exit code {worker.process.exitcode})"
+                    ) from None
+
+    def _check_results(self, *, block: bool) -> None:
+        assert self._results is not None
+
+        while True:
+            try:
+                item = self._results.get(timeout=1.0) if block else self._results.get_nowait()
+            except Empty:
+                if not block:
+                    return
+                # Процесс может умереть, так ничего и не сообщив (например,
+                # из-за OOM killer)
+                for worker in self.workers:
+                    assert worker.process is not None
+                    if not worker.done and not worker.process.is_alive():
+                        worker.done = True
+                        worker.error = f"Process died (exit code {worker.process.exitcode})"
+                return
+
+            kind, worker_idx = item[0], item[1]
+            worker = self.workers[worker_idx]
+
+            if kind == "error":
+                worker.error = item[2]
+                if not block:
+                    worker.error_raised = True
+                    raise RuntimeError(f"Processors failed in worker process #{worker_idx}:\n{item[2]}")
+
+            elif kind == "done":
+                perf, worker.wall_time, worker.idle_time = item[2], item[3], item[4]
+                worker.busy_time = sum(perf)
+                for local_idx, duration in enumerate(perf):
+                    self.perf[worker.processors[local_idx]] = duration
+                for local_idx, details in enumerate(item[5]):
+                    self.perf_details[worker.processors[local_idx]] = details
+                for local_idx, profile_stats in enumerate(item[6]):
+                    self.profile_stats[worker.processors[local_idx]] = profile_stats
+                worker.done = True
+
+            if block:
+                return
+
+
+def _worker_main(
+    worker_idx: int,
+    stat_kwargs: dict[str, Any],
+    processors: list[BaseProcessor],
+    queue: "Queue[bytes | None]",
+    results: "Queue[tuple[Any, ...]]",
+) -> None:
+    # pylint: disable=import-outside-toplevel,protected-access
+    from tabun_stat.stat import TabunStat
+
+    # Прерыванием работы управляет основной процесс: он сам сообщит, когда
+    # нужно вызвать stop у обработчиков
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    started_at = time.monotonic()
+    idle_time = 0.0
+    error: str | None = None
+
+    stat = TabunStat(**stat_kwargs)
+    for p in processors:
+        stat.add_processor(p)
+    stat._perfmon_reset()
+
+    try:
+        stat.source.start(stat)
+    except BaseException:  # pylint: disable=broad-exception-caught
+        error = traceback.format_exc()
+        results.put(("error", worker_idx, error))
+
+    while True:
+        tm = time.monotonic()
+        item = queue.get()
+        idle_time += time.monotonic() - tm
+        if item is None:
+            break
+
+        name, args = pickle.loads(item)
+        # После ошибки обработчики в неконсистентном состоянии, поэтому
+        # не кормим их данными, но stop всё равно вызываем, как это делается
+        # и в основном процессе
+        if error is not None and name != "_stop_processors":
+            continue
+
+        try:
+            getattr(stat, name)(*args)
+        except BaseException:  # pylint: disable=broad-exception-caught
+            error = traceback.format_exc()
+            results.put(("error", worker_idx, error))
+
+    results.put(
+        (
+            "done",
+            worker_idx,
+            stat._perf,
+            time.monotonic() - started_at,
+            idle_time,
+            stat._perf_details,
+            stat._export_profile_stats(),
+        )
+    )
+
+    stat.destroy()
+    stat.source.destroy()
+
+
+@dataclass(slots=True)
+class ShardInfo:
+    # Параметры TabunStat для этого куска (в том числе границы дат)
+    stat_kwargs: dict[str, Any]
+    # Дополнительные фильтры для пользователей
+    users_filters: dict[str, Any]
+    # Передавать ли пользователей обработчикам (загружаются в любом случае)
+    feed_users: bool
+
+    process: BaseProcess | None = None
+
+    wall_time: float = 0.0
+    # Состояния обработчиков после обработки куска (в порядке обработчиков)
+    states: list[object] | None = None
+    # Время работы каждого обработчика внутри куска
+    perf: list[float] = field(default_factory=list)
+    # Подробные замеры и статистика профилировщиков каждого обработчика
+    perf_details: list[ProcessorPerf] = field(default_factory=list)
+    profile_stats: list[dict[Any, Any]] = field(default_factory=list)
+
+    done: bool = False
+    error: str | None = None
+
+
+class ShardsRunner:
+    """Запускает копии обработчиков (потомков MergeableProcessor)
+    в нескольких процессах, каждый из которых обрабатывает свой кусок
+    данных, и собирает их состояния для последующего слияния.
+    """
+
+    def __init__(self, processors: list[BaseProcessor], shards: list[ShardInfo]):
+        self.processors = processors
+        self.shards = shards
+
+        self._ctx = multiprocessing.get_context("spawn")
+        self._results: "Queue[tuple[Any, ...]] | None" = None
+        self._started = False
+
+    def start(self) -> None:
+        if self._started:
+            raise RuntimeError("Shards are already started")
+        self._started = True
+
+        self._results = self._ctx.Queue()
+        for shard_idx, shard in enumerate(self.shards):
+            shard.process = self._ctx.Process(
+                target=_shard_main,
+                args=(
+                    shard_idx,
+                    shard.stat_kwargs,
+                    shard.users_filters,
+                    shard.feed_users,
+                    self.processors,
+                    self._results,
+                ),
+                name=f"tabun_stat-shard-{shard_idx}",
+                daemon=True,
+            )
+            shard.process.start()
+
+    def finish(self) -> None:
+        """Дожидается завершения обработки всех кусков. Если в каком-то
+        процессе произошла ошибка, выбрасывает RuntimeError с её описанием.
+        """
+        assert self._results is not None
+
+        while not all(s.done for s in self.shards):
+            try:
+                item = self._results.get(timeout=1.0)
+            except Empty:
+                for shard in self.shards:
+                    assert shard.process is not None
+                    if not shard.done and not shard.process.is_alive():
+                        shard.done = True
+                        shard.error = f"Process died (exit code {shard.process.exitcode})"
+                continue
+
+            shard = self.shards[item[1]]
+            shard.done = True
+            if item[0] == "error":
+                shard.error = item[2]
+            else:
+                shard.states, shard.perf, shard.wall_time = item[2], item[3], item[4]
+                shard.perf_details, shard.profile_stats = item[5], item[6]
+
+        for shard in self.shards:
+            assert shard.process is not None
+            shard.process.join()
+
+        errors = [f"Shard #{i}:\n{s.error}" for i, s in enumerate(self.shards) if s.error is not None]
+        if errors:
+            raise RuntimeError("Processors failed in shard processes:\n" + "\n".join(errors))
+
+    def terminate(self) -> None:
+        for shard in self.shards:
+            if shard.process is not None and shard.process.is_alive():
+                shard.process.terminate()
+                shard.process.join()
+
+
+def _shard_main(
+    shard_idx: int,
+    stat_kwargs: dict[str, Any],
+    users_filters: dict[str, Any],
+    feed_users: bool,
+    processors: list[BaseProcessor],
+    results: "Queue[tuple[Any, ...]]",
+) -> None:
+    # pylint: disable=import-outside-toplevel,protected-access
+    from tabun_stat.processors.base import MergeableProcessor
+    from tabun_stat.stat import TabunStat
+
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    started_at = time.monotonic()
+    stat = TabunStat(**stat_kwargs)
+    for p in processors:
+        stat.add_processor(p)
+    stat._perfmon_reset()
+
+    try:
+        stat.source.start(stat)
+        stat._process_users(users_filters, feed_processors=feed_users)
+        stat._process_blogs()
+        stat._process_posts_and_comments()
+
+        states: list[object] = []
+        for idx, p in enumerate(processors):
+            assert isinstance(p, MergeableProcessor)
+            with stat._perfmon(idx, "stop"):
+                states.append(p.export_state())
+
+        results.put(
+            (
+                "done",
+                shard_idx,
+                states,
+                stat._perf,
+                time.monotonic() - started_at,
+                stat._perf_details,
+                stat._export_profile_stats(),
+            )
+        )
+
+    except BaseException:  # pylint: disable=broad-exception-caught
+        results.put(("error", shard_idx, traceback.format_exc()))
+
+    finally:
+        stat.destroy()
+        stat.source.destroy()
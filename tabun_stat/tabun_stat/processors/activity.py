@@ -1,181 +1,482 @@
+import array
+import math
+from bisect import bisect_left
+from collections import Counter
 from dataclasses import dataclass, field
-from datetime import date, datetime, timedelta
-from typing import IO, Sequence
+from datetime import date
+from itertools import compress
+from typing import Iterable, Sequence
 
-from tabun_stat import types, utils
-from tabun_stat.processors.base import BaseProcessor
+from tabun_stat import types
+from tabun_stat.output import RowWriter
+from tabun_stat.processors.base import MergeableProcessor
 from tabun_stat.stat import TabunStat
 
 
+class SlidingDistinctCounter:
+    """Считает число различных пользователей, активных за последние N дней,
+    сразу для нескольких N. Для каждого пользователя хранится последний
+    день активности, а для каждого дня — пользователи, у которых он последний
+    (из этих «корзин» по истечении периода пользователи и выбывают из окна).
+    Поэтому каждый день обходятся только активные в этот день пользователи,
+    и периоды могут быть сколь угодно длинными (90, 365 дней и т.п.).
+
+    Последние дни активности хранятся в массиве по id пользователя (четыре
+    байта на пользователя), так что память зависит от числа пользователей,
+    а не от длины периодов.
+    """
+
+    def __init__(self, periods: Sequence[int]):
+        self.periods = list(periods)
+        self.max_period = max(self.periods, default=1)
+        self.counts = [0] * len(self.periods)
+
+        self._day: int | None = None
+        # Последний день активности по id пользователя (0 — давно не был
+        # активен или не был вообще)
+        self._last_seen = array.array("i")
+        self._buckets: dict[int, set[int]] = {}  # {day: {user_id, ...}}
+
+    def add_day(self, day: int, users: Iterable[int]) -> list[int]:
+        """Добавляет пользователей, активных в указанный день (номер дня,
+        например date.toordinal()), и возвращает число активных пользователей
+        за каждый из периодов, заканчивающихся этим днём. Дни должны идти
+        по возрастанию.
+        """
+        if self._day is not None:
+            assert day > self._day
+            if day - self._day > self.max_period:
+                # Все старые пользователи выбыли из всех окон
+                self._last_seen = array.array("i", bytes(len(self._last_seen) * self._last_seen.itemsize))
+                self._buckets.clear()
+                self.counts = [0] * len(self.periods)
+            else:
+                for d in range(self._day + 1, day + 1):
+                    self._expire(d)
+        self._day = day
+
+        periods = self.periods
+        counts = self.counts
+        last_seen = self._last_seen
+        buckets = self._buckets
+        bucket = buckets.setdefault(day, set())
+
+        for user_id in users:
+            if user_id >= len(last_seen):
+                last_seen.frombytes(bytes((user_id + 1 - len(last_seen)) * last_seen.itemsize))
+            last_day = last_seen[user_id]
+            if last_day == day:
+                continue
+            for i, period in enumerate(periods):
+                if last_day <= day - period:
+                    counts[i] += 1
+            if last_day:
+                buckets[last_day].discard(user_id)
+            last_seen[user_id] = day
+            bucket.add(user_id)
+
+        return list(counts)
+
+    def _expire(self, day: int) -> None:
+        # Окно периода N в день day — это дни (day - N, day]
+        for i, period in enumerate(self.periods):
+            bucket = self._buckets.get(day - period)
+            if bucket:
+                self.counts[i] -= len(bucket)
+
+        # Этот день уже вышел из всех окон
+        old_bucket = self._buckets.pop(day - self.max_period, None)
+        if old_bucket:
+            for user_id in old_bucket:
+                self._last_seen[user_id] = 0
+
+
+def _hash64(value: int) -> int:
+    # splitmix64
+    value = (value + 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF
+    value = ((value ^ (value >> 30)) * 0xBF58476D1CE4E5B9) & 0xFFFFFFFFFFFFFFFF
+    value = ((value ^ (value >> 27)) * 0x94D049BB133111EB) & 0xFFFFFFFFFFFFFFFF
+    return value ^ (value >> 31)
+
+
+class SlidingHyperLogLog:
+    """Приблизительный вариант SlidingDistinctCounter (скользящий
+    HyperLogLog). Каждый регистр хранит не одно значение, а список пар
+    (день, значение) с убывающими значениями — только те, которые ещё могут
+    оказаться максимумом для какого-нибудь окна. Память не зависит от числа
+    пользователей (примерно 2**precision регистров по нескольку пар), а
+    относительная погрешность около 1.04 / sqrt(2**precision).
+    """
+
+    def __init__(self, periods: Sequence[int], *, precision: int = 12):
+        if not 4 <= precision <= 18:
+            raise ValueError("precision must be in range 4..18")
+        self.periods = list(periods)
+        self.max_period = max(self.periods, default=1)
+        self.precision = precision
+
+        self._m = 1 << precision
+        self._alpha = 0.7213 / (1 + 1.079 / self._m)
+        self._registers: list[list[tuple[int, int]]] = [[] for _ in range(self._m)]
+        self._day: int | None = None
+
+    def add_day(self, day: int, users: Iterable[int]) -> list[int]:
+        """Аналогично SlidingDistinctCounter.add_day, но числа приблизительные."""
+        assert self._day is None or day > self._day
+        self._day = day
+
+        precision = self.precision
+        value_bits = 64 - precision
+        value_mask = (1 << value_bits) - 1
+        registers = self._registers
+
+        for user_id in users:
+            h = _hash64(user_id)
+            rho = value_bits - (h & value_mask).bit_length() + 1
+            reg = registers[h >> value_bits]
+            # Значения, не превосходящие нового, больше никогда не будут
+            # максимумом: новое значение свежее
+            while reg and reg[-1][1] <= rho:
+                reg.pop()
+            reg.append((day, rho))
+
+        oldest_day = day - self.max_period + 1
+        counts: list[int] = []
+        for period in self.periods:
+            first_day = day - period + 1
+            total = 0.0
+            zeros = 0
+            for reg in registers:
+                if reg and reg[0][0] < oldest_day:
+                    del reg[: bisect_left(reg, (oldest_day,))]
+                # Пары упорядочены по дням, и значения убывают, так что
+                # первая пара окна — максимум в окне
+                pos = bisect_left(reg, (first_day,)) if reg and reg[0][0] < first_day else 0
+                if pos < len(reg):
+                    total += 2.0 ** -reg[pos][1]
+                else:
+                    total += 1.0
+                    zeros += 1
+            counts.append(self._estimate(total, zeros))
+
+        return counts
+
+    def _estimate(self, total: float, zeros: int) -> int:
+        m = self._m
+        estimate = self._alpha * m * m / total
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * math.log(m / zeros)
+        return round(estimate)
+
+
+class UserBitset:
+    """Множество id пользователей в виде битовой карты (бит на каждый
+    возможный id). Для всех пользователей Табуна занимает десятки килобайт
+    вместо мегабайт у set.
+    """
+
+    __slots__ = ("bits",)
+
+    def __init__(self) -> None:
+        self.bits = bytearray()
+
+    def update(self, user_ids: Iterable[int]) -> None:
+        bits = self.bits
+        for user_id in user_ids:
+            byte_idx = user_id >> 3
+            if byte_idx >= len(bits):
+                bits.extend(bytes(byte_idx + 1 - len(bits)))
+            bits[byte_idx] |= 1 << (user_id & 7)
+
+    def to_int(self) -> int:
+        """Возвращает множество как одно большое число, с которым удобно
+        делать операции над множествами (&, |, & ~) и считать их размер
+        через int.bit_count().
+        """
+        return int.from_bytes(self.bits, "little")
+
+    def __len__(self) -> int:
+        return self.to_int().bit_count()
+
+
 @dataclass(slots=True)
 class ActivityStat:
     # Минимальный рейтинг пользователей, которые считаются в текущем объекте
     min_rating: float | None = None
 
-    # Список активности по дням. Каждый элемент — множество айдишников
-    # пользователей, активных в этот день
-    # (количество хранимых дней ограничено максимальным периодом в опции periods)
-    # Первый set — пользователи, писавшие посты; второй — писавшие комменты
-    activity: list[tuple[set[int], set[int]]] = field(default_factory=list)
+    # Число активных пользователей за точно считаемые периоды
+    window: SlidingDistinctCounter | None = None
+    # И за приблизительно считаемые (см. hll_min_period)
+    hll: SlidingHyperLogLog | None = None
 
     # Айдишники юзеров с постами за всё время
-    users_with_posts: set[int] = field(default_factory=set)
+    users_with_posts: UserBitset = field(default_factory=UserBitset)
 
     # Айдишники юзеров с комментами за всё время
-    users_with_comments: set[int] = field(default_factory=set)
+    users_with_comments: UserBitset = field(default_factory=UserBitset)
+
+    # Число дней, в которые юзер был активен, по id юзера
+    # (считается только с опцией days_histogram)
+    active_days: "array.array[int] | None" = None
 
-    # Файл, в который будет записываться статистика по окончании очередного дня
-    fp: IO[str] | None = None
 
+# Авторы постов и комментов за один день (отсортированные id)
+DayAuthors = tuple["array.array[int]", "array.array[int]"]
 
-class ActivityProcessor(BaseProcessor):
+
+class ActivityProcessor(MergeableProcessor):
     def __init__(
         self,
         *,
         periods: Sequence[int] = (1, 7, 30),
         rating_thresholds: Sequence[float] = (0.0,),
+        hll_min_period: int | None = None,
+        hll_precision: int = 12,
+        days_histogram: bool = False,
     ):
+        """
+        :param periods: за сколько последних дней считать активных
+          пользователей
+        :param rating_thresholds: минимальные рейтинги пользователей, для
+          которых считается отдельная статистика
+        :param hll_min_period: если задано, то число активных пользователей
+          за периоды не короче этого считается приблизительно через
+          HyperLogLog — памяти нужно меньше, а погрешность около
+          1.04 / sqrt(2 ** hll_precision)
+        :param hll_precision: точность HyperLogLog (от 4 до 18)
+        :param days_histogram: посчитать для каждого пользователя число дней,
+          в которые он был активен, и сохранить распределение этих чисел
+          (activity_days.csv) и его квантили (в active_users.txt)
+        """
         super().__init__()
         self.periods = periods
-        self._max_period = max(self.periods)
+        self.rating_thresholds = list(rating_thresholds)
+        self.hll_min_period = hll_min_period
+        self.hll_precision = hll_precision
+        self.days_histogram = days_histogram
 
-        self._stats = []
-        for min_rating in [None] + list(rating_thresholds):
-            self._stats.append(ActivityStat(min_rating=min_rating))
+        if hll_min_period is not None and any(x >= hll_min_period for x in periods):
+            # Проверяем точность сразу, а не в конце обработки
+            SlidingHyperLogLog((), precision=hll_precision)
 
-        self._user_ratings: dict[int, float] = {}  # {user_id: rating}
-        self._last_day: date | None = None
+        # Авторы по дням ({date.toordinal(): авторы}). Окна активности
+        # считаются только в stop: их нельзя посчитать по кусочкам, а
+        # рейтинги пользователей нужны текущие, а не на момент обработки
+        self._days: dict[int, DayAuthors] = {}
 
-    def start(self, stat: TabunStat) -> None:
-        super().start(stat)
-        header = ["Дата"]
-        for period in self.periods:
-            if period == 1:
-                header.append("Активны в этот день")
-            else:
-                header.append(f"Активны в последние {period} дней")
-
-        for item in self._stats:
-            filename = "activity.csv"
-            if item.min_rating is not None:
-                filename = f"activity_{item.min_rating:.2f}.csv"
-            item.fp = (stat.destination / filename).open("w", encoding="utf-8")
-            item.fp.write(utils.csvline(*header))
-
-    def process_user(self, stat: TabunStat, user: types.User) -> None:
-        # Собираем рейтинги пользователей
-        self._user_ratings[user.id] = user.rating
+        # Пользователи, активные в текущий день: первый set — писавшие посты;
+        # второй — писавшие комменты
+        self._today: tuple[set[int], set[int]] = (set(), set())
+        self._last_day: int | None = None
 
     def process_post(self, stat: TabunStat, post: types.Post) -> None:
         assert post.created_at_local is not None
-
-        if post.author_id in self._user_ratings:
-            rating = self._user_ratings[post.author_id]
-        else:
-            stat.log(0, f"WARNING: activity: unknown author {post.author_id} of post {post.id}")
-            rating = 0.0
-
-        self._put_activity(0, post.author_id, post.created_at_local, rating)
+        self._set_day(post.created_at_local.date().toordinal())
+        self._today[0].add(post.author_id)
 
     def process_comment(self, stat: TabunStat, comment: types.Comment) -> None:
         assert comment.created_at_local is not None
+        self._set_day(comment.created_at_local.date().toordinal())
+        self._today[1].add(comment.author_id)
 
-        if comment.author_id in self._user_ratings:
-            rating = self._user_ratings[comment.author_id]
-        else:
-            stat.log(0, f"WARNING: activity: unknown author {comment.author_id} of comment {comment.id}")
-            rating = 0.0
+    def process_messages_batch(self, stat: TabunStat, batch: types.MessagesBatch) -> None:
+        for day, lo, hi in batch.iter_days():
+            self._set_day(day.toordinal())
 
-        self._put_activity(1, comment.author_id, comment.created_at_local, rating)
+            author_id = batch.author_id[lo:hi]
+            is_comment = batch.is_comment[lo:hi]
 
-    def _put_activity(self, idx: int, user_id: int, created_at_local: datetime, rating: float) -> None:
-        # idx: 0 - пост, 1 - коммент
-        day = created_at_local.date()
+            # 0 - посты, 1 - комменты
+            self._today[0].update(compress(author_id, [x ^ 1 for x in is_comment]))
+            self._today[1].update(compress(author_id, is_comment))
 
-        if self._last_day is None:
-            # Если это первый вызов _put_activity
+    def _set_day(self, day: int) -> None:
+        if day != self._last_day:
+            assert self._last_day is None or day > self._last_day  # TabunStat нам гарантирует это
+            self._flush_today()
             self._last_day = day
-            for item in self._stats:
-                item.activity.append((set(), set()))
-                assert len(item.activity) == 1
-
-        else:
-            assert day >= self._last_day  # TabunStat нам гарантирует это
-
-            # Если день изменился, то сливаем всю прошлую статистику
-            # в результат и добавляем следующий день на обработку
-            while day > self._last_day:
-                for item in self._stats:
-                    self._flush_activity(item)
-                self._last_day += timedelta(days=1)
-                # Удаляем лишние старые дни и добавляем новый день
-                for item in self._stats:
-                    if self._max_period > 1:
-                        del item.activity[: -(self._max_period - 1)]
-                        item.activity.append((set(), set()))
-                    else:
-                        item.activity[0][0].clear()
-                        item.activity[0][1].clear()
-
-        for item in self._stats:
-            if item.min_rating is None or rating >= item.min_rating:
-                item.activity[-1][idx].add(user_id)
-
-    def _flush_activity(self, item: ActivityStat) -> None:
-        row: list[object] = [str(self._last_day)]
 
+    def _flush_today(self) -> None:
+        """Переносит пользователей текущего дня в _days."""
+        posts, comments = self._today
+        if self._last_day is None or not posts and not comments:
+            return
+        self._put_day(self._last_day, (array.array("I", sorted(posts)), array.array("I", sorted(comments))))
+        self._today = (set(), set())
+
+    def _put_day(self, day: int, authors: DayAuthors) -> None:
+        old = self._days.get(day)
+        if old is None:
+            self._days[day] = authors
+            return
+        # Один и тот же локальный день может попасть в два соседних куска
+        self._days[day] = (
+            array.array("I", sorted(set(old[0]).union(authors[0]))),
+            array.array("I", sorted(set(old[1]).union(authors[1]))),
+        )
+
+    def export_state(self) -> dict[int, DayAuthors]:
+        self._flush_today()
+        return self._days
+
+    def merge_state(self, state: object) -> None:
+        assert isinstance(state, dict)
+        for day, authors in state.items():
+            self._put_day(day, authors)
+
+    def stop(self, stat: TabunStat) -> None:
+        self._flush_today()
+
+        authors: set[int] = set()
+        for day_authors in self._days.values():
+            authors.update(day_authors[0])
+            authors.update(day_authors[1])
+        unknown = sorted(x for x in authors if x not in stat.users)
+        if unknown:
+            stat.log(
+                0, f"WARNING: activity: unknown authors of posts or comments: {', '.join(map(str, unknown))}"
+            )
+
+        header = ["Дата"]
         for period in self.periods:
-            # Собираем все id за последние period дней
-            all_users: set[int] = set()
+            if period == 1:
+                header.append("Активны в этот день")
+            else:
+                header.append(f"Активны в последние {period} дней")
 
-            for p, c in item.activity[-period:]:
-                all_users = all_users | p | c
-                item.users_with_posts = item.users_with_posts | p
-                item.users_with_comments = item.users_with_comments | c
+        exact_periods = [x for x in self.periods if self.hll_min_period is None or x < self.hll_min_period]
+        hll_periods = [
+            x for x in self.periods if self.hll_min_period is not None and x >= self.hll_min_period
+        ]
 
-            row.append(len(all_users))
+        for min_rating in [None] + self.rating_thresholds:
+            item = ActivityStat(
+                min_rating=min_rating,
+                window=SlidingDistinctCounter(exact_periods) if exact_periods else None,
+                hll=SlidingHyperLogLog(hll_periods, precision=self.hll_precision) if hll_periods else None,
+                active_days=array.array("I") if self.days_histogram else None,
+            )
 
-        # И пишем собранные числа в статистику
-        assert item.fp is not None
-        item.fp.write(utils.csvline(*row))
+            # Неизвестные авторы считаются с нулевым рейтингом
+            allowed: set[int] | None = None
+            if min_rating is not None:
+                allowed = {x for x in authors if (stat.users.get_rating(x) or 0.0) >= min_rating}
 
-    def stop(self, stat: TabunStat) -> None:
-        for item in self._stats:
-            if self._last_day is not None:
-                self._flush_activity(item)
-            if item.fp is not None:
-                item.fp.close()
-                item.fp = None
-
-            if item.min_rating is not None:
-                filename = f"active_users_{item.min_rating:.2f}.txt"
-                users_all = len([x for x in self._user_ratings.values() if x >= item.min_rating])
-                header = f"# Статистика пользователей с рейтингом {item.min_rating:.2f} и больше\n\n"
+            filename = "activity.csv"
+            if min_rating is not None:
+                filename = f"activity_{min_rating:.2f}.csv"
+            with stat.open_csv(filename) as fp:
+                fp.write(*header)
+                # Статистика пишется за каждый день, начиная с первого дня
+                # с активностью, даже если в какие-то дни активных не было
+                if self._days:
+                    for day in range(min(self._days), max(self._days) + 1):
+                        day_posts: Sequence[int]
+                        day_comments: Sequence[int]
+                        day_posts, day_comments = self._days.get(day, ((), ()))
+                        if allowed is not None:
+                            day_posts = [x for x in day_posts if x in allowed]
+                            day_comments = [x for x in day_comments if x in allowed]
+                        self._put_activity_day(item, day, day_posts, day_comments, fp)
+
+            if min_rating is not None:
+                filename = f"active_users_{min_rating:.2f}.txt"
+                users_all = sum(1 for x in stat.users.rating if x >= min_rating)
+                header_txt = f"# Статистика пользователей с рейтингом {min_rating:.2f} и больше\n\n"
             else:
                 filename = "active_users.txt"
-                users_all = len(self._user_ratings)
-                header = "# Статистика пользователей с любым рейтингом\n\n"
-
-            with (stat.destination / filename).open("w", encoding="utf-8") as fp:
-                fp.write(header)
-
-                fp.write(f"Всего юзеров: {users_all}\n")
-                fp.write(f"Юзеров с постами: {len(item.users_with_posts)}\n")
-                fp.write(f"Юзеров с комментами: {len(item.users_with_comments)}\n")
-                fp.write(
-                    f"Юзеров с постами и комментами: {len(item.users_with_posts & item.users_with_comments)}\n"
-                )
-                fp.write(
-                    f"Юзеров с постами или комментами: {len(item.users_with_posts | item.users_with_comments)}\n"
-                )
-                fp.write(
-                    f"Юзеров без постов и без комментов: {users_all - len(item.users_with_posts | item.users_with_comments)}\n"
-                )
-                fp.write(
-                    f"Юзеров с постами, но без комментов: {len(item.users_with_posts - item.users_with_comments)}\n"
-                )
-                fp.write(
-                    f"Юзеров с комментами, но без постов: {len(item.users_with_comments - item.users_with_posts)}\n"
-                )
+                users_all = len(stat.users)
+                header_txt = "# Статистика пользователей с любым рейтингом\n\n"
+
+            posts = item.users_with_posts.to_int()
+            comments = item.users_with_comments.to_int()
+            active = posts | comments
+
+            with (stat.destination / filename).open("w", encoding="utf-8") as txt:
+                txt.write(header_txt)
+
+                txt.write(f"Всего юзеров: {users_all}\n")
+                txt.write(f"Юзеров с постами: {posts.bit_count()}\n")
+                txt.write(f"Юзеров с комментами: {comments.bit_count()}\n")
+                txt.write(f"Юзеров с постами и комментами: {(posts & comments).bit_count()}\n")
+                txt.write(f"Юзеров с постами или комментами: {active.bit_count()}\n")
+                txt.write(f"Юзеров без постов и без комментов: {users_all - active.bit_count()}\n")
+                txt.write(f"Юзеров с постами, но без комментов: {(posts & ~comments).bit_count()}\n")
+                txt.write(f"Юзеров с комментами, но без постов: {(comments & ~posts).bit_count()}\n")
+
+                if item.active_days is not None:
+                    histogram = self._write_days_histogram(stat, item)
+                    txt.write(self._format_days_quantiles(histogram))
 
         super().stop(stat)
+
+    def _put_activity_day(
+        self,
+        item: ActivityStat,
+        day: int,
+        posts: Iterable[int],
+        comments: Iterable[int],
+        fp: RowWriter,
+    ) -> None:
+        """Добавляет в статистику пользователей, активных в указанный день,
+        и пишет строку статистики за этот день.
+        """
+        active = set(posts).union(comments)
+
+        counts: dict[int, int] = {}
+        for counter in (item.window, item.hll):
+            if counter is not None:
+                counts.update(zip(counter.periods, counter.add_day(day, active)))
+
+        item.users_with_posts.update(posts)
+        item.users_with_comments.update(comments)
+
+        active_days = item.active_days
+        if active_days is not None and active:
+            max_user_id = max(active)
+            if max_user_id >= len(active_days):
+                active_days.frombytes(bytes((max_user_id + 1 - len(active_days)) * active_days.itemsize))
+            for user_id in active:
+                active_days[user_id] += 1
+
+        fp.write(str(date.fromordinal(day)), *(counts[x] for x in self.periods))
+
+    def _write_days_histogram(self, stat: TabunStat, item: ActivityStat) -> dict[int, int]:
+        """Сохраняет распределение юзеров по числу дней активности
+        и возвращает его ({число дней: число юзеров}).
+        """
+        assert item.active_days is not None
+        histogram = dict(sorted(Counter(x for x in item.active_days if x).items()))
+        total = sum(histogram.values())
+
+        filename = "activity_days.csv"
+        if item.min_rating is not None:
+            filename = f"activity_days_{item.min_rating:.2f}.csv"
+
+        with stat.open_csv(filename) as fp:
+            fp.write("Дней с активностью", "Юзеров", "Юзеров с таким или меньшим числом дней, %")
+            cumulative = 0
+            for days, count in histogram.items():
+                cumulative += count
+                fp.write(days, count, f"{cumulative * 100.0 / total:.2f}")
+
+        return histogram
+
+    def _format_days_quantiles(self, histogram: dict[int, int]) -> str:
+        total = sum(histogram.values())
+        if not total:
+            return ""
+
+        result = ["\nДней с активностью у активных юзеров:\n"]
+        for label, q in (("медиана", 0.5), ("90-й перцентиль", 0.9), ("99-й перцентиль", 0.99)):
+            # Ближайший ранг: наименьшее число дней, которого не превышает
+            # доля q юзеров
+            rank = max(1, math.ceil(q * total))
+            cumulative = 0
+            for days, count in histogram.items():
+                cumulative += count
+                if cumulative >= rank:
+                    result.append(f"{label}: {days}\n")
+                    break
+        result.append(f"максимум: {max(histogram)}\n")
+        return "".join(result)
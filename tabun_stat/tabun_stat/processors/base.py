@@ -52,6 +52,17 @@ class BaseProcessor:
     def process_comment(self, stat: "TabunStat", comment: types.Comment) -> None:
         pass
 
+    def process_messages_batch(self, stat: "TabunStat", batch: types.MessagesBatch) -> None:
+        """Обрабатывает сразу пачку постов и комментов (см. MessagesBatch).
+        Если обработчик переопределяет этот метод, то TabunStat вызывает
+        только его вместо ``process_post`` и ``process_comment``.
+        """
+        for message in batch.messages:
+            if isinstance(message, types.Comment):
+                self.process_comment(stat, message)
+            else:
+                self.process_post(stat, message)
+
     def end_messages(
         self,
         stat: "TabunStat",
@@ -59,3 +70,80 @@ class BaseProcessor:
         comments_limits: types.CommentsLimits,
     ) -> None:
         pass
+
+
+def uses_messages_batch(processor: BaseProcessor) -> bool:
+    """Переопределяет ли обработчик метод ``process_messages_batch``."""
+    return type(processor).process_messages_batch is not BaseProcessor.process_messages_batch
+
+
+def uses_messages(processor: BaseProcessor) -> bool:
+    """Переопределяет ли обработчик хоть один метод обработки блогов, постов
+    или комментов (если нет, то ему достаточно пользователей).
+    """
+    cls = type(processor)
+    return any(
+        getattr(cls, name) is not getattr(BaseProcessor, name)
+        for name in (
+            "begin_blogs",
+            "process_blog",
+            "end_blogs",
+            "begin_messages",
+            "process_post",
+            "process_comment",
+            "process_messages_batch",
+            "end_messages",
+        )
+    )
+
+
+class MergeableProcessor(BaseProcessor):
+    """Обработчик, статистику которого можно считать по кусочкам
+    в нескольких процессах одновременно, а потом сложить. Подходит для
+    обработчиков, результат которых не зависит от того, как данные были
+    разделены на части (всякие счётчики и подобное).
+
+    Если включено деление на куски (опция shards у TabunStat), то весь
+    диапазон дат постов и комментов делится на непересекающиеся куски. Для
+    каждого куска в отдельном процессе создаётся копия обработчика, у которой
+    вызываются ``begin_*``, ``process_*`` и ``end_*`` (но не ``start``
+    и ``stop``!), после чего забирается ``export_state``. Блоги в каждый кусок
+    передаются все, пользователи — только в первый кусок (но ``stat.users``
+    в каждом куске заполнен всеми пользователями).
+
+    В основном процессе у исходного обработчика вызывается ``start``, затем
+    ``merge_state`` для каждого куска в хронологическом порядке, а затем
+    ``stop``. Поэтому в ``begin_*``, ``process_*`` и ``end_*`` такие обработчики
+    не должны ничего записывать в каталог со статистикой — всё пишется
+    в ``stop``.
+
+    Состояние таких обработчиков сохраняется в контрольную точку (опция
+    checkpoint у TabunStat), если они не обрабатывают пользователей (см.
+    ``can_resume``): данные пользователей (рейтинг, ник) со временем
+    меняются, так что их статистику нельзя досчитать, её можно только
+    посчитать заново.
+    """
+
+    def export_state(self) -> object:
+        """Возвращает накопленное состояние обработчика. Оно будет передано
+        в другой процесс через pickle.
+        """
+        raise NotImplementedError
+
+    def merge_state(self, state: object) -> None:
+        """Добавляет к текущему состоянию обработчика состояние, полученное
+        из ``export_state`` другой копии этого обработчика. Гарантируется,
+        что состояния передаются в хронологическом порядке кусков.
+        """
+        raise NotImplementedError
+
+
+def can_resume(processor: BaseProcessor) -> bool:
+    """Можно ли продолжить работу обработчика с контрольной точки, то есть
+    обработать им только новые данные: он должен поддерживать слияние
+    статистики и не переопределять метод ``process_user``.
+    """
+    return (
+        isinstance(processor, MergeableProcessor)
+        and type(processor).process_user is BaseProcessor.process_user
+    )
@@ -1,4 +1,4 @@
-from tabun_stat import types, utils
+from tabun_stat import types
 from tabun_stat.processors.base import BaseProcessor
 from tabun_stat.stat import TabunStat
 
@@ -20,7 +20,7 @@ class BirthdaysProcessor(BaseProcessor):
         self._birthdays[day].add(user.id)
 
     def end_users(self, stat: TabunStat, limits: types.UsersLimits) -> None:
-        with (stat.destination / "birthdays.csv").open("w", encoding="utf-8") as fp:
-            fp.write(utils.csvline("День рождения", "Число пользователей"))
+        with stat.open_csv("birthdays.csv") as fp:
+            fp.write("День рождения", "Число пользователей")
             for day, user_ids in sorted(self._birthdays.items(), key=lambda x: len(x[1]), reverse=True):
-                fp.write(utils.csvline(f"{day[0]:02d}.{day[1]:02d}", len(user_ids)))
+                fp.write(f"{day[0]:02d}.{day[1]:02d}", len(user_ids))
@@ -1,8 +1,8 @@
 from dataclasses import dataclass
 from datetime import datetime
 
-from tabun_stat import types, utils
-from tabun_stat.processors.base import BaseProcessor
+from tabun_stat import types
+from tabun_stat.processors.base import MergeableProcessor
 from tabun_stat.stat import TabunStat
 
 
@@ -12,7 +12,7 @@ class CharInfo:
     first_seen_at: datetime
 
 
-class CharsProcessor(BaseProcessor):
+class CharsProcessor(MergeableProcessor):
     special_names: dict[str, str] = {
         '"': "Кавычка",
         ",": "Запятая",
@@ -39,25 +39,36 @@ class CharsProcessor(BaseProcessor):
         self._chars: dict[str, CharInfo] = {}
 
     def process_post(self, stat: TabunStat, post: types.Post) -> None:
-        self._process(post.body, post.created_at)
+        self._process(stat.get_message_text(post).stripped, post.created_at)
         for tag in post.tags:
-            self._process(tag, post.created_at)
+            self._process(tag.strip(), post.created_at)
 
     def process_comment(self, stat: TabunStat, comment: types.Comment) -> None:
-        self._process(comment.body, comment.created_at)
+        self._process(stat.get_message_text(comment).stripped, comment.created_at)
 
     def _process(self, body: str, tm: datetime) -> None:
-        body = body.strip()
-
         for c in body:
             try:
                 self._chars[c].count += 1
             except KeyError:
                 self._chars[c] = CharInfo(count=1, first_seen_at=tm)
 
+    def export_state(self) -> dict[str, CharInfo]:
+        return self._chars
+
+    def merge_state(self, state: object) -> None:
+        assert isinstance(state, dict)
+        # Куски приходят в хронологическом порядке, поэтому дата первого
+        # появления у уже известных символов не меняется
+        for c, info in state.items():
+            try:
+                self._chars[c].count += info.count
+            except KeyError:
+                self._chars[c] = info
+
     def stop(self, stat: TabunStat) -> None:
-        with (stat.destination / "chars.csv").open("w", encoding="utf-8") as fp:
-            fp.write(utils.csvline("Символ", "Сколько раз встретился", "Дата первого появления"))
+        with stat.open_csv("chars.csv") as fp:
+            fp.write("Символ", "Сколько раз встретился", "Дата первого появления")
 
             for c, info in sorted(
                 self._chars.items(),
@@ -70,6 +81,6 @@ class CharsProcessor(BaseProcessor):
                 elif not c.strip():
                     c = repr(c)
                 first_seen_at_str = info.first_seen_at.astimezone(stat.tz).strftime("%Y-%m-%d %H:%M:%S")
-                fp.write(utils.csvline(c, info.count, first_seen_at_str))
+                fp.write(c, info.count, first_seen_at_str)
 
         super().stop(stat)
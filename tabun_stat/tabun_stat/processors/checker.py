@@ -1,11 +1,11 @@
 from datetime import datetime
 
 from tabun_stat import types
-from tabun_stat.processors.base import BaseProcessor
+from tabun_stat.processors.base import MergeableProcessor
 from tabun_stat.stat import TabunStat
 
 
-class CheckerProcessor(BaseProcessor):
+class CheckerProcessor(MergeableProcessor):
     def __init__(self) -> None:
         super().__init__()
         self._last_date: datetime | None = None
@@ -15,6 +15,18 @@ class CheckerProcessor(BaseProcessor):
         super().start(stat)
         self._last_date = None
 
+    def export_state(self) -> tuple[datetime | None, set[int]]:
+        return self._last_date, self._warned_posts
+
+    def merge_state(self, state: object) -> None:
+        # Порядок внутри куска проверен в его процессе, а сами куски
+        # не пересекаются по датам
+        assert isinstance(state, tuple)
+        last_date, warned_posts = state
+        if last_date is not None:
+            self._last_date = last_date
+        self._warned_posts.update(warned_posts)
+
     def stop(self, stat: TabunStat) -> None:
         try:
             import resource  # pylint: disable=import-outside-toplevel
@@ -52,8 +64,12 @@ class CheckerProcessor(BaseProcessor):
         if comment.post_id is None:
             stat.log(0, f"WARNING: comment {comment.id} has no post")
         elif comment.blog_status is None and comment.post_id not in self._warned_posts:
-            stat.log(
-                0,
-                f"WARNING: comment {comment.id} from post {comment.post_id} has unknown blog {comment.blog_id}",
-            )
+            if comment.blog_id is not None:
+                stat.log(
+                    0,
+                    f"WARNING: comment {comment.id} from post {comment.post_id}",
+                    f"has unknown blog {comment.blog_id}",
+                )
+            else:
+                stat.log(0, f"WARNING: comment {comment.id} for unknown post {comment.post_id}")
             self._warned_posts.add(comment.post_id)
@@ -1,8 +1,12 @@
+from bisect import bisect_left
+from collections import Counter
+from dataclasses import dataclass
 from datetime import datetime, timedelta
-from typing import IO, TypedDict
+from typing import TypedDict
 
-from tabun_stat import types, utils
-from tabun_stat.processors.base import BaseProcessor
+from tabun_stat import types
+from tabun_stat.output import RowWriter
+from tabun_stat.processors.base import MergeableProcessor
 from tabun_stat.stat import TabunStat
 
 
@@ -11,7 +15,17 @@ class StatCategory(TypedDict):
     blogs: list[str]
 
 
-class CommentsCountsProcessor(BaseProcessor):
+@dataclass(slots=True)
+class PeriodStat:
+    # Число комментов по категориям
+    counts: list[int]
+    # Крайние комменты периода, для подсчёта всех существующих комментов
+    # (с учётом неизвестных закрытых блогов и лички)
+    first_comment_id: int = 0
+    last_comment_id: int = 0
+
+
+class CommentsCountsProcessor(MergeableProcessor):
     def __init__(
         self,
         *,
@@ -52,42 +66,19 @@ class CommentsCountsProcessor(BaseProcessor):
         self._open_idx = len(self._labels) - 2
         self._all_by_id_idx = len(self._labels) - 1
 
-        # Статистика по категориям
-        self._stat = [0] * (len(self._labels) - 1)
-        # Крайние комменты периода, для подсчёта всех существующих комментов
-        # (с учётом неизвестных закрытых блогов и лички)
-        # Сбрасываются в конце каждого периода
-        self._first_comment_id = 0
-        self._last_comment_id = 0
+        # Статистика для каждого периода
+        self._stat: dict[int, PeriodStat] = {}
 
         # Период подсчёта статистики (по умолчанию неделя)
         self.period = period
         # С какого дня начинать считать статистику
         # (границы суток считаются с учётом часового пояса из настроек)
+        self.first_day = first_day
+        # Текущий период; начинаем его при обработке первого коммента, потому
+        # что при обработке по кусочкам start не вызывается
+        self._period_idx = -1
         self.period_begin = first_day
-        self.period_end = self.period_begin  # Перезапишем в start
-
-        self._fp: IO[str] | None = None
-        self._fp_sum: IO[str] | None = None
-        self._fp_perc: IO[str] | None = None
-
-    def start(self, stat: TabunStat) -> None:
-        super().start(stat)
-        self._fp = (stat.destination / "comments_counts.csv").open("w", encoding="utf-8")
-        self._fp_sum = (stat.destination / "comments_counts_sum.csv").open("w", encoding="utf-8")
-        self._fp_perc = (stat.destination / "comments_counts_perc.csv").open("w", encoding="utf-8")
-
-        # Применяем часовой пояс к периоду
-        self.period_begin = self.period_end = self.period_begin.astimezone(stat.tz)
-        # И начинаем первый период
-        self._increment_period()
-
-        header = ["Дата"] + self._labels
-        header_csv = utils.csvline(*header)
-
-        self._fp.write(header_csv)
-        self._fp_sum.write(header_csv)
-        self._fp_perc.write(utils.csvline(*header[:-1]))  # В процентах комменты из лички не учитываем
+        self.period_end = first_day
 
     def process_blog(self, stat: TabunStat, blog: types.Blog) -> None:
         if blog.slug in self._blogs_categories_slug:
@@ -98,23 +89,61 @@ class CommentsCountsProcessor(BaseProcessor):
         if comment.id == 2498188:
             return
 
-        # Если период закончился, то сохраняем статистику
+        # Если период закончился, то переходим к следующему
+        self._begin_period(stat)
         while comment.created_at >= self.period_end:
-            self._flush_stat(stat)
+            self._increment_period()
+        period_stat = self._get_period_stat()
 
         # Забираем граничные айдишники комментов, чтобы потом по ним угадать
         # общее число комментов
-        if self._first_comment_id == 0 or self._last_comment_id == 0:
-            self._first_comment_id = self._last_comment_id = comment.id
-        elif comment.id > self._last_comment_id:
-            self._last_comment_id = comment.id
+        if period_stat.first_comment_id == 0 or period_stat.last_comment_id == 0:
+            period_stat.first_comment_id = period_stat.last_comment_id = comment.id
+        elif comment.id > period_stat.last_comment_id:
+            period_stat.last_comment_id = comment.id
 
         if comment.blog_status is None:
             return
 
+        # Пишем статистику в выбранную категорию
+        period_stat.counts[self._get_category(comment.blog_id, comment.blog_status)] += 1
+
+    def process_messages_batch(self, stat: TabunStat, batch: types.MessagesBatch) -> None:
+        # Индексы комментов в пачке и их даты (отсортированы по времени)
+        comments = [
+            i for i, is_comment in enumerate(batch.is_comment) if is_comment and batch.id[i] != 2498188
+        ]
+        created_at = [batch.created_at[i] for i in comments]
+
+        self._begin_period(stat)
+        pos = 0
+        while pos < len(comments):
+            # Комменты до конца текущего периода
+            end = bisect_left(created_at, self.period_end.timestamp(), pos)
+            if end == pos:
+                # Период закончился, переходим к следующему
+                self._increment_period()
+                continue
+            period_stat = self._get_period_stat()
+
+            # Граничные айдишники комментов: первый коммент периода
+            # и максимальный id
+            ids = [batch.id[i] for i in comments[pos:end]]
+            if period_stat.first_comment_id == 0 or period_stat.last_comment_id == 0:
+                period_stat.first_comment_id = period_stat.last_comment_id = ids[0]
+            period_stat.last_comment_id = max(period_stat.last_comment_id, max(ids))
+
+            categories = Counter((batch.blog_id[i], batch.blog_status[i]) for i in comments[pos:end])
+            for (blog_id, blog_status), count in categories.items():
+                if blog_status == -1:
+                    continue  # Блог неизвестен
+                period_stat.counts[
+                    self._get_category(blog_id if blog_id != -1 else None, blog_status)
+                ] += count
+            pos = end
+
+    def _get_category(self, blog_id: int | None, blog_status: int) -> int:
         # Вычисляем категорию согласно настройкам
-        blog_id = comment.blog_id
-        blog_status = comment.blog_status
         category_idx = self._blogs_categories.get(blog_id) if blog_id is not None else None
 
         # Если в настройках ничего, то используем одну из встроенных категорий
@@ -129,22 +158,29 @@ class CommentsCountsProcessor(BaseProcessor):
                 assert blog_status == 0
                 category_idx = self._open_idx
 
-        # Пишем статистику в выбранную категорию
-        self._stat[category_idx] += 1
+        return category_idx
 
-    def _flush_stat(self, stat: TabunStat) -> None:
+    def _write_stat(
+        self,
+        stat: TabunStat,
+        fp: RowWriter,
+        fp_sum: RowWriter,
+        fp_perc: RowWriter,
+        period_begin: datetime,
+        period_stat: PeriodStat,
+    ) -> None:
         # Собираем три разные строки для трёх файлов
-        line: list[object] = [self.period_begin.strftime("%Y-%m-%d")]
+        line: list[object] = [period_begin.strftime("%Y-%m-%d")]
         line_sum = line[:]
         line_perc = line[:]
 
         # Высчитываем, что такое 100%
         # Число комментов, доступных в базе данных
-        all_exist_count = sum(self._stat)
+        all_exist_count = sum(period_stat.counts)
 
         # Число комментов вместе с неизвестными, угаданное по id
-        all_count = self._last_comment_id - self._first_comment_id + 1
-        if self._last_comment_id == 0:
+        all_count = period_stat.last_comment_id - period_stat.first_comment_id + 1
+        if period_stat.last_comment_id == 0:
             all_count = 0
         if all_count < all_exist_count:
             stat.log(
@@ -156,7 +192,7 @@ class CommentsCountsProcessor(BaseProcessor):
 
         # И собираем в строки данные по каждой категории
         cnt_sum = 0
-        for cnt in self._stat:
+        for cnt in period_stat.counts:
             # В простой файл просто пишем число как есть
             line.append(cnt)
             # В файле с суммами используем складывание слева направо для более простого рисования графиков
@@ -171,36 +207,67 @@ class CommentsCountsProcessor(BaseProcessor):
         # В line_perc all_count не используется
 
         # Пишем в файлы
-        assert self._fp
-        self._fp.write(utils.csvline(*line))
-        assert self._fp_sum
-        self._fp_sum.write(utils.csvline(*line_sum))
-        assert self._fp_perc
-        self._fp_perc.write(utils.csvline(*line_perc))
-
-        # Обнуляем статистику для начала следующего периода
-        self._stat = [0] * (len(self._labels) - 1)
-        self._first_comment_id = self._last_comment_id = 0
+        fp.write(*line)
+        fp_sum.write(*line_sum)
+        fp_perc.write(*line_perc)
 
-        # Высчитываем следующий период
-        self._increment_period()
+    def _begin_period(self, stat: TabunStat) -> None:
+        if self._period_idx < 0:
+            # Применяем часовой пояс к периоду и начинаем первый период
+            self.period_begin = self.period_end = self.first_day.astimezone(stat.tz)
+            self._increment_period()
 
     def _increment_period(self) -> None:
+        self._period_idx += 1
         self.period_begin = self.period_end
         # Теоретически есть шанс попасть в несуществующее или неоднозначное время... но пофиг наверное
         self.period_end = self.period_begin + timedelta(days=self.period)
 
+    def _get_period_stat(self) -> PeriodStat:
+        try:
+            return self._stat[self._period_idx]
+        except KeyError:
+            period_stat = PeriodStat(counts=[0] * (len(self._labels) - 1))
+            self._stat[self._period_idx] = period_stat
+            return period_stat
+
+    def export_state(self) -> dict[int, PeriodStat]:
+        return self._stat
+
+    def merge_state(self, state: object) -> None:
+        assert isinstance(state, dict)
+        for period_idx, other in state.items():
+            period_stat = self._stat.get(period_idx)
+            if period_stat is None:
+                self._stat[period_idx] = other
+                continue
+            # Куски приходят в хронологическом порядке, так что первый
+            # коммент периода остаётся нашим
+            period_stat.counts = [a + b for a, b in zip(period_stat.counts, other.counts)]
+            if period_stat.first_comment_id == 0 or period_stat.last_comment_id == 0:
+                period_stat.first_comment_id = other.first_comment_id
+            period_stat.last_comment_id = max(period_stat.last_comment_id, other.last_comment_id)
+
     def stop(self, stat: TabunStat) -> None:
-        if sum(self._stat) > 0:
-            self._flush_stat(stat)
-
-        if self._fp is not None:
-            self._fp.close()
-            self._fp = None
-        if self._fp_sum is not None:
-            self._fp_sum.close()
-            self._fp_sum = None
-        if self._fp_perc is not None:
-            self._fp_perc.close()
-            self._fp_perc = None
+        header = ["Дата"] + self._labels
+        with (
+            stat.open_csv("comments_counts.csv") as fp,
+            stat.open_csv("comments_counts_sum.csv") as fp_sum,
+            stat.open_csv("comments_counts_perc.csv") as fp_perc,
+        ):
+            fp.write(*header)
+            fp_sum.write(*header)
+            fp_perc.write(*header[:-1])  # В процентах комменты из лички не учитываем
+
+            # Пишем все периоды от первого до последнего с комментами, в том
+            # числе пустые; последний период без известных комментов не пишем
+            last_idx = max(self._stat, default=-1)
+            if last_idx >= 0 and sum(self._stat[last_idx].counts) <= 0:
+                last_idx -= 1
+            period_begin = self.first_day.astimezone(stat.tz)
+            for period_idx in range(last_idx + 1):
+                period_stat = self._stat.get(period_idx) or PeriodStat(counts=[0] * (len(self._labels) - 1))
+                self._write_stat(stat, fp, fp_sum, fp_perc, period_begin, period_stat)
+                period_begin += timedelta(days=self.period)
+
         super().stop(stat)
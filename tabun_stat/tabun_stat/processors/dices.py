@@ -1,7 +1,7 @@
 from dataclasses import dataclass
 
-from tabun_stat import types, utils
-from tabun_stat.processors.base import BaseProcessor
+from tabun_stat import types
+from tabun_stat.processors.base import MergeableProcessor
 from tabun_stat.stat import TabunStat
 
 
@@ -13,19 +13,18 @@ class DiceStat:
     dices_count: int = 0
 
 
-class DicesProcessor(BaseProcessor):
+class DicesProcessor(MergeableProcessor):
     def __init__(self) -> None:
         super().__init__()
         self._dices: dict[int, DiceStat] = {}
 
     def process_post(self, stat: TabunStat, post: types.Post) -> None:
-        self._process(post.author_id, post.body)
+        self._process(post.author_id, stat.get_message_text(post).dices_count)
 
     def process_comment(self, stat: TabunStat, comment: types.Comment) -> None:
-        self._process(comment.author_id, comment.body)
+        self._process(comment.author_id, stat.get_message_text(comment).dices_count)
 
-    def _process(self, author_id: int, body: str) -> None:
-        count = body.count('<span class="dice">')
+    def _process(self, author_id: int, count: int) -> None:
         if count == 0:
             return
 
@@ -34,29 +33,37 @@ class DicesProcessor(BaseProcessor):
         self._dices[author_id].publications_count += 1
         self._dices[author_id].dices_count += count
 
+    def export_state(self) -> dict[int, DiceStat]:
+        return self._dices
+
+    def merge_state(self, state: object) -> None:
+        assert isinstance(state, dict)
+        for author_id, st in state.items():
+            if author_id not in self._dices:
+                self._dices[author_id] = DiceStat()
+            self._dices[author_id].publications_count += st.publications_count
+            self._dices[author_id].dices_count += st.dices_count
+
     def stop(self, stat: TabunStat) -> None:
-        with (stat.destination / "dices.csv").open("w", encoding="utf-8") as fp:
+        with stat.open_csv("dices.csv") as fp:
             fp.write(
-                utils.csvline(
-                    "ID юзера",
-                    "Пользователь",
-                    "Сколько публикаций с дайсами",
-                    "Сколько раз брошены дайсы",
-                )
+                "ID юзера",
+                "Пользователь",
+                "Сколько публикаций с дайсами",
+                "Сколько раз брошены дайсы",
             )
             info = sorted(
                 self._dices.items(),
                 key=lambda x: (x[1].publications_count, x[1].dices_count, -x[0]),
                 reverse=True,
             )
+            usernames = stat.get_usernames_by_ids(self._dices)
             for user_id, st in info:
                 fp.write(
-                    utils.csvline(
-                        user_id,
-                        stat.source.get_username_by_user_id(user_id),
-                        st.publications_count,
-                        st.dices_count,
-                    )
+                    user_id,
+                    usernames[user_id],
+                    st.publications_count,
+                    st.dices_count,
                 )
 
         super().stop(stat)
@@ -1,11 +1,14 @@
+from collections import Counter
 from datetime import datetime
+from itertools import compress
+from operator import and_
 
-from tabun_stat import types, utils
-from tabun_stat.processors.base import BaseProcessor
+from tabun_stat import types
+from tabun_stat.processors.base import MergeableProcessor
 from tabun_stat.stat import TabunStat
 
 
-class FloodersProcessor(BaseProcessor):
+class FloodersProcessor(MergeableProcessor):
     def __init__(
         self,
         *,
@@ -114,6 +117,97 @@ class FloodersProcessor(BaseProcessor):
                 comment.author_id,
             )
 
+    def process_messages_batch(self, stat: TabunStat, batch: types.MessagesBatch) -> None:
+        for day, lo, hi in batch.iter_days():
+            self._put_batch(
+                batch,
+                day.year,
+                lo,
+                hi,
+                (
+                    self._flooders_all_posts,
+                    self._flooders_all_comments,
+                    self._flooders_public_posts,
+                    self._flooders_public_comments,
+                ),
+            )
+
+            for i, (dt_from, dt_to) in enumerate(self._date_ranges):
+                range_lo = batch.find_time(dt_from, lo, hi)
+                range_hi = batch.find_time(dt_to, range_lo, hi)
+                if range_lo < range_hi:
+                    self._put_batch(
+                        batch,
+                        i,
+                        range_lo,
+                        range_hi,
+                        (
+                            self._flooders_all_posts_ranges,
+                            self._flooders_all_comments_ranges,
+                            self._flooders_public_posts_ranges,
+                            self._flooders_public_comments_ranges,
+                        ),
+                    )
+
+    def _put_batch(
+        self,
+        batch: types.MessagesBatch,
+        key: int,
+        lo: int,
+        hi: int,
+        objs: tuple[dict[int, dict[int, int]], ...],
+    ) -> None:
+        # objs: все посты, все комменты, публичные посты, публичные комменты
+        author_id = batch.author_id[lo:hi]
+        is_comment = batch.is_comment[lo:hi]
+        is_post = [x ^ 1 for x in is_comment]
+        public = batch.public[lo:hi]
+
+        counters = (
+            Counter(compress(author_id, is_post)),
+            Counter(compress(author_id, is_comment)),
+            Counter(compress(author_id, map(and_, is_post, public))),
+            Counter(compress(author_id, map(and_, is_comment, public))),
+        )
+
+        # Counter сохраняет порядок первого появления, поэтому новые
+        # пользователи добавляются в том же порядке, что и по одному
+        for obj, counter in zip(objs, counters):
+            if not counter:
+                continue
+            if key not in obj:
+                obj[key] = {}
+            d = obj[key]
+            for author, count in counter.items():
+                d[author] = d.get(author, 0) + count
+
+    def _get_stat_dicts(self) -> tuple[dict[int, dict[int, int]], ...]:
+        return (
+            self._flooders_all_posts,
+            self._flooders_all_comments,
+            self._flooders_public_posts,
+            self._flooders_public_comments,
+            self._flooders_all_posts_ranges,
+            self._flooders_all_comments_ranges,
+            self._flooders_public_posts_ranges,
+            self._flooders_public_comments_ranges,
+        )
+
+    def export_state(self) -> tuple[dict[int, dict[int, int]], ...]:
+        return self._get_stat_dicts()
+
+    def merge_state(self, state: object) -> None:
+        assert isinstance(state, tuple)
+        # Куски приходят в хронологическом порядке, поэтому новые
+        # пользователи добавляются в том же порядке, что и без деления
+        for obj, other in zip(self._get_stat_dicts(), state):
+            for key, other_counts in other.items():
+                if key not in obj:
+                    obj[key] = {}
+                d = obj[key]
+                for author, count in other_counts.items():
+                    d[author] = d.get(author, 0) + count
+
     def stop(self, stat: TabunStat) -> None:
         # Сохраняем статистику по годам
 
@@ -194,15 +288,14 @@ class FloodersProcessor(BaseProcessor):
         # Сортируем юзеров по общему числу постов и комментов в сумме
         items = sorted(fstat.items(), key=lambda x: x[1][0] + x[1][1], reverse=True)
 
-        with (stat.destination / filename).open("w", encoding="utf-8") as fp:
-            fp.write(utils.csvline("ID юзера", "Пользователь", "Сколько постов", "Сколько комментов"))
+        with stat.open_csv(filename) as fp:
+            fp.write("ID юзера", "Пользователь", "Сколько постов", "Сколько комментов")
 
+            usernames = stat.get_usernames_by_ids(fstat)
             for user_id, (posts_count, comments_count) in items:
                 fp.write(
-                    utils.csvline(
-                        user_id,
-                        stat.source.get_username_by_user_id(user_id),
-                        posts_count,
-                        comments_count,
-                    )
+                    user_id,
+                    usernames[user_id],
+                    posts_count,
+                    comments_count,
                 )
@@ -1,13 +1,12 @@
-import re
 from dataclasses import dataclass
 from datetime import datetime
+from typing import Iterator
 
-from tabun_stat import types, utils
-from tabun_stat.processors.base import BaseProcessor
+from tabun_stat import types
+from tabun_stat.processors.base import MergeableProcessor
+from tabun_stat.spill import Spiller, external_sort, merge_groups
 from tabun_stat.stat import TabunStat
 
-img_re = re.compile('<img[^>]+src="([^"]+)".*>', flags=re.U | re.I)
-
 
 @dataclass(slots=True)
 class ImageStat:
@@ -42,9 +41,54 @@ class HostStat:
     all_public_count: int = 0
 
 
-class ImagesProcessor(BaseProcessor):
-    def __init__(self) -> None:
+# Запись прогона при сбросе статистики на диск: ссылка на картинку, её номер
+# в порядке первого использования внутри прогона и статистика
+SpilledImage = tuple[str, int, ImageStat]
+
+
+def merge_image_stats(items: list[tuple[int, SpilledImage]]) -> tuple[int, SpilledImage]:
+    """Объединяет статистику одной и той же картинки из разных прогонов
+    (см. tabun_stat.spill). Элементы — пары (номер прогона, запись)
+    в хронологическом порядке прогонов.
+    """
+    run_no, (img, order, first) = items[0]
+    stats = [x[1][2] for x in items]
+
+    last_public_dates = [x.last_public_date for x in stats if x.last_public_date is not None]
+
+    return run_no, (
+        img,
+        order,
+        ImageStat(
+            host=first.host,
+            host2=first.host2,
+            first_date=first.first_date,
+            last_date=stats[-1].last_date,
+            count=sum(x.count for x in stats),
+            # Как и в _process, публичность первого использования определяется
+            # только самым первым сообщением с картинкой
+            first_public_date=first.first_public_date,
+            last_public_date=last_public_dates[-1] if last_public_dates else None,
+            public_count=sum(x.public_count for x in stats),
+        ),
+    )
+
+
+class ImagesProcessor(MergeableProcessor):
+    def __init__(self, *, spill_threshold: int | None = None, spill_dir: str | None = None) -> None:
+        """
+        :param spill_threshold: если задано, то при превышении этого числа
+          различных картинок в памяти их статистика сбрасывается на диск
+          во временные файлы и объединяется в конце
+        :param spill_dir: каталог для временных файлов (по умолчанию
+          системный)
+        """
         super().__init__()
+        self.spill_threshold = spill_threshold
+        self.spill_dir = spill_dir
+
+        if spill_threshold is not None and spill_threshold < 1:
+            raise ValueError("spill_threshold must be positive")
 
         self._stat: dict[str, ImageStat] = {}
         self._images_list: list[str] = []
@@ -52,27 +96,33 @@ class ImagesProcessor(BaseProcessor):
         self._hosts: dict[str, HostStat] = {}
         self._hosts2: dict[str, HostStat] = {}
 
+        # Статистика картинок, сброшенная на диск (см. spill_threshold).
+        # Общее число использований хостов всегда считается в памяти, а число
+        # уникальных ссылок при сбросе пересчитывается заново в stop
+        self._spiller = Spiller(spill_dir, prefix="tabun_stat_images_")
+
         self._warned_posts: set[int] = set()
 
     def process_post(self, stat: TabunStat, post: types.Post) -> None:
         public = post.blog_status in (0, 2)
-        self._process(post.body, public, post.created_at)
+        self._process(stat.get_message_text(post).images, public, post.created_at)
 
     def process_comment(self, stat: TabunStat, comment: types.Comment) -> None:
         if comment.post_id is None or comment.blog_status is None:
             if comment.post_id is None or comment.post_id not in self._warned_posts:
-                stat.log(
-                    0,
-                    f"WARNING: images: comment {comment.id} for unknown post {comment.post_id},",
-                    "marking as private",
-                )
+                if comment.blog_id is not None:
+                    # Пост есть, но его блога нет в базе данных
+                    what = f"from post {comment.post_id} with unknown blog {comment.blog_id}"
+                else:
+                    what = f"for unknown post {comment.post_id}"
+                stat.log(0, f"WARNING: images: comment {comment.id} {what},", "marking as private")
             if comment.post_id is not None:
                 self._warned_posts.add(comment.post_id)
             public = False
         else:
             public = comment.blog_status in (0, 2)
 
-        self._process(comment.body, public, comment.created_at)
+        self._process(stat.get_message_text(comment).images, public, comment.created_at)
 
     def _get_host(self, url: str) -> str:
         # https://example.com:80/path → example.com:80/path
@@ -100,13 +150,7 @@ class ImagesProcessor(BaseProcessor):
             host = host[host.find(".") + 1 :]
         return host
 
-    def _process(self, body: str, public: bool, created_at: datetime) -> None:
-        body = body.strip()
-        if "<" not in body:
-            return
-
-        images = utils.drop_duplicates(img_re.findall(body))
-
+    def _process(self, images: list[str], public: bool, created_at: datetime) -> None:
         for img in images:
             if not img:
                 continue
@@ -164,10 +208,125 @@ class ImagesProcessor(BaseProcessor):
                 if public:
                     self._hosts2[stat.host2].all_public_count += 1
 
+        self._check_spill()
+
+    def _check_spill(self) -> None:
+        if self.spill_threshold is not None and len(self._stat) > self.spill_threshold:
+            self._spill_images(self._images_list, self._stat)
+            self._images_list = []
+            self._stat = {}
+
+    def _spill_images(self, images_list: list[str], images_stat: dict[str, ImageStat]) -> None:
+        """Сбрасывает статистику картинок на диск, отсортировав её по ссылкам."""
+        if images_list:
+            order = {img: i for i, img in enumerate(images_list)}
+            self._spiller.write_run((img, order[img], images_stat[img]) for img in sorted(images_list))
+
+    def _iter_stats(self) -> Iterator[tuple[str, ImageStat]]:
+        """Выдаёт итоговую статистику картинок в порядке первого использования."""
+        if not self._spiller:
+            for img in self._images_list:
+                yield img, self._stat[img]
+            return
+
+        self._spill_images(self._images_list, self._stat)
+        self._images_list = []
+        self._stat = {}
+
+        merged = merge_groups(self._spiller.merge(lambda x: x[0]), lambda x: x[1][0], merge_image_stats)
+        assert self.spill_threshold is not None
+        for _, (img, _, image_stat) in external_sort(
+            merged,
+            lambda x: (x[0], x[1][1]),
+            chunk_size=self.spill_threshold,
+            directory=self.spill_dir,
+        ):
+            yield img, image_stat
+
+    def export_state(
+        self,
+    ) -> tuple[list[str], dict[str, ImageStat], dict[str, HostStat], dict[str, HostStat], list[bytes]]:
+        # Сброшенная на диск статистика передаётся содержимым временных файлов,
+        # так как сами файлы будут удалены вместе с этим обработчиком
+        return self._images_list, self._stat, self._hosts, self._hosts2, self._spiller.read_runs_bytes()
+
+    def merge_state(self, state: object) -> None:
+        assert isinstance(state, tuple)
+        images_list, images_stat, hosts, hosts2 = state[:4]
+        # В контрольных точках старых версий сброшенной статистики нет
+        runs: list[bytes] = state[4] if len(state) > 4 else []
+
+        # Общее число использований хостов просто складывается
+        for my_hosts, other_hosts in ((self._hosts, hosts), (self._hosts2, hosts2)):
+            for h, c in other_hosts.items():
+                if h not in my_hosts:
+                    my_hosts[h] = HostStat()
+                my_hosts[h].all_count += c.all_count
+                my_hosts[h].all_public_count += c.all_public_count
+
+        if runs or self._spiller:
+            # Прогоны всех кусков идут в хронологическом порядке: сначала
+            # своя статистика, затем сброшенная на диск статистика куска
+            # и потом оставшаяся у него в памяти
+            self._spill_images(self._images_list, self._stat)
+            self._images_list = []
+            self._stat = {}
+            for data in runs:
+                self._spiller.write_run_bytes(data)
+            self._spill_images(images_list, images_stat)
+            return
+
+        # А с картинками надо аккуратнее: куски приходят в хронологическом
+        # порядке, и картинка могла уже встретиться в предыдущих кусках
+        for img in images_list:
+            other = images_stat[img]
+            mine = self._stat.get(img)
+
+            if mine is not None:
+                mine.last_date = other.last_date
+                mine.count += other.count
+                if other.last_public_date is not None:
+                    mine.last_public_date = other.last_public_date
+                mine.public_count += other.public_count
+                continue
+
+            # Картинка встретилась впервые — считаем её уникальной так же,
+            # как это делает _process (публичность определяется по первому
+            # использованию)
+            self._images_list.append(img)
+            self._stat[img] = other
+            public = other.first_public_date is not None
+
+            if other.host:
+                self._hosts[other.host].unique_count += 1
+                if public:
+                    self._hosts[other.host].unique_public_count += 1
+
+            if other.host2:
+                self._hosts2[other.host2].unique_count += 1
+                if public:
+                    self._hosts2[other.host2].unique_public_count += 1
+
+        self._check_spill()
+
     def stop(self, stat: TabunStat) -> None:
-        with (stat.destination / "images.csv").open("w", encoding="utf-8") as fp:
-            fp.write(
-                utils.csvline(
+        spilled = bool(self._spiller)
+        if spilled:
+            # Картинки из разных прогонов посчитаны уникальными несколько раз,
+            # поэтому число уникальных ссылок считаем заново по итоговой
+            # статистике
+            for c in (*self._hosts.values(), *self._hosts2.values()):
+                c.unique_count = 0
+                c.unique_public_count = 0
+
+        # Оба списка картинок пишутся за один проход, так как при сбросе
+        # статистики на диск каждый проход — это чтение всех временных файлов
+        try:
+            with (
+                stat.open_csv("images.csv", large=True) as fp,
+                stat.open_csv("images_public.csv", large=True) as fp_public,
+            ):
+                fp.write(
                     "Картинка",
                     "Первое исп-е",
                     "Первое исп-е на внешке",
@@ -176,12 +335,23 @@ class ImagesProcessor(BaseProcessor):
                     "Сколько раз",
                     "Сколько раз на внешке",
                 )
-            )
+                fp_public.write(
+                    "Картинка",
+                    "Первое исп-е на внешке",
+                    "Последнее исп-е на внешке",
+                    "Сколько раз на внешке",
+                )
 
-            for img in self._images_list:
-                data = self._stat[img]
-                fp.write(
-                    utils.csvline(
+                for img, data in self._iter_stats():
+                    if spilled:
+                        public = data.first_public_date is not None
+                        for hosts, host in ((self._hosts, data.host), (self._hosts2, data.host2)):
+                            if host:
+                                hosts[host].unique_count += 1
+                                if public:
+                                    hosts[host].unique_public_count += 1
+
+                    fp.write(
                         img,
                         data.first_date,
                         data.first_public_date or "",
@@ -190,96 +360,75 @@ class ImagesProcessor(BaseProcessor):
                         data.count,
                         data.public_count,
                     )
-                )
 
-        with (stat.destination / "images_hosts.csv").open("w", encoding="utf-8") as fp:
+                    if data.public_count == 0:
+                        continue
+                    fp_public.write(
+                        img,
+                        data.first_public_date or "",
+                        data.last_public_date or "",
+                        data.public_count,
+                    )
+
+        finally:
+            self._spiller.cleanup()
+
+        with stat.open_csv("images_hosts.csv") as fp:
             fp.write(
-                utils.csvline(
-                    "Хост",
-                    "Число уникальных ссылок",
-                    "Число уникальных ссылок на внешке",
-                    "Общее число использований",
-                    "Общее число использований на внешке",
-                )
+                "Хост",
+                "Число уникальных ссылок",
+                "Число уникальных ссылок на внешке",
+                "Общее число использований",
+                "Общее число использований на внешке",
             )
 
             items = sorted(self._hosts.items(), key=lambda x: x[1].all_count, reverse=True)
             for h, c in items:
                 assert c.all_count >= c.unique_count
                 assert c.all_public_count >= c.unique_public_count
-                fp.write(
-                    utils.csvline(h, c.unique_count, c.unique_public_count, c.all_count, c.all_public_count)
-                )
+                fp.write(h, c.unique_count, c.unique_public_count, c.all_count, c.all_public_count)
 
-        with (stat.destination / "images_hosts2.csv").open("w", encoding="utf-8") as fp:
+        with stat.open_csv("images_hosts2.csv") as fp:
             fp.write(
-                utils.csvline(
-                    "Хост",
-                    "Число уникальных ссылок",
-                    "Число уникальных ссылок на внешке",
-                    "Общее число использований",
-                    "Общее число использований на внешке",
-                )
+                "Хост",
+                "Число уникальных ссылок",
+                "Число уникальных ссылок на внешке",
+                "Общее число использований",
+                "Общее число использований на внешке",
             )
 
             items = sorted(self._hosts2.items(), key=lambda x: x[1].all_count, reverse=True)
             for h, c in items:
                 assert c.all_count >= c.unique_count
                 assert c.all_public_count >= c.unique_public_count
-                fp.write(
-                    utils.csvline(h, c.unique_count, c.unique_public_count, c.all_count, c.all_public_count)
-                )
+                fp.write(h, c.unique_count, c.unique_public_count, c.all_count, c.all_public_count)
 
         # Дублируем всё то же самое, но без закрытых блогов
 
-        with (stat.destination / "images_public.csv").open("w", encoding="utf-8") as fp:
+        with stat.open_csv("images_public_hosts.csv") as fp:
             fp.write(
-                utils.csvline(
-                    "Картинка", "Первое исп-е на внешке", "Последнее исп-е на внешке", "Сколько раз на внешке"
-                )
-            )
-
-            for img in self._images_list:
-                data = self._stat[img]
-                if data.public_count == 0:
-                    continue
-                fp.write(
-                    utils.csvline(
-                        img,
-                        data.first_public_date or "",
-                        data.last_public_date or "",
-                        data.public_count,
-                    )
-                )
-
-        with (stat.destination / "images_public_hosts.csv").open("w", encoding="utf-8") as fp:
-            fp.write(
-                utils.csvline(
-                    "Хост",
-                    "Число уникальных ссылок на внешке",
-                    "Общее число использований на внешке",
-                )
+                "Хост",
+                "Число уникальных ссылок на внешке",
+                "Общее число использований на внешке",
             )
 
             items = sorted(self._hosts.items(), key=lambda x: x[1].all_count, reverse=True)
             for h, c in items:
                 if c.unique_public_count == 0:
                     continue
-                fp.write(utils.csvline(h, c.unique_public_count, c.all_public_count))
+                fp.write(h, c.unique_public_count, c.all_public_count)
 
-        with (stat.destination / "images_hosts2.csv").open("w", encoding="utf-8") as fp:
+        with stat.open_csv("images_hosts2.csv") as fp:
             fp.write(
-                utils.csvline(
-                    "Хост",
-                    "Число уникальных ссылок на внешке",
-                    "Общее число использований на внешке",
-                )
+                "Хост",
+                "Число уникальных ссылок на внешке",
+                "Общее число использований на внешке",
             )
 
             items = sorted(self._hosts2.items(), key=lambda x: x[1].all_count, reverse=True)
             for h, c in items:
                 if c.unique_public_count == 0:
                     continue
-                fp.write(utils.csvline(h, c.unique_public_count, c.all_public_count))
+                fp.write(h, c.unique_public_count, c.all_public_count)
 
         super().stop(stat)
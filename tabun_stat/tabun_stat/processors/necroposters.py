@@ -1,8 +1,8 @@
 from dataclasses import dataclass, field
 from typing import Sequence
 
-from tabun_stat import types, utils
-from tabun_stat.processors.base import BaseProcessor
+from tabun_stat import types
+from tabun_stat.processors.base import MergeableProcessor
 from tabun_stat.stat import TabunStat
 
 
@@ -29,7 +29,19 @@ class NecroStat:
             self.score_by_user[author_id] = score
 
 
-class NecropostersProcessor(BaseProcessor):
+@dataclass(slots=True)
+class NecroComment:
+    comment_id: int
+    post_id: int
+    author_id: int
+    created_at: float  # unix timestamp
+    # Время предыдущей активности в посте; None, если в обработанных
+    # данных её не было (при обработке по кусочкам она может найтись
+    # в предыдущем куске)
+    last_activity: float | None
+
+
+class NecropostersProcessor(MergeableProcessor):
     def __init__(
         self,
         *,
@@ -47,10 +59,10 @@ class NecropostersProcessor(BaseProcessor):
 
         self._last_activity: dict[int, float] = {}  # {post_id: unix_timestamp}
         self._post_authors: dict[int, int] = {}  # {post_id: author_id}
-        self._user_ratings: dict[int, float] = {}  # {user_id: rating}
 
-    def process_user(self, stat: TabunStat, user: types.User) -> None:
-        self._user_ratings[user.id] = user.rating
+        # Комменты, которые могут оказаться некропостами, в хронологическом
+        # порядке; окончательно считаем их в stop
+        self._comments: list[NecroComment] = []
 
     def process_post(self, stat: TabunStat, post: types.Post) -> None:
         if post.blog_status not in (0, 2):
@@ -77,62 +89,102 @@ class NecropostersProcessor(BaseProcessor):
         self._last_activity[comment.post_id] = tm
 
         if last_activity is None:
-            # Это может случиться в двух случаях:
-            # 1) Посты отсечены настройкой min_date
-            # 2) Автор поста добавил комментарии ещё в черновиках перед публикацией
-            # В таком случае считаем дату коммента датой первой активности, чтобы считать хоть что-то
-            # (правда, автор поста останется неизвестен)
-            stat.log(
-                0, f"WARNING: necroposters: comment {comment.id} for uninitalized post {comment.post_id}"
+            # Разбираемся с таким в stop (или в merge_state)
+            self._comments.append(
+                NecroComment(comment.id, comment.post_id, comment.author_id, tm, last_activity=None)
             )
             return
 
-        try:
-            user_rating = self._user_ratings[comment.author_id]
-        except KeyError:
+        if stat.users.get_rating(comment.author_id) is None:
             stat.log(
                 0, f"WARNING: necroposters: comment {comment.id} for unknown author id {comment.author_id}"
             )
             return
 
+        if self._get_score(tm, last_activity) > 0:
+            self._comments.append(
+                NecroComment(comment.id, comment.post_id, comment.author_id, tm, last_activity)
+            )
+
+    def _get_score(self, tm: float, last_activity: float) -> int:
         days = int(tm - last_activity) // 3600 // 24
-        score = days - self.min_inactivity_days + 1
+        return days - self.min_inactivity_days + 1
 
-        if score <= 0:
-            # Не некропостер
-            return
+    def export_state(self) -> tuple[dict[int, float], dict[int, int], list[NecroComment]]:
+        return self._last_activity, self._post_authors, self._comments
 
-        if not self.authors_are_necroposters and self._post_authors.get(comment.post_id) == comment.author_id:
-            # Некропостер, но в своём собственном посте, это можно
-            return
+    def merge_state(self, state: object) -> None:
+        assert isinstance(state, tuple)
+        last_activity, post_authors, comments = state
 
-        for nstat in self._stats:
-            if nstat.min_rating is None or user_rating >= nstat.min_rating:
-                nstat.add(comment.author_id, score)
+        # Предыдущая активность в посте могла быть в предыдущих кусках
+        for item in comments:
+            if item.last_activity is None:
+                item.last_activity = self._last_activity.get(item.post_id)
+                if (
+                    item.last_activity is not None
+                    and self._get_score(item.created_at, item.last_activity) <= 0
+                ):
+                    continue
+            self._comments.append(item)
+
+        self._last_activity.update(last_activity)
+        self._post_authors.update(post_authors)
 
     def stop(self, stat: TabunStat) -> None:
+        for item in self._comments:
+            if item.last_activity is None:
+                # Это может случиться в двух случаях:
+                # 1) Посты отсечены настройкой min_date
+                # 2) Автор поста добавил комментарии ещё в черновиках перед публикацией
+                # В таком случае считаем дату коммента датой первой активности, чтобы считать хоть что-то
+                # (правда, автор поста останется неизвестен)
+                stat.log(
+                    0,
+                    f"WARNING: necroposters: comment {item.comment_id} for uninitalized post {item.post_id}",
+                )
+                continue
+
+            user_rating = stat.users.get_rating(item.author_id)
+            if user_rating is None:
+                stat.log(
+                    0,
+                    f"WARNING: necroposters: comment {item.comment_id} for unknown author id {item.author_id}",
+                )
+                continue
+
+            score = self._get_score(item.created_at, item.last_activity)
+            if score <= 0:
+                # Не некропостер
+                continue
+
+            if not self.authors_are_necroposters and self._post_authors.get(item.post_id) == item.author_id:
+                # Некропостер, но в своём собственном посте, это можно
+                continue
+
+            for nstat in self._stats:
+                if nstat.min_rating is None or user_rating >= nstat.min_rating:
+                    nstat.add(item.author_id, score)
+
         for nstat in self._stats:
             suffix = f"_{nstat.min_rating:.2f}" if nstat.min_rating is not None else ""
-            with (stat.destination / f"necroposters{suffix}.csv").open("w", encoding="utf-8") as fp:
-                fp.write(utils.csvline("ID юзера", "Пользователь", "Число некропостов"))
+            usernames = stat.get_usernames_by_ids(nstat.count_by_user.keys() | nstat.score_by_user.keys())
+            with stat.open_csv(f"necroposters{suffix}.csv") as fp:
+                fp.write("ID юзера", "Пользователь", "Число некропостов")
                 for user_id, count in sorted(nstat.count_by_user.items(), key=lambda x: x[1], reverse=True):
                     fp.write(
-                        utils.csvline(
-                            user_id,
-                            stat.source.get_username_by_user_id(user_id),
-                            count,
-                        )
+                        user_id,
+                        usernames[user_id],
+                        count,
                     )
 
-            with (stat.destination / f"necroposters{suffix}_score.csv").open("w", encoding="utf-8") as fp:
-                fp.write(utils.csvline("ID юзера", "Пользователь", "Рейтинг некропостинга"))
+            with stat.open_csv(f"necroposters{suffix}_score.csv") as fp:
+                fp.write("ID юзера", "Пользователь", "Рейтинг некропостинга")
                 for user_id, score in sorted(nstat.score_by_user.items(), key=lambda x: x[1], reverse=True):
                     fp.write(
-                        utils.csvline(
-                            user_id,
-                            stat.source.get_username_by_user_id(user_id),
-                            score,
-                        )
+                        user_id,
+                        usernames[user_id],
+                        score,
                     )
 
         super().stop(stat)
@@ -1,9 +1,9 @@
-from tabun_stat import types, utils
-from tabun_stat.processors.base import BaseProcessor
+from tabun_stat import types
+from tabun_stat.processors.base import MergeableProcessor
 from tabun_stat.stat import TabunStat
 
 
-class NicknamesProcessor(BaseProcessor):
+class NicknamesProcessor(MergeableProcessor):
     def __init__(self) -> None:
         super().__init__()
         self._letters: dict[str, set[int]] = {}
@@ -14,8 +14,20 @@ class NicknamesProcessor(BaseProcessor):
             self._letters[c] = set()
         self._letters[c].add(user.id)
 
-    def end_users(self, stat: TabunStat, limits: types.UsersLimits) -> None:
-        with (stat.destination / "nicknames.csv").open("w", encoding="utf-8") as fp:
-            fp.write(utils.csvline("Первая буква ника", "Число пользователей"))
+    def export_state(self) -> dict[str, set[int]]:
+        return self._letters
+
+    def merge_state(self, state: object) -> None:
+        assert isinstance(state, dict)
+        for c, user_ids in state.items():
+            if c not in self._letters:
+                self._letters[c] = set()
+            self._letters[c] |= user_ids
+
+    def stop(self, stat: TabunStat) -> None:
+        with stat.open_csv("nicknames.csv") as fp:
+            fp.write("Первая буква ника", "Число пользователей")
             for c, user_ids in sorted(self._letters.items(), key=lambda x: len(x[1]), reverse=True):
-                fp.write(utils.csvline(c, len(user_ids)))
+                fp.write(c, len(user_ids))
+
+        super().stop(stat)
@@ -1,12 +1,11 @@
 from datetime import date, datetime, timedelta
-from typing import IO
 
-from tabun_stat import types, utils
-from tabun_stat.processors.base import BaseProcessor
+from tabun_stat import types
+from tabun_stat.processors.base import MergeableProcessor
 from tabun_stat.stat import TabunStat
 
 
-class OldfagsProcessor(BaseProcessor):
+class OldfagsProcessor(MergeableProcessor):
     default_age_days: dict[int, str] = {
         7: "Аккаунты ≤ 7 дней",
         30: "Аккаунты от 8 до 30 дней",
@@ -47,48 +46,19 @@ class OldfagsProcessor(BaseProcessor):
             self._age_days.append(age)
             self._age_labels.append(label)
 
-        self._regdates: dict[int, datetime] = {}
-        self._user_ratings: dict[int, float] = {}
-
-        self._mon: date | None = None  # День не используется и всегда должен быть 1
-
+        # Пользователи, активные в каждом месяце (день не используется
+        # и всегда должен быть 1), с индексами их возрастов на момент первой
+        # активности в месяце: {месяц: {user_id: count_idx}}
         # Все блоги
-        self._counts = [0] * (len(age_days) + 1)
-        self._counted_users: set[int] = set()
-
+        self._counted_users: dict[date, dict[int, int]] = {}
         # Только открытые и полузакрытые блоги
-        self._public_counts = [0] * (len(age_days) + 1)
-        self._public_counted_users: set[int] = set()
-
-        self._fp: IO[str] | None = None
-        self._fp_sum: IO[str] | None = None
+        self._public_counted_users: dict[date, set[int]] = {}
 
         self._warned_posts: set[int] = set()
 
         if self._age_base_date is not None and self._age_base_date.tzinfo is None:
             raise ValueError("age_base_date must be aware datetime")
 
-    def start(self, stat: TabunStat) -> None:
-        super().start(stat)
-        header = ["Месяц"]
-        header.extend(self._age_labels)
-        header.append(self._label_max)
-
-        suffix = ""
-        if self._age_base_date:
-            suffix = self._age_base_date.strftime("_rel_%Y-%m-%d")
-
-        self._fp = (stat.destination / f"oldfags{suffix}.csv").open("w", encoding="utf-8")
-        self._fp.write(utils.csvline(*header))
-
-        self._fp_sum = (stat.destination / f"oldfags{suffix}_sum.csv").open("w", encoding="utf-8")
-        self._fp_sum.write(utils.csvline(*header))
-
-    def process_user(self, stat: TabunStat, user: types.User) -> None:
-        assert user.registered_at_local is not None
-        self._regdates[user.id] = user.registered_at_local
-        self._user_ratings[user.id] = user.rating
-
     def process_post(self, stat: TabunStat, post: types.Post) -> None:
         self._put_activity(
             stat,
@@ -100,11 +70,12 @@ class OldfagsProcessor(BaseProcessor):
     def process_comment(self, stat: TabunStat, comment: types.Comment) -> None:
         if comment.post_id is None or comment.blog_status is None:
             if comment.post_id is None or comment.post_id not in self._warned_posts:
-                stat.log(
-                    0,
-                    f"WARNING: oldfags: comment {comment.id} for unknown post {comment.post_id},",
-                    "marking as private",
-                )
+                if comment.blog_id is not None:
+                    # Пост есть, но его блога нет в базе данных
+                    what = f"from post {comment.post_id} with unknown blog {comment.blog_id}"
+                else:
+                    what = f"for unknown post {comment.post_id}"
+                stat.log(0, f"WARNING: oldfags: comment {comment.id} {what},", "marking as private")
             if comment.post_id is not None:
                 self._warned_posts.add(comment.post_id)
             public = False
@@ -119,109 +90,123 @@ class OldfagsProcessor(BaseProcessor):
         )
 
     def _put_activity(self, stat: TabunStat, user_id: int, created_at: datetime, *, public: bool) -> None:
-        try:
-            regdate = self._regdates[user_id].timestamp()
-        except KeyError:
+        regdate = stat.users.get_registered_at(user_id)
+        if regdate is None:
             stat.log(0, f"WARNING: oldfags: activity from unknown user {user_id}, skipping")
             return
 
         mon = created_at.date().replace(day=1)
-        if mon != self._mon:
-            self._flush_activity(stat, mon)
+        counted_users = self._counted_users.get(mon)
+        if counted_users is None:
+            counted_users = self._counted_users[mon] = {}
+            self._public_counted_users[mon] = set()
+
+        if user_id not in counted_users:
+            counted_users[user_id] = self._get_count_idx(created_at, regdate)
+
+        if public:
+            self._public_counted_users[mon].add(user_id)
 
+    def _get_count_idx(self, created_at: datetime, regdate: float) -> int:
         age_base_ts = (self._age_base_date or created_at).timestamp()
         user_age_days = int(age_base_ts - regdate) // 3600 // 24
 
-        count_idx = len(self._counts) - 1
         for i, max_age_days in enumerate(self._age_days):
             if user_age_days <= max_age_days:
-                count_idx = i
-                break
-
-        if user_id not in self._counted_users:
-            self._counts[count_idx] += 1
-            self._counted_users.add(user_id)
-
-        if public and user_id not in self._public_counted_users:
-            self._public_counts[count_idx] += 1
-            self._public_counted_users.add(user_id)
-
-    def _flush_activity(self, stat: TabunStat, new_mon: date) -> None:
-        assert self._fp is not None
-        assert self._fp_sum is not None
-        assert new_mon.day == 1
-
-        if self._mon is None:
-            self._mon = new_mon
-            return
-
-        while self._mon != new_mon:
-            row: list[object] = [f"{self._mon.year:04d}-{self._mon.month:02d}"]
-            row.extend(self._counts)
-            self._fp.write(utils.csvline(*row))
-
-            # То же самое, но с суммированием для более удобного рисования графика
-            row = [f"{self._mon.year:04d}-{self._mon.month:02d}"]
-            s = 0
-            for c in self._counts:
-                s += c
-                row.append(s)
-            self._fp_sum.write(utils.csvline(*row))
-
-            # А также полные списки пользователей для запрошенных месяцев
-            if self._mon in self._dump_user_list_for_months:
-                self._dump_users(stat)
-
-            # Проматываем в цикле while до нужного месяца
-            # (такой цикл нужен, чтобы не пропустить месяцы без активности
-            # и записать нули в статистику)
-            self._mon = (self._mon + timedelta(days=32)).replace(day=1)
-
-            self._counts = [0] * (len(self._age_days) + 1)
-            self._counted_users.clear()
-
-            self._public_counts = [0] * (len(self._age_days) + 1)
-            self._public_counted_users.clear()
-
-    def _dump_users(self, stat: TabunStat) -> None:
-        if self._mon is None:
-            return
-
-        filename = f"oldfags_list_{self._mon.year:04d}-{self._mon.month:02d}.csv"
-        with (stat.destination / filename).open("w", encoding="utf-8") as fp:
-            fp.write(utils.csvline("ID юзера", "Пользователь", "Дата регистрации", "Рейтинг"))
-            for user_id in sorted(self._counted_users, key=lambda u: self._regdates[u]):
+                return i
+        return len(self._age_days)
+
+    def export_state(self) -> tuple[dict[date, dict[int, int]], dict[date, set[int]]]:
+        return self._counted_users, self._public_counted_users
+
+    def merge_state(self, state: object) -> None:
+        assert isinstance(state, tuple)
+        counted_users, public_counted_users = state
+
+        # Куски приходят в хронологическом порядке, поэтому первая
+        # активность пользователя в месяце — из самого раннего куска
+        for mon, users in counted_users.items():
+            if mon not in self._counted_users:
+                self._counted_users[mon] = users
+                continue
+            mon_users = self._counted_users[mon]
+            for user_id, count_idx in users.items():
+                if user_id not in mon_users:
+                    mon_users[user_id] = count_idx
+
+        for mon, public_users in public_counted_users.items():
+            if mon not in self._public_counted_users:
+                self._public_counted_users[mon] = public_users
+            else:
+                self._public_counted_users[mon].update(public_users)
+
+    def _dump_users(self, stat: TabunStat, mon: date) -> None:
+        users = stat.users
+        counted_users = self._counted_users.get(mon) or {}
+        public_counted_users = self._public_counted_users.get(mon) or set()
+
+        filename = f"oldfags_list_{mon.year:04d}-{mon.month:02d}.csv"
+        with stat.open_csv(filename) as fp:
+            fp.write("ID юзера", "Пользователь", "Дата регистрации", "Рейтинг")
+            usernames = stat.get_usernames_by_ids(counted_users)
+            for user_id in sorted(counted_users, key=lambda u: users.registered_at[u]):
                 fp.write(
-                    utils.csvline(
-                        user_id,
-                        stat.source.get_username_by_user_id(user_id),
-                        self._regdates[user_id],
-                        f"{self._user_ratings[user_id]:.02f}",
-                    )
+                    user_id,
+                    usernames[user_id],
+                    datetime.fromtimestamp(users.registered_at[user_id], stat.tz),
+                    f"{users.rating[user_id]:.02f}",
                 )
 
-        filename = f"oldfags_public_list_{self._mon.year:04d}-{self._mon.month:02d}.csv"
-        with (stat.destination / filename).open("w", encoding="utf-8") as fp:
-            fp.write(utils.csvline("ID юзера", "Пользователь", "Дата регистрации", "Рейтинг"))
-            for user_id in sorted(self._public_counted_users, key=lambda u: self._regdates[u]):
+        filename = f"oldfags_public_list_{mon.year:04d}-{mon.month:02d}.csv"
+        with stat.open_csv(filename) as fp:
+            fp.write("ID юзера", "Пользователь", "Дата регистрации", "Рейтинг")
+            usernames = stat.get_usernames_by_ids(public_counted_users)
+            for user_id in sorted(public_counted_users, key=lambda u: users.registered_at[u]):
                 fp.write(
-                    utils.csvline(
-                        user_id,
-                        stat.source.get_username_by_user_id(user_id),
-                        self._regdates[user_id],
-                        f"{self._user_ratings[user_id]:.02f}",
-                    )
+                    user_id,
+                    usernames[user_id],
+                    datetime.fromtimestamp(users.registered_at[user_id], stat.tz),
+                    f"{users.rating[user_id]:.02f}",
                 )
 
     def stop(self, stat: TabunStat) -> None:
-        if self._fp is not None:
-            if self._mon is not None:
-                self._flush_activity(stat, (self._mon + timedelta(days=32)).replace(day=1))
-            self._fp.close()
-            self._fp = None
-
-        if self._fp_sum is not None:
-            self._fp_sum.close()
-            self._fp_sum = None
+        header = ["Месяц"]
+        header.extend(self._age_labels)
+        header.append(self._label_max)
+
+        suffix = ""
+        if self._age_base_date:
+            suffix = self._age_base_date.strftime("_rel_%Y-%m-%d")
+
+        with stat.open_csv(f"oldfags{suffix}.csv") as fp, stat.open_csv(f"oldfags{suffix}_sum.csv") as fp_sum:
+            fp.write(*header)
+            fp_sum.write(*header)
+
+            # Идём в цикле по всем месяцам, чтобы не пропустить месяцы без
+            # активности и записать нули в статистику
+            mon = min(self._counted_users, default=None)
+            last_mon = max(self._counted_users, default=None)
+            while mon is not None and last_mon is not None and mon <= last_mon:
+                counts = [0] * (len(self._age_days) + 1)
+                for count_idx in (self._counted_users.get(mon) or {}).values():
+                    counts[count_idx] += 1
+
+                row: list[object] = [f"{mon.year:04d}-{mon.month:02d}"]
+                row.extend(counts)
+                fp.write(*row)
+
+                # То же самое, но с суммированием для более удобного рисования графика
+                row = [f"{mon.year:04d}-{mon.month:02d}"]
+                s = 0
+                for c in counts:
+                    s += c
+                    row.append(s)
+                fp_sum.write(*row)
+
+                # А также полные списки пользователей для запрошенных месяцев
+                if mon in self._dump_user_list_for_months:
+                    self._dump_users(stat, mon)
+
+                mon = (mon + timedelta(days=32)).replace(day=1)
 
         super().stop(stat)
@@ -1,8 +1,11 @@
+from bisect import bisect_left
+from collections import Counter
 from datetime import datetime, timedelta
-from typing import IO, TypedDict
+from typing import TypedDict
 
-from tabun_stat import types, utils
-from tabun_stat.processors.base import BaseProcessor
+from tabun_stat import types
+from tabun_stat.output import RowWriter
+from tabun_stat.processors.base import MergeableProcessor
 from tabun_stat.stat import TabunStat
 
 
@@ -11,7 +14,7 @@ class StatCategory(TypedDict):
     blogs: list[str]
 
 
-class PostsCountsProcessor(BaseProcessor):
+class PostsCountsProcessor(MergeableProcessor):
     def __init__(
         self,
         *,
@@ -50,50 +53,56 @@ class PostsCountsProcessor(BaseProcessor):
         self._personal_idx = len(self._labels) - 2
         self._open_idx = len(self._labels) - 1
 
-        # Статистика по категориям
-        self._stat = [0] * len(self._labels)
+        # Статистика по категориям для каждого периода: {period_idx: counts}
+        self._stat: dict[int, list[int]] = {}
 
         # Период подсчёта статистики (по умолчанию неделя)
         self.period = period
         # С какого дня начинать считать статистику
         # (границы суток считаются с учётом часового пояса из настроек)
+        self.first_day = first_day
+        # Текущий период; начинаем его при обработке первого поста, потому
+        # что при обработке по кусочкам start не вызывается
+        self._period_idx = -1
         self.period_begin = first_day
-        self.period_end = self.period_begin  # Перезапишем в start
-
-        self._fp: IO[str] | None = None
-        self._fp_sum: IO[str] | None = None
-        self._fp_perc: IO[str] | None = None
-
-    def start(self, stat: TabunStat) -> None:
-        super().start(stat)
-        self._fp = (stat.destination / "posts_counts.csv").open("w", encoding="utf-8")
-        self._fp_sum = (stat.destination / "posts_counts_sum.csv").open("w", encoding="utf-8")
-        self._fp_perc = (stat.destination / "posts_counts_perc.csv").open("w", encoding="utf-8")
-
-        # Применяем часовой пояс к периоду
-        self.period_begin = self.period_end = self.period_begin.astimezone(stat.tz)
-        # И начинаем первый период
-        self._increment_period()
-
-        header = ["Дата"] + self._labels
-        header_csv = utils.csvline(*header)
-
-        self._fp.write(header_csv)
-        self._fp_sum.write(header_csv)
-        self._fp_perc.write(utils.csvline(*header))
+        self.period_end = first_day
 
     def process_blog(self, stat: TabunStat, blog: types.Blog) -> None:
         if blog.slug in self._blogs_categories_slug:
             self._blogs_categories[blog.id] = self._blogs_categories_slug[blog.slug]
 
     def process_post(self, stat: TabunStat, post: types.Post) -> None:
-        # Если период закончился, то сохраняем статистику
+        # Если период закончился, то переходим к следующему
+        self._begin_period(stat)
         while post.created_at >= self.period_end:
-            self._flush_stat()
+            self._increment_period()
 
+        # Пишем статистику в выбранную категорию
+        self._get_period_stat()[self._get_category(post.blog_id, post.blog_status)] += 1
+
+    def process_messages_batch(self, stat: TabunStat, batch: types.MessagesBatch) -> None:
+        # Индексы постов в пачке и их даты (отсортированы по времени)
+        posts = [i for i, is_comment in enumerate(batch.is_comment) if not is_comment]
+        created_at = [batch.created_at[i] for i in posts]
+
+        self._begin_period(stat)
+        pos = 0
+        while pos < len(posts):
+            # Посты до конца текущего периода
+            end = bisect_left(created_at, self.period_end.timestamp(), pos)
+            if end == pos:
+                # Период закончился, переходим к следующему
+                self._increment_period()
+                continue
+
+            period_stat = self._get_period_stat()
+            categories = Counter((batch.blog_id[i], batch.blog_status[i]) for i in posts[pos:end])
+            for (blog_id, blog_status), count in categories.items():
+                period_stat[self._get_category(blog_id if blog_id != -1 else None, blog_status)] += count
+            pos = end
+
+    def _get_category(self, blog_id: int | None, blog_status: int) -> int:
         # Вычисляем категорию согласно настройкам
-        blog_id = post.blog_id
-        blog_status = post.blog_status
         category_idx = self._blogs_categories.get(blog_id) if blog_id is not None else None
 
         # Если в настройках ничего, то используем одну из встроенных категорий
@@ -108,12 +117,18 @@ class PostsCountsProcessor(BaseProcessor):
                 assert blog_status == 0
                 category_idx = self._open_idx
 
-        # Пишем статистику в выбранную категорию
-        self._stat[category_idx] += 1
+        return category_idx
 
-    def _flush_stat(self) -> None:
+    def _write_stat(
+        self,
+        fp: RowWriter,
+        fp_sum: RowWriter,
+        fp_perc: RowWriter,
+        period_begin: datetime,
+        period_stat: list[int],
+    ) -> None:
         # Собираем три разные строки для трёх файлов
-        line: list[object] = [self.period_begin.strftime("%Y-%m-%d")]
+        line: list[object] = [period_begin.strftime("%Y-%m-%d")]
         line_sum = line[:]
         line_perc = line[:]
 
@@ -121,11 +136,11 @@ class PostsCountsProcessor(BaseProcessor):
         # Число постов, доступных в базе данных
         # (достоверно посчитать число всех постов, в отличие от комментов,
         # нельзя, потому что дата создания/публикации поста может меняться)
-        all_exist_count = sum(self._stat)
+        all_exist_count = sum(period_stat)
 
         # И собираем в строки данные по каждой категории
         cnt_sum = 0
-        for cnt in self._stat:
+        for cnt in period_stat:
             # В простой файл просто пишем число как есть
             line.append(cnt)
             # В файле с суммами используем складывание слева направо для более простого рисования графиков
@@ -136,35 +151,59 @@ class PostsCountsProcessor(BaseProcessor):
             line_perc.append(f"{percent:.2f}")
 
         # Пишем в файлы
-        assert self._fp
-        self._fp.write(utils.csvline(*line))
-        assert self._fp_sum
-        self._fp_sum.write(utils.csvline(*line_sum))
-        assert self._fp_perc
-        self._fp_perc.write(utils.csvline(*line_perc))
+        fp.write(*line)
+        fp_sum.write(*line_sum)
+        fp_perc.write(*line_perc)
 
-        # Обнуляем статистику для начала следующего периода
-        self._stat = [0] * len(self._labels)
-
-        # Высчитываем следующий период
-        self._increment_period()
+    def _begin_period(self, stat: TabunStat) -> None:
+        if self._period_idx < 0:
+            # Применяем часовой пояс к периоду и начинаем первый период
+            self.period_begin = self.period_end = self.first_day.astimezone(stat.tz)
+            self._increment_period()
 
     def _increment_period(self) -> None:
+        self._period_idx += 1
         self.period_begin = self.period_end
         # Теоретически есть шанс попасть в несуществующее или неоднозначное время... но пофиг наверное
         self.period_end = self.period_begin + timedelta(days=self.period)
 
+    def _get_period_stat(self) -> list[int]:
+        try:
+            return self._stat[self._period_idx]
+        except KeyError:
+            period_stat = [0] * len(self._labels)
+            self._stat[self._period_idx] = period_stat
+            return period_stat
+
+    def export_state(self) -> dict[int, list[int]]:
+        return self._stat
+
+    def merge_state(self, state: object) -> None:
+        assert isinstance(state, dict)
+        for period_idx, period_stat in state.items():
+            if period_idx not in self._stat:
+                self._stat[period_idx] = period_stat
+            else:
+                self._stat[period_idx] = [a + b for a, b in zip(self._stat[period_idx], period_stat)]
+
     def stop(self, stat: TabunStat) -> None:
-        if sum(self._stat) > 0:
-            self._flush_stat()
-
-        if self._fp is not None:
-            self._fp.close()
-            self._fp = None
-        if self._fp_sum is not None:
-            self._fp_sum.close()
-            self._fp_sum = None
-        if self._fp_perc is not None:
-            self._fp_perc.close()
-            self._fp_perc = None
+        header = ["Дата"] + self._labels
+        with (
+            stat.open_csv("posts_counts.csv") as fp,
+            stat.open_csv("posts_counts_sum.csv") as fp_sum,
+            stat.open_csv("posts_counts_perc.csv") as fp_perc,
+        ):
+            fp.write(*header)
+            fp_sum.write(*header)
+            fp_perc.write(*header)
+
+            # Пишем все периоды от первого до последнего с постами, в том
+            # числе пустые
+            last_idx = max(self._stat, default=-1)
+            period_begin = self.first_day.astimezone(stat.tz)
+            for period_idx in range(last_idx + 1):
+                period_stat = self._stat.get(period_idx) or [0] * len(self._labels)
+                self._write_stat(fp, fp_sum, fp_perc, period_begin, period_stat)
+                period_begin += timedelta(days=self.period)
+
         super().stop(stat)
@@ -1,11 +1,12 @@
+from collections.abc import Iterable
 from datetime import date, timedelta
 
-from tabun_stat import types, utils
-from tabun_stat.processors.base import BaseProcessor
+from tabun_stat import types
+from tabun_stat.processors.base import MergeableProcessor
 from tabun_stat.stat import TabunStat
 
 
-class PostsCountsAvgProcessor(BaseProcessor):
+class PostsCountsAvgProcessor(MergeableProcessor):
     def __init__(
         self,
         *,
@@ -17,43 +18,59 @@ class PostsCountsAvgProcessor(BaseProcessor):
         self.collect_empty_days = collect_empty_days
         self.save_last_months = save_last_months
 
-        self._last_day: date | None = None
-
         # Число комментов в месяце во часам
         self._counts: dict[tuple[int, int], list[int]] = {}
 
-        # Число дней в месяце, учтённых в статистике
-        self._days: dict[tuple[int, int], int] = {}
+        # Дни, в которые были посты
+        self._days: set[date] = set()
 
     def process_post(self, stat: TabunStat, post: types.Post) -> None:
         assert post.created_at_local is not None
         day = post.created_at_local.date()
         hour = post.created_at_local.hour
 
-        # Если это самый первый пост, поступивший на обработку, то
-        # инициализиуем всю статистику
-        if self._last_day is None:
-            self._last_day = day
-            self._counts = {(day.year, day.month): [0] * 24}
-            self._days = {(day.year, day.month): 1}
-
-        # Если день сменился, то готовим статистику для нового дня
-        assert day >= self._last_day
-        while day != self._last_day:
-            if self.collect_empty_days:
-                # Благодаря циклу while дни без постов будут учитываться
-                self._last_day += timedelta(days=1)
-            else:
-                # ...или не учитываться, если в конфиге отключено
-                self._last_day = day
+        self._days.add(day)
+        mon = (day.year, day.month)
+        if mon not in self._counts:
+            self._counts[mon] = [0] * 24
+        self._counts[mon][hour] += 1
+
+    def export_state(self) -> tuple[dict[tuple[int, int], list[int]], set[date]]:
+        return self._counts, self._days
 
-            mon = (self._last_day.year, self._last_day.month)
+    def merge_state(self, state: object) -> None:
+        assert isinstance(state, tuple)
+        counts, days = state
+        for mon, cstat in counts.items():
+            if mon not in self._counts:
+                self._counts[mon] = cstat
+            else:
+                self._counts[mon] = [a + b for a, b in zip(self._counts[mon], cstat)]
+        self._days.update(days)
+
+    def _count_days(self) -> dict[tuple[int, int], int]:
+        """Считает число дней в каждом месяце, учтённых в статистике."""
+        result: dict[tuple[int, int], int] = {}
+        if not self._days:
+            return result
+
+        if self.collect_empty_days:
+            # Дни без постов между первым и последним днём тоже учитываются...
+            days: Iterable[date] = (
+                min(self._days) + timedelta(days=i)
+                for i in range((max(self._days) - min(self._days)).days + 1)
+            )
+        else:
+            # ...или не учитываются, если в конфиге отключено
+            days = self._days
+
+        for day in days:
+            mon = (day.year, day.month)
+            result[mon] = result.get(mon, 0) + 1
+            # Месяцы совсем без сообщений тоже попадают в статистику
             if mon not in self._counts:
                 self._counts[mon] = [0] * 24
-                self._days[mon] = 0
-            self._days[mon] += 1
-
-        self._counts[(day.year, day.month)][hour] += 1
+        return result
 
     def stop(self, stat: TabunStat) -> None:
         # Считаем статистику за всё время...
@@ -65,8 +82,9 @@ class PostsCountsAvgProcessor(BaseProcessor):
         days_year: dict[int, int] = {}
 
         # ...в одном цикле
+        days_counts = self._count_days()
         for (year, monn), cstat in self._counts.items():
-            days = self._days[(year, monn)]
+            days = days_counts[(year, monn)]
 
             if year not in counts_year:
                 counts_year[year] = [0] * 24
@@ -88,8 +106,8 @@ class PostsCountsAvgProcessor(BaseProcessor):
         for mon in last_months:
             header.append(f"{mon[0]:04d}-{mon[1]:02d}")
 
-        with (stat.destination / "posts_counts_avg.csv").open("w", encoding="utf-8") as fp:
-            fp.write(utils.csvline(*header))
+        with stat.open_csv("posts_counts_avg.csv") as fp:
+            fp.write(*header)
 
             for hour in range(24):
                 line: list[object] = [hour]
@@ -103,8 +121,8 @@ class PostsCountsAvgProcessor(BaseProcessor):
 
                 # И за два последних месяца
                 for mon in last_months:
-                    line.append("{:.2f}".format(self._counts[mon][hour] / (self._days.get(mon) or 1)))
+                    line.append("{:.2f}".format(self._counts[mon][hour] / (days_counts.get(mon) or 1)))
 
-                fp.write(utils.csvline(*line))
+                fp.write(*line)
 
         super().stop(stat)
@@ -1,9 +1,9 @@
-from tabun_stat import types, utils
-from tabun_stat.processors.base import BaseProcessor
+from tabun_stat import types
+from tabun_stat.processors.base import MergeableProcessor
 from tabun_stat.stat import TabunStat
 
 
-class PostsRatingsProcessor(BaseProcessor):
+class PostsRatingsProcessor(MergeableProcessor):
     def __init__(self) -> None:
         super().__init__()
 
@@ -26,6 +26,16 @@ class PostsRatingsProcessor(BaseProcessor):
             self._stat[year][vote] = 0
         self._stat[year][vote] += 1
 
+    def export_state(self) -> dict[int, dict[int, int]]:
+        return self._stat
+
+    def merge_state(self, state: object) -> None:
+        assert isinstance(state, dict)
+        for year, votes_dict in state.items():
+            year_stat = self._stat.setdefault(year, {})
+            for vote, count in votes_dict.items():
+                year_stat[vote] = year_stat.get(vote, 0) + count
+
     def stop(self, stat: TabunStat) -> None:
         min_rating = 0
         max_rating = 0
@@ -37,13 +47,13 @@ class PostsRatingsProcessor(BaseProcessor):
         for year in sorted(self._stat):
             header.append(f"{year} год")
 
-        with (stat.destination / "posts_ratings.csv").open("w", encoding="utf-8") as fp:
-            fp.write(utils.csvline(*header))
+        with stat.open_csv("posts_ratings.csv") as fp:
+            fp.write(*header)
             for vote in range(min_rating, max_rating + 1):
                 line = [vote, 0]
                 for year in sorted(self._stat):
                     line.append(self._stat[year].get(vote, 0))
                     line[1] += line[-1]
-                fp.write(utils.csvline(*line))
+                fp.write(*line)
 
         super().stop(stat)
@@ -1,7 +1,7 @@
 from datetime import date, timedelta
 from typing import Sequence
 
-from tabun_stat import types, utils
+from tabun_stat import types
 from tabun_stat.processors.base import BaseProcessor
 from tabun_stat.stat import TabunStat
 
@@ -53,12 +53,12 @@ class RegistrationsProcessor(BaseProcessor):
         day = min(self._stat)
         max_day = max(self._stat)
 
-        with (stat.destination / "registrations.csv").open("w", encoding="utf-8") as fp:
+        with stat.open_csv("registrations.csv") as fp:
             headers = ["Дата", "Новые пользователи", "Всего пользователей"]
             for r, _ in self._stat_by_rating:
                 headers.append(f"Всего с рейтингом ≥ {r:0.2f}")
 
-            fp.write(utils.csvline(*headers))
+            fp.write(*headers)
 
             all_users = 0
             all_users_by_rating = [0] * len(self._stat_by_rating)
@@ -71,6 +71,6 @@ class RegistrationsProcessor(BaseProcessor):
                 if day >= self.start_date:
                     row = [day, self._stat.get(day, 0), all_users]
                     row.extend(all_users_by_rating)
-                    fp.write(utils.csvline(*row))
+                    fp.write(*row)
 
                 day += timedelta(days=1)
@@ -1,12 +1,12 @@
 import math
 from typing import Iterable
 
-from tabun_stat import types, utils
-from tabun_stat.processors.base import BaseProcessor
+from tabun_stat import types
+from tabun_stat.processors.base import MergeableProcessor
 from tabun_stat.stat import TabunStat
 
 
-class UsersRatingsProcessor(BaseProcessor):
+class UsersRatingsProcessor(MergeableProcessor):
     def __init__(self, *, steps: Iterable[int] = (10, 100)):
         super().__init__()
 
@@ -25,10 +25,22 @@ class UsersRatingsProcessor(BaseProcessor):
         if user.rating == 0.0:
             self._zero += 1
 
-    def end_users(self, stat: TabunStat, limits: types.UsersLimits) -> None:
+    def export_state(self) -> tuple[dict[int, dict[int, int]], int]:
+        return self._ratings, self._zero
+
+    def merge_state(self, state: object) -> None:
+        assert isinstance(state, tuple)
+        ratings_state, zero = state
+        for step, ratings in ratings_state.items():
+            my_ratings = self._ratings[step]
+            for step_vote, count in ratings.items():
+                my_ratings[step_vote] = my_ratings.get(step_vote, 0) + count
+        self._zero += zero
+
+    def stop(self, stat: TabunStat) -> None:
         for step, ratings in self._ratings.items():
-            with (stat.destination / f"users_ratings_{step}.csv").open("w", encoding="utf-8") as fp:
-                fp.write(utils.csvline("Рейтинг", "Число пользователей"))
+            with stat.open_csv(f"users_ratings_{step}.csv") as fp:
+                fp.write("Рейтинг", "Число пользователей")
 
                 step_vote = min(ratings)
                 vmax = max(ratings)
@@ -37,9 +49,11 @@ class UsersRatingsProcessor(BaseProcessor):
                     count = ratings.get(step_vote, 0)
 
                     step_vote_end = round(step_vote + (step - 0.01), 2)
-                    fp.write(utils.csvline(f"{step_vote:.2f} – {step_vote_end:.2f}", count))
+                    fp.write(f"{step_vote:.2f} – {step_vote_end:.2f}", count)
 
                     step_vote += step
 
         with (stat.destination / "users_ratings_zero.txt").open("w", encoding="utf-8") as fp:
             fp.write(f"{self._zero}\n")
+
+        super().stop(stat)
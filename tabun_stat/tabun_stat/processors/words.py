@@ -1,53 +1,301 @@
 import array
+import math
+import re
+from bisect import bisect_left
 from dataclasses import dataclass
 from datetime import datetime
-from typing import IO, Iterable
+from typing import Iterable, Iterator, Union
 
-from tabun_stat import types, utils
-from tabun_stat.processors.base import BaseProcessor
+from tabun_stat import types
+from tabun_stat.output import RowWriter
+from tabun_stat.processors.base import MergeableProcessor
+from tabun_stat.spill import Spiller, external_sort, merge_groups
 from tabun_stat.stat import TabunStat
+from tabun_stat.text import MessageText
+
+# Пока пользователей слова немного, они хранятся в отсортированном массиве;
+# когда их становится больше, массив заменяется на битовую карту (байт на каждые
+# восемь id пользователей), которая для популярных слов компактнее массива
+BITMAP_THRESHOLD = 1024
+
+# Множество пользователей слова: None (пусто), один id пользователя (самый
+# частый случай, не требует отдельного объекта), отсортированный массив id
+# или битовая карта
+UserSet = Union[None, int, "array.array[int]", bytearray]
+
+
+def put_user(users: list[UserSet], counts: "array.array[int]", idx: int, user_id: int) -> None:
+    """Добавляет пользователя в множество пользователей слова с номером idx
+    и обновляет число пользователей этого слова в counts.
+    """
+    current = users[idx]
+    if current is None:
+        users[idx] = user_id
+        counts[idx] = 1
+
+    elif isinstance(current, int):
+        if current != user_id:
+            users[idx] = array.array("I", (current, user_id) if current < user_id else (user_id, current))
+            counts[idx] = 2
+
+    elif isinstance(current, array.array):
+        pos = bisect_left(current, user_id)
+        if pos == len(current) or current[pos] != user_id:
+            current.insert(pos, user_id)
+            counts[idx] += 1
+            if len(current) > BITMAP_THRESHOLD:
+                bitmap = bytearray((current[-1] >> 3) + 1)
+                for uid in current:
+                    bitmap[uid >> 3] |= 1 << (uid & 7)
+                users[idx] = bitmap
+
+    else:
+        byte_idx = user_id >> 3
+        if byte_idx >= len(current):
+            current.extend(bytes(byte_idx - len(current) + 1))
+        bit = 1 << (user_id & 7)
+        if not current[byte_idx] & bit:
+            current[byte_idx] |= bit
+            counts[idx] += 1
+
+
+def iter_users(users: UserSet) -> Iterator[int]:
+    if users is None:
+        return
+    if isinstance(users, int):
+        yield users
+    elif isinstance(users, array.array):
+        yield from users
+    else:
+        for byte_idx, byte in enumerate(users):
+            if byte:
+                for bit in range(8):
+                    if byte & (1 << bit):
+                        yield (byte_idx << 3) | bit
+
+
+def make_user_set(user_ids: list[int]) -> UserSet:
+    """Создаёт множество пользователей из отсортированного списка id."""
+    if not user_ids:
+        return None
+    if len(user_ids) == 1:
+        return user_ids[0]
+    if len(user_ids) <= BITMAP_THRESHOLD:
+        return array.array("I", user_ids)
+    bitmap = bytearray((user_ids[-1] >> 3) + 1)
+    for uid in user_ids:
+        bitmap[uid >> 3] |= 1 << (uid & 7)
+    return bitmap
+
+
+def union_users(sets: Iterable[UserSet]) -> tuple[UserSet, int]:
+    """Объединяет множества пользователей. Возвращает новое множество
+    и число пользователей в нём.
+    """
+    user_ids: set[int] = set()
+    for users in sets:
+        user_ids.update(iter_users(users))
+    return make_user_set(sorted(user_ids)), len(user_ids)
 
 
 @dataclass(slots=True)
 class WordStat:
-    first_date: datetime
-    first_public_date: datetime | None
-    last_date: datetime
-    last_public_date: datetime | None
+    """Статистика одного слова, выгруженная из WordsTable (используется
+    при сбросе статистики на диск и при её выводе).
+    """
+
+    word: bytes
+    # Номер слова в WordsTable (порядок первого использования)
+    order: int
+
+    first_date: float
+    first_public_date: float
+    last_date: float
+    last_public_date: float
     count: int
     public_count: int
     nobots_count: int
     public_nobots_count: int
 
-    # Списки/массивы медленнее, но экономнее по памяти чем словари и множества,
-    # поэтому городим такие компромиссные костыли
-    users: dict[int, "array.array[int]"]
+    users: UserSet
     users_count: int
-    public_users: dict[int, "array.array[int]"]
+    public_users: UserSet
     public_users_count: int
 
-    def put_user(self, user_id: int) -> None:
-        user_key = user_id // 1000
-        user_list = self.users.get(user_key)
-        if user_list is None:
-            self.users[user_key] = array.array("I", [user_id])
-            self.users_count += 1
-        elif user_id not in user_list:
-            user_list.append(user_id)
-            self.users_count += 1
-
-    def put_public_user(self, user_id: int) -> None:
-        user_key = user_id // 1000
-        user_list = self.public_users.get(user_key)
-        if user_list is None:
-            self.public_users[user_key] = array.array("I", [user_id])
-            self.public_users_count += 1
-        elif user_id not in user_list:
-            user_list.append(user_id)
-            self.public_users_count += 1
-
-
-class WordsProcessor(BaseProcessor):
+
+def merge_word_stats(items: list[tuple[int, WordStat]]) -> tuple[int, WordStat]:
+    """Объединяет статистику одного и того же слова из разных прогонов
+    (см. tabun_stat.spill). Элементы — пары (номер прогона, статистика)
+    в хронологическом порядке прогонов.
+    """
+    run_no, first = items[0]
+    stats = [x[1] for x in items]
+
+    first_public_dates = [x.first_public_date for x in stats if not math.isnan(x.first_public_date)]
+    last_public_dates = [x.last_public_date for x in stats if not math.isnan(x.last_public_date)]
+    users, users_count = union_users(x.users for x in stats)
+    public_users, public_users_count = union_users(x.public_users for x in stats)
+
+    return run_no, WordStat(
+        word=first.word,
+        order=first.order,
+        first_date=first.first_date,
+        first_public_date=first_public_dates[0] if first_public_dates else math.nan,
+        last_date=stats[-1].last_date,
+        last_public_date=last_public_dates[-1] if last_public_dates else math.nan,
+        count=sum(x.count for x in stats),
+        public_count=sum(x.public_count for x in stats),
+        nobots_count=sum(x.nobots_count for x in stats),
+        public_nobots_count=sum(x.public_nobots_count for x in stats),
+        users=users,
+        users_count=users_count,
+        public_users=public_users,
+        public_users_count=public_users_count,
+    )
+
+
+class WordsTable:
+    """Компактная таблица статистики по словам. Каждому слову при первой
+    встрече присваивается номер, а вся статистика хранится в колонках-массивах
+    по этому номеру, а не в отдельном объекте на каждое слово (их миллионы,
+    и накладные расходы на объекты занимали гигабайты памяти).
+
+    Даты хранятся как unix timestamp, отсутствующие даты — как NaN.
+    """
+
+    def __init__(self) -> None:
+        # Номера слов; словарь сохраняет порядок добавления, так что он же
+        # служит списком слов по порядку первого использования
+        self.ids: dict[bytes, int] = {}
+
+        self.first_date = array.array("d")
+        self.first_public_date = array.array("d")
+        self.last_date = array.array("d")
+        self.last_public_date = array.array("d")
+        self.count = array.array("q")
+        self.public_count = array.array("q")
+        self.nobots_count = array.array("q")
+        self.public_nobots_count = array.array("q")
+
+        self.users: list[UserSet] = []
+        self.users_count = array.array("q")
+        self.public_users: list[UserSet] = []
+        self.public_users_count = array.array("q")
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def put_words(self, words: list[bytes], tm: float, author_id: int, *, public: bool, is_bot: bool) -> None:
+        """Добавляет использование слов из одного сообщения.
+
+        :param words: слова сообщения (повторы считаются по отдельности)
+        :param tm: время создания сообщения (unix timestamp)
+        :param author_id: id автора сообщения
+        :param public: сообщение в открытом или полузакрытом блоге
+        :param is_bot: автор сообщения — бот
+        """
+        ids = self.ids
+        users = self.users
+        users_count = self.users_count
+        public_users = self.public_users
+        public_users_count = self.public_users_count
+        nobots = 0 if is_bot else 1
+
+        for word in words:
+            idx = ids.get(word)
+            if idx is None:
+                idx = len(ids)
+                ids[word] = idx
+                self.first_date.append(tm)
+                self.first_public_date.append(math.nan)
+                self.last_date.append(tm)
+                self.last_public_date.append(math.nan)
+                self.count.append(0)
+                self.public_count.append(0)
+                self.nobots_count.append(0)
+                self.public_nobots_count.append(0)
+                users.append(None)
+                users_count.append(0)
+                public_users.append(None)
+                public_users_count.append(0)
+
+            self.last_date[idx] = tm
+            self.count[idx] += 1
+            self.nobots_count[idx] += nobots
+            if users[idx] != author_id:
+                put_user(users, users_count, idx, author_id)
+
+            if public:
+                if math.isnan(self.first_public_date[idx]):
+                    self.first_public_date[idx] = tm
+                self.last_public_date[idx] = tm
+                self.public_count[idx] += 1
+                self.public_nobots_count[idx] += nobots
+                if public_users[idx] != author_id:
+                    put_user(public_users, public_users_count, idx, author_id)
+
+    def merge(self, other: "WordsTable") -> None:
+        """Добавляет статистику из другой таблицы, собранной по более поздним
+        сообщениям (например, в другом куске).
+        """
+        ids = self.ids
+        for word_stat in other.iter_stats():
+            idx = ids.get(word_stat.word)
+            if idx is None:
+                ids[word_stat.word] = len(ids)
+                self.first_date.append(word_stat.first_date)
+                self.first_public_date.append(word_stat.first_public_date)
+                self.last_date.append(word_stat.last_date)
+                self.last_public_date.append(word_stat.last_public_date)
+                self.count.append(word_stat.count)
+                self.public_count.append(word_stat.public_count)
+                self.nobots_count.append(word_stat.nobots_count)
+                self.public_nobots_count.append(word_stat.public_nobots_count)
+                self.users.append(word_stat.users)
+                self.users_count.append(word_stat.users_count)
+                self.public_users.append(word_stat.public_users)
+                self.public_users_count.append(word_stat.public_users_count)
+                continue
+
+            self.last_date[idx] = word_stat.last_date
+            if math.isnan(self.first_public_date[idx]):
+                self.first_public_date[idx] = word_stat.first_public_date
+            if not math.isnan(word_stat.last_public_date):
+                self.last_public_date[idx] = word_stat.last_public_date
+            self.count[idx] += word_stat.count
+            self.public_count[idx] += word_stat.public_count
+            self.nobots_count[idx] += word_stat.nobots_count
+            self.public_nobots_count[idx] += word_stat.public_nobots_count
+            for user_id in iter_users(word_stat.users):
+                put_user(self.users, self.users_count, idx, user_id)
+            for user_id in iter_users(word_stat.public_users):
+                put_user(self.public_users, self.public_users_count, idx, user_id)
+
+    def iter_stats(self, words: Iterable[bytes] | None = None) -> Iterator[WordStat]:
+        """Выгружает статистику указанных слов (по умолчанию всех в порядке
+        первого использования).
+        """
+        for word in self.ids if words is None else words:
+            idx = self.ids[word]
+            yield WordStat(
+                word=word,
+                order=idx,
+                first_date=self.first_date[idx],
+                first_public_date=self.first_public_date[idx],
+                last_date=self.last_date[idx],
+                last_public_date=self.last_public_date[idx],
+                count=self.count[idx],
+                public_count=self.public_count[idx],
+                nobots_count=self.nobots_count[idx],
+                public_nobots_count=self.public_nobots_count[idx],
+                users=self.users[idx],
+                users_count=self.users_count[idx],
+                public_users=self.public_users[idx],
+                public_users_count=self.public_users_count[idx],
+            )
+
+
+class WordsProcessor(MergeableProcessor):
     default_delimiters = ".,?!@'\"«»-—–()*:;#№$%^&[]{}\\/|`~=©®™+©°×⋅…_″′“”"
 
     # Так как я решил использовать байтовые строки вместо юникодных, придётся
@@ -65,17 +313,40 @@ class WordsProcessor(BaseProcessor):
         delimiters: str | None = None,
         since: datetime | None = None,
         user_lists_max_len: int = 20,
+        spill_threshold: int | None = None,
+        spill_dir: str | None = None,
     ):
+        """
+        :param spill_threshold: если задано, то при превышении этого числа
+          различных слов в памяти их статистика сбрасывается на диск
+          во временные файлы и объединяется в конце (медленнее, но позволяет
+          обработать всю базу при небольшом объёме памяти)
+        :param spill_dir: каталог для временных файлов (по умолчанию
+          системный)
+        """
         super().__init__()
         self.bot_ids = tuple(bot_ids)
         self.delimiters = delimiters or self.default_delimiters
         self.since = since
         self.user_lists_max_len = user_lists_max_len
+        self.spill_threshold = spill_threshold
+        self.spill_dir = spill_dir
+
+        if spill_threshold is not None and spill_threshold < 1:
+            raise ValueError("spill_threshold must be positive")
 
         if since is not None and since.tzinfo is None:
             raise ValueError("since must be aware datetime")
 
-        self._trans_table = str.maketrans({x: 32 for x in self.delimiters + self.whitespaces})
+        # Теги и идущие подряд разделители заменяются одним пробелом за один
+        # проход регулярки; _separators_re — то же без тегов (для заголовков,
+        # тегов постов и хвоста сообщения без «>», см. split_words)
+        separators = "[" + re.escape(self.delimiters + self.whitespaces) + "]+"
+        self._html_separators_re = re.compile("<[^>]*>|" + separators)
+        self._separators_re = re.compile(separators)
+        # Слова сообщений запоминаются в MessageText, и обработчики
+        # с одинаковыми разделителями используют их совместно
+        self._split_key = ("words", self.delimiters + self.whitespaces)
 
         # Первый элемент — значение в штуках/символах/байтах, второй — количество постов/комментов
         self._post_len_words = [0, 0]
@@ -91,9 +362,9 @@ class WordsProcessor(BaseProcessor):
         self._comments_without_text = 0
 
         # Статистика по отдельным словам
-        # {первые три байта: {слово: WordStat}}
-        self._stat: dict[bytes, dict[bytes, WordStat]] = {}
-        self._words_list: list[bytes] = []
+        self._words = WordsTable()
+        # Статистика, сброшенная на диск (см. spill_threshold)
+        self._spiller = Spiller(spill_dir, prefix="tabun_stat_words_")
 
         self._warned_posts: set[int] = set()
 
@@ -111,7 +382,7 @@ class WordsProcessor(BaseProcessor):
         )
         self._process(
             post.author_id,
-            post.body,
+            stat.get_message_text(post),
             post.created_at_local,
             is_comment=False,
             is_title=False,
@@ -133,11 +404,12 @@ class WordsProcessor(BaseProcessor):
         assert comment.created_at_local is not None
         if comment.post_id is None or comment.blog_status is None:
             if comment.post_id is None or comment.post_id not in self._warned_posts:
-                stat.log(
-                    0,
-                    f"WARNING: words: comment {comment.id} for unknown post {comment.post_id},",
-                    "marking as private",
-                )
+                if comment.blog_id is not None:
+                    # Пост есть, но его блога нет в базе данных
+                    what = f"from post {comment.post_id} with unknown blog {comment.blog_id}"
+                else:
+                    what = f"for unknown post {comment.post_id}"
+                stat.log(0, f"WARNING: words: comment {comment.id} {what},", "marking as private")
             if comment.post_id is not None:
                 self._warned_posts.add(comment.post_id)
             public = False
@@ -146,7 +418,7 @@ class WordsProcessor(BaseProcessor):
 
         self._process(
             comment.author_id,
-            comment.body,
+            stat.get_message_text(comment),
             comment.created_at_local,
             is_comment=True,
             is_title=False,
@@ -154,25 +426,30 @@ class WordsProcessor(BaseProcessor):
             public=public,
         )
 
-    def _get_word_stat(self, word: bytes) -> WordStat | None:
-        word_key = word[:3]
-        words_stat_local = self._stat.get(word_key)
-        if words_stat_local is None:
-            return None
-        return words_stat_local.get(word)
-
-    def _put_word_stat(self, word: bytes, stat: WordStat) -> None:
-        word_key = word[:3]
-        words_stat_local = self._stat.get(word_key)
-        if words_stat_local is None:
-            self._stat[word_key] = {word: stat}
+    def split_words(self, body: str, *, strip_tags: bool = True) -> list[bytes]:
+        """Делит текст на слова: выкидывает HTML-теги (если strip_tags),
+        разделители и пробельные символы и приводит слова к нижнему регистру.
+        Слова возвращаются закодированными в utf-8 (так немного экономнее
+        по памяти и чуть быстрее по скорости).
+        """
+        if strip_tags:
+            # После последнего «>» тегов уже нет; если и там искать теги, то
+            # регулярка от каждого «<» без пары будет сканировать текст
+            # до конца, и время станет квадратичным
+            end = body.rfind(">") + 1
+            if end > 0:
+                head = self._html_separators_re.sub(" ", body[:end])
+                body = head + self._separators_re.sub(" ", body[end:])
+            else:
+                body = self._separators_re.sub(" ", body)
         else:
-            words_stat_local[word] = stat
+            body = self._separators_re.sub(" ", body)
+        return body.lower().encode("utf-8").split()
 
     def _process(
         self,
         author_id: int,
-        raw_body: str,
+        body: str | MessageText,
         created_at_local: datetime,
         *,
         is_comment: bool,
@@ -181,34 +458,21 @@ class WordsProcessor(BaseProcessor):
         public: bool,
     ) -> None:
         if not is_title and not is_tag:
+            assert isinstance(body, MessageText)
             # Фиксим косяк старых версий tbackup
-            if not raw_body.startswith("<div ") and raw_body.endswith("</div>"):
-                raw_body = raw_body[raw_body.find(">") + 1 : raw_body.rfind("<")].strip()
-
-            body = raw_body.strip()
-            if not body:
+            raw_body = body.unwrapped
+            if not raw_body or raw_body.isspace():
                 return
 
-            # Выкидываем HTML-теги
-            while True:
-                f1 = body.find("<")
-                if f1 < 0:
-                    break
-                f2 = body.find(">", f1 + 1)
-                if f2 < 0:
-                    break
-                body = body[:f1] + " " + body[f2 + 1 :]
+            words = body.get_words(self._split_key, self.split_words)
 
         else:
             # Для заголовков и тегов предобработка не нужна
-            body = raw_body
+            assert isinstance(body, str)
             if not body:
                 return
-
-        # Делим сообщение на слова
-        # (хранить в закодированном utf-8 немного экономнее по памяти и чуть быстрее по скорости)
-        body = body.translate(self._trans_table)
-        words = body.lower().encode("utf-8").split()
+            raw_body = body
+            words = self.split_words(body, strip_tags=False)
 
         if not is_title and not is_tag:
             # Считаем статистику публикаций в целом
@@ -244,116 +508,169 @@ class WordsProcessor(BaseProcessor):
             # MineOzelot статистика в бункере
             is_bot = True
 
-        for word in words:
-            ws = self._get_word_stat(word)
-            if ws is None:
-                self._words_list.append(word)
-                ws = WordStat(
-                    first_date=created_at_local,
-                    first_public_date=None,
-                    last_date=created_at_local,
-                    last_public_date=None,
-                    count=0,
-                    public_count=0,
-                    nobots_count=0,
-                    public_nobots_count=0,
-                    users={},
-                    users_count=0,
-                    public_users={},
-                    public_users_count=0,
-                )
-                self._put_word_stat(word, ws)
+        self._words.put_words(words, created_at_local.timestamp(), author_id, public=public, is_bot=is_bot)
+        if self.spill_threshold is not None and len(self._words) > self.spill_threshold:
+            self._spill()
 
-            if ws.first_public_date is None and public:
-                ws.first_public_date = created_at_local
+    def _spill(self) -> None:
+        """Сбрасывает статистику слов на диск, отсортировав её по словам,
+        и начинает новую таблицу.
+        """
+        self._spill_table(self._words)
+        self._words = WordsTable()
 
-            ws.last_date = created_at_local
-            ws.count += 1
-            if not is_bot:
-                ws.nobots_count += 1
-            ws.put_user(author_id)
+    def _spill_table(self, table: WordsTable) -> None:
+        if table:
+            self._spiller.write_run(table.iter_stats(sorted(table.ids)))
 
-            if public:
-                ws.last_public_date = created_at_local
-                ws.public_count += 1
-                if not is_bot:
-                    ws.public_nobots_count += 1
-                ws.put_public_user(author_id)
+    def export_state(
+        self,
+    ) -> tuple[list[list[int]], int, WordsTable, list[bytes]]:
+        # Сброшенная на диск статистика передаётся содержимым временных файлов,
+        # так как сами файлы будут удалены вместе с этим обработчиком
+        lengths = [
+            self._post_len_words,
+            self._post_len_chars,
+            self._post_len_bytes,
+            self._comment_len_words,
+            self._comment_len_chars,
+            self._comment_len_bytes,
+        ]
+        return lengths, self._comments_without_text, self._words, self._spiller.read_runs_bytes()
+
+    def merge_state(self, state: object) -> None:
+        assert isinstance(state, tuple)
+        lengths, comments_without_text, table, runs = state
+
+        my_lengths = [
+            self._post_len_words,
+            self._post_len_chars,
+            self._post_len_bytes,
+            self._comment_len_words,
+            self._comment_len_chars,
+            self._comment_len_bytes,
+        ]
+        for mine, other in zip(my_lengths, lengths):
+            mine[0] += other[0]
+            mine[1] += other[1]
+        self._comments_without_text += comments_without_text
+
+        if runs or self._spiller:
+            # Прогоны всех кусков идут в хронологическом порядке: сначала
+            # своя статистика, затем сброшенная на диск статистика куска
+            # и потом оставшаяся у него в памяти
+            self._spill()
+            for data in runs:
+                self._spiller.write_run_bytes(data)
+            self._spill_table(table)
+            return
+
+        self._words.merge(table)
+        if self.spill_threshold is not None and len(self._words) > self.spill_threshold:
+            self._spill()
+
+    def _get_usernames(self, stat: TabunStat, users: UserSet) -> list[str]:
+        # Как и в других обработчиках, неизвестный пользователь — ошибка,
+        # иначе число пользователей и их список разойдутся
+        user_ids = list(iter_users(users))
+        usernames = stat.get_usernames_by_ids(user_ids)
+        return [usernames[user_id] for user_id in user_ids]
+
+    def _iter_stats(self) -> Iterator[WordStat]:
+        """Выдаёт итоговую статистику слов в порядке первого использования."""
+        if not self._spiller:
+            yield from self._words.iter_stats()
+            return
+
+        self._spill()
+        merged = merge_groups(self._spiller.merge(lambda x: x.word), lambda x: x[1].word, merge_word_stats)
+        # Слово впервые использовано в самом раннем прогоне, где оно есть,
+        # и внутри прогона в порядке номеров
+        assert self.spill_threshold is not None
+        for _, word_stat in external_sort(
+            merged,
+            lambda x: (x[0], x[1].order),
+            chunk_size=self.spill_threshold,
+            directory=self.spill_dir,
+        ):
+            yield word_stat
 
     def stop(self, stat: TabunStat) -> None:
-        fps: list[tuple[IO[str], datetime | None]] = []
+        # Соседние слова часто впервые использованы в одном и том же
+        # сообщении, поэтому кэшируем последнюю отформатированную дату
+        last_date: tuple[float, str] = (math.nan, "")
+
+        def format_date(tm: float) -> str:
+            nonlocal last_date
+            if math.isnan(tm):
+                return ""
+            if last_date[0] != tm:
+                last_date = (tm, str(datetime.fromtimestamp(tm, stat.tz)))
+            return last_date[1]
+
+        writers: list[tuple[RowWriter, float | None]] = []
 
         try:
-            fps.append(((stat.destination / "words.csv").open("w", encoding="utf-8"), None))
+            writers.append((stat.open_csv("words.csv", large=True), None))
             if self.since is not None:
                 filename = f"words_since_{self.since.strftime('%Y-%m-%d_%H-%M-%S')}.csv"
-                fps.append(((stat.destination / filename).open("w", encoding="utf-8"), self.since))
-
-            for fp, since in fps:
-                fp.write(
-                    utils.csvline(
-                        "Слово",
-                        "Первое исп-е",
-                        "Первое исп-е на внешке",
-                        "Последнее исп-е",
-                        "Последнее исп-е на внешке",
-                        "Сколько раз",
-                        "Сколько раз на внешке",
-                        "Сколько раз (без ботов)",
-                        "Сколько раз на внешке (без ботов)",
-                        "Сколько юзеров юзали",
-                        "Кто юзал",
-                        "Сколько юзеров юзали на внешке",
-                        "Кто юзал на внешке",
-                    )
+                writers.append((stat.open_csv(filename, large=True), self.since.timestamp()))
+
+            for writer, _ in writers:
+                writer.write(
+                    "Слово",
+                    "Первое исп-е",
+                    "Первое исп-е на внешке",
+                    "Последнее исп-е",
+                    "Последнее исп-е на внешке",
+                    "Сколько раз",
+                    "Сколько раз на внешке",
+                    "Сколько раз (без ботов)",
+                    "Сколько раз на внешке (без ботов)",
+                    "Сколько юзеров юзали",
+                    "Кто юзал",
+                    "Сколько юзеров юзали на внешке",
+                    "Кто юзал на внешке",
+                )
+
+            # Все файлы пишутся за один проход, так как при сбросе статистики
+            # на диск (spill_threshold) каждый проход — это чтение всех
+            # временных файлов
+            for word_stat in self._iter_stats():
+                if word_stat.users_count <= self.user_lists_max_len:
+                    users = self._get_usernames(stat, word_stat.users)
+                else:
+                    users = []
+
+                if word_stat.public_users_count <= self.user_lists_max_len:
+                    public_users = self._get_usernames(stat, word_stat.public_users)
+                else:
+                    public_users = []
+
+                line = (
+                    word_stat.word.decode("utf-8"),
+                    format_date(word_stat.first_date),
+                    format_date(word_stat.first_public_date),
+                    format_date(word_stat.last_date),
+                    format_date(word_stat.last_public_date),
+                    word_stat.count,
+                    word_stat.public_count,
+                    word_stat.nobots_count,
+                    word_stat.public_nobots_count,
+                    word_stat.users_count,
+                    "; ".join(sorted(users)) if users else "",
+                    word_stat.public_users_count,
+                    "; ".join(sorted(public_users)) if public_users else "",
                 )
-                for word in self._words_list:
-                    data = self._get_word_stat(word)
-                    assert data is not None
-
-                    if since is not None and data.first_date < since:
-                        continue
-
-                    if data.users_count <= self.user_lists_max_len:
-                        users = [
-                            stat.source.get_username_by_user_id(uid)
-                            for user_list in data.users.values()
-                            for uid in user_list
-                        ]
-                    else:
-                        users = []
-
-                    if data.public_users_count <= self.user_lists_max_len:
-                        public_users = [
-                            stat.source.get_username_by_user_id(uid)
-                            for user_list in data.public_users.values()
-                            for uid in user_list
-                        ]
-                    else:
-                        public_users = []
-
-                    fp.write(
-                        utils.csvline(
-                            word.decode("utf-8"),
-                            data.first_date,
-                            data.first_public_date or "",
-                            data.last_date,
-                            data.last_public_date or "",
-                            data.count,
-                            data.public_count,
-                            data.nobots_count,
-                            data.public_nobots_count,
-                            data.users_count,
-                            "; ".join(sorted(users)) if users else "",
-                            data.public_users_count,
-                            "; ".join(sorted(public_users)) if public_users else "",
-                        )
-                    )
+                for writer, since_tm in writers:
+                    if since_tm is None or word_stat.first_date >= since_tm:
+                        writer.write(*line)
 
         finally:
-            for fp, _ in fps:
-                fp.close()
-            fps.clear()
+            for writer, _ in writers:
+                writer.close()
+            writers.clear()
+            self._spiller.cleanup()
 
         with (stat.destination / "avgstats.txt").open("w", encoding="utf-8") as fp:
             fp.write(
@@ -0,0 +1,159 @@
+import heapq
+import pickle
+import shutil
+import tempfile
+import weakref
+from itertools import groupby
+from pathlib import Path
+from typing import Any, Callable, Iterable, Iterator, TypeVar
+
+T = TypeVar("T")
+
+# Сколько записей сериализуется в файл за один раз
+BATCH_SIZE = 1000
+
+
+class Spiller:
+    """Временные файлы для внешней агрегации: обработчик, которому
+    не хватает памяти, сбрасывает на диск отсортированные частичные
+    агрегаты (прогоны), а в конце сливает их все вместе k-way слиянием.
+
+    Прогон — это файл с записями, сериализованными через pickle пачками.
+    Записи внутри прогона должны быть отсортированы по тому же ключу, по
+    которому они потом сливаются.
+    """
+
+    def __init__(self, directory: str | Path | None = None, *, prefix: str = "tabun_stat_"):
+        """
+        :param directory: каталог, в котором создаётся временный каталог
+          для прогонов (по умолчанию системный каталог для временных файлов)
+        :param prefix: префикс имени временного каталога
+        """
+        self.directory = directory
+        self.prefix = prefix
+        self.runs: list[Path] = []
+        self._tmp_path: Path | None = None
+        # Удаляет временный каталог, если до cleanup дело не дошло (например,
+        # обработчик в процессе-куске отдал export_state и больше не нужен)
+        self._finalizer: "weakref.finalize[..., Spiller] | None" = None
+
+    def __bool__(self) -> bool:
+        return bool(self.runs)
+
+    def _get_tmp_path(self) -> Path:
+        if self._tmp_path is None:
+            self._tmp_path = Path(tempfile.mkdtemp(prefix=self.prefix, dir=self.directory))
+            self._finalizer = weakref.finalize(self, shutil.rmtree, self._tmp_path, ignore_errors=True)
+        return self._tmp_path
+
+    def write_run(self, records: Iterable[Any]) -> Path:
+        """Записывает новый прогон. Записи должны быть уже отсортированы."""
+        path = self._get_tmp_path() / f"run{len(self.runs):06d}.pickle"
+        with path.open("wb") as fp:
+            batch: list[Any] = []
+            for record in records:
+                batch.append(record)
+                if len(batch) >= BATCH_SIZE:
+                    pickle.dump(batch, fp, protocol=pickle.HIGHEST_PROTOCOL)
+                    batch = []
+            if batch:
+                pickle.dump(batch, fp, protocol=pickle.HIGHEST_PROTOCOL)
+        self.runs.append(path)
+        return path
+
+    def write_run_bytes(self, data: bytes) -> Path:
+        """Записывает прогон, полученный из ``read_runs_bytes`` (например,
+        от другого процесса или из контрольной точки).
+        """
+        path = self._get_tmp_path() / f"run{len(self.runs):06d}.pickle"
+        path.write_bytes(data)
+        self.runs.append(path)
+        return path
+
+    def read_runs_bytes(self) -> list[bytes]:
+        """Возвращает содержимое всех прогонов как есть. Сериализованные
+        записи занимают в разы меньше памяти, чем живые объекты, поэтому
+        так их можно передать в другой процесс или сохранить в контрольную
+        точку, когда временные файлы уже будут удалены.
+        """
+        return [x.read_bytes() for x in self.runs]
+
+    def merge(self, key: Callable[[Any], Any]) -> Iterator[tuple[int, Any]]:
+        """Сливает все прогоны в один отсортированный по key поток. Каждая
+        запись возвращается вместе с номером прогона, из которого она взята:
+        прогоны пишутся в хронологическом порядке, и по номеру можно понять,
+        какая из одинаковых записей более ранняя.
+        """
+        return heapq.merge(
+            *(_iter_numbered_run(run_no, path) for run_no, path in enumerate(self.runs)),
+            key=lambda x: key(x[1]),
+        )
+
+    def cleanup(self) -> None:
+        if self._finalizer is not None:
+            self._finalizer()
+            self._finalizer = None
+        self._tmp_path = None
+        self.runs.clear()
+
+
+def iter_run(path: Path) -> Iterator[Any]:
+    with path.open("rb") as fp:
+        while True:
+            try:
+                batch = pickle.load(fp)
+            except EOFError:
+                break
+            yield from batch
+
+
+def _iter_numbered_run(run_no: int, path: Path) -> Iterator[tuple[int, Any]]:
+    for record in iter_run(path):
+        yield run_no, record
+
+
+def merge_groups(
+    records: Iterator[T],
+    key: Callable[[T], Any],
+    combine: Callable[[list[T]], T],
+) -> Iterator[T]:
+    """Объединяет идущие подряд записи с одинаковым ключом (из разных
+    прогонов) в одну.
+    """
+    for _, group in groupby(records, key=key):
+        items = list(group)
+        yield items[0] if len(items) == 1 else combine(items)
+
+
+def external_sort(
+    records: Iterable[T],
+    key: Callable[[T], Any],
+    *,
+    chunk_size: int,
+    directory: str | Path | None = None,
+) -> Iterator[T]:
+    """Сортирует записи, держа в памяти не больше chunk_size записей
+    за раз (остальные сбрасываются на диск во временные файлы).
+    """
+    spiller = Spiller(directory)
+    try:
+        chunk: list[T] = []
+        for record in records:
+            chunk.append(record)
+            if len(chunk) >= chunk_size:
+                chunk.sort(key=key)
+                spiller.write_run(chunk)
+                chunk = []
+
+        chunk.sort(key=key)
+        if not spiller:
+            yield from chunk
+            return
+
+        spiller.write_run(chunk)
+        del chunk
+        for _, record in spiller.merge(key):
+            yield record
+
+    finally:
+        spiller.cleanup()
@@ -1,16 +1,34 @@
+import cProfile
+import math
+import pickle
 import sys
 import time
-from datetime import datetime, timedelta, timezone, tzinfo
+from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta, timezone, tzinfo
 from itertools import chain
 from pathlib import Path
 from queue import Queue
 from threading import Thread
-from typing import Iterator, Protocol
+from typing import Any, Iterable, Iterator, Protocol, TypeVar
 from zoneinfo import ZoneInfo
 
 from tabun_stat import types, utils
+from tabun_stat.checkpoint import Checkpoint, get_processor_name, load_checkpoint, save_checkpoint
 from tabun_stat.datasource.base import BaseDataSource
-from tabun_stat.processors.base import BaseProcessor
+from tabun_stat.output import COMPRESSION_SUFFIXES, RowWriter, open_writer
+from tabun_stat.perf import PHASES, ProcessorPerf, dump_profile_stats, get_profile_stats, write_perf_json
+from tabun_stat.pool import ProcessorsPool, ShardInfo, ShardsRunner
+from tabun_stat.processors.base import (
+    BaseProcessor,
+    MergeableProcessor,
+    can_resume,
+    uses_messages,
+    uses_messages_batch,
+)
+from tabun_stat.text import MessageText
+
+T = TypeVar("T")
 
 
 class LogCallable(Protocol):
@@ -34,6 +52,17 @@ class TabunStat:
         min_date: datetime | None = None,
         max_date: datetime | None = None,
         tz: str | tzinfo | None = None,
+        workers: int = 0,
+        shards: int = 0,
+        checkpoint: str | Path | None = None,
+        resume: bool = False,
+        prefetch_threads: int = 1,
+        prefetch_queue_size: int = 4,
+        prefetch_rows: int = 10000,
+        profile: bool = False,
+        perf_json: bool = False,
+        output_compression: str = "",
+        parquet_tables: bool = False,
     ):
         """
         :param source: источник данных для обработки
@@ -47,6 +76,34 @@ class TabunStat:
           go)
         :param tz: часовой пояс для обработки дат, используется
           некоторыми обработчиками (ZoneInfo или строка, по умолчанию UTC)
+        :param workers: число процессов, между которыми распределяются
+          обработчики (0 или 1 — все обработчики работают в текущем процессе)
+        :param shards: на сколько кусков делить данные для обработчиков,
+          поддерживающих слияние статистики (MergeableProcessor); каждый кусок
+          обрабатывается в отдельном процессе (0 или 1 — не делить)
+        :param checkpoint: путь к файлу контрольной точки, в который
+          по окончании работы сохраняется состояние обработчиков,
+          поддерживающих слияние статистики
+        :param resume: загрузить контрольную точку и обработать этими
+          обработчиками только данные после неё (если файла ещё нет,
+          то обрабатываются все данные)
+        :param prefetch_threads: сколько потоков параллельно загружают посты
+          и комменты по интервалам времени (используется, если источник
+          данных не умеет отдавать их одним потоком через iter_messages)
+        :param prefetch_queue_size: сколько пачек постов и комментов может
+          быть загружено заранее (в каждом потоке)
+        :param prefetch_rows: примерное число постов и комментов в одной
+          пачке; интервалы времени для загрузки подбираются под него
+        :param profile: профилировать каждый обработчик через cProfile
+          и сохранить результаты в подкаталог profile каталога destination
+          (файлы .prof, по одному на обработчик); включает и perf_json
+        :param perf_json: сохранить подробные замеры производительности
+          в файл perf.json в каталоге destination (для сравнения разных
+          запусков между собой)
+        :param output_compression: сжимать csv-файлы статистики ("gzip"
+          или "zstd"; по умолчанию без сжатия)
+        :param parquet_tables: писать самые большие таблицы (например,
+          статистику слов) в формате Parquet вместо csv (нужен pyarrow)
         """
 
         self.source = source
@@ -54,6 +111,23 @@ class TabunStat:
         self.min_date = utils.force_utc(min_date) if min_date is not None else None
         self.max_date = utils.force_utc(max_date) if max_date is not None else None
         self.verbosity = verbosity
+        self.workers = max(0, workers)
+        self.shards = max(0, shards)
+        self.checkpoint_path = Path(checkpoint) if checkpoint is not None else None
+        self.resume = resume
+        self.prefetch_threads = max(1, prefetch_threads)
+        self.prefetch_queue_size = max(1, prefetch_queue_size)
+        self.prefetch_rows = max(1, prefetch_rows)
+        self.profile = profile
+        self.perf_json = perf_json or profile
+        self.output_compression = output_compression
+        self.parquet_tables = parquet_tables
+
+        if self.output_compression not in COMPRESSION_SUFFIXES:
+            raise ValueError(f"Unknown output compression: {output_compression!r}")
+
+        if self.resume and self.checkpoint_path is None:
+            raise ValueError("resume requires checkpoint path")
 
         # Парсим часовой пояс
         if tz is None:
@@ -69,10 +143,39 @@ class TabunStat:
         self.log: LogCallable = self._default_log
         self._isatty: bool | None = None
 
+        # Все пользователи, общие для обработчиков этого процесса (при
+        # распределении обработчиков по процессам заполняется в каждом из них,
+        # а при обработке по кусочкам содержит только пользователей куска)
+        self.users = types.UsersIndex()
+
         self._processors: list[BaseProcessor] = []
+        # Явно указанные номера процессов для обработчиков
+        self._processor_workers: dict[BaseProcessor, int] = {}
+        self._processor_params: dict[BaseProcessor, dict[str, Any]] = {}
+        self._pool: ProcessorsPool | None = None
+
+        # Индексы обработчиков, которые работают по кусочкам в других процессах
+        self._sharded: set[int] = set()
+        self._shards_runner: ShardsRunner | None = None
+        # Сколько времени основной процесс ждал завершения кусков
+        self._shards_wait_perf = 0.0
+        # Сколько времени основной процесс сливал состояния кусков
+        self._shards_merge_perf = 0.0
+        # Загруженная контрольная точка (если продолжаем с неё)
+        self._checkpoint: Checkpoint | None = None
+
         self._perf: list[float] = []
+        # Подробные замеры по этапам и профилировщики (если включены)
+        # для каждого обработчика
+        self._perf_details: list[ProcessorPerf] = []
+        self._profilers: list[cProfile.Profile | None] = []
+        # Статистика профилировщиков, полученная из других процессов
+        self._profile_stats: list[list[dict[Any, Any]]] = []
+        # Сколько времени основной процесс провёл в каждом этапе
+        self._phases_perf: dict[str, float] = {}
         self._source_perf = 0.0
         self._source_perf_threaded = 0.0
+        self._prefetch_stats = PrefetchStats()
 
     def _default_log(self, verbosity: int, *args: object, end: str = "\n", for_tty: bool = False) -> None:
         if verbosity > self.verbosity:
@@ -98,10 +201,30 @@ class TabunStat:
             func = self._empty_log
         self.log = func
 
-    def add_processor(self, processor: BaseProcessor) -> bool:
-        """Добавляет обработчик данных."""
+    def add_processor(
+        self,
+        processor: BaseProcessor,
+        *,
+        worker: int | None = None,
+        params: dict[str, Any] | None = None,
+    ) -> bool:
+        """Добавляет обработчик данных.
+
+        :param worker: номер процесса (начиная с нуля), в котором должен
+          работать обработчик, если включено распределение обработчиков
+          по процессам; если не указан, то процесс выбирается автоматически
+        :param params: параметры, с которыми создан обработчик; сохраняются
+          в контрольную точку, и продолжить с неё можно только с теми же
+          параметрами
+        """
+        if worker is not None and self.workers > 1 and not 0 <= worker < self.workers:
+            raise ValueError(f"Invalid worker number {worker} (expected 0..{self.workers - 1})")
+
         if processor not in self._processors:
             self._processors.append(processor)
+            if worker is not None:
+                self._processor_workers[processor] = worker
+            self._processor_params[processor] = dict(params or {})
             return True
         return False
 
@@ -109,6 +232,8 @@ class TabunStat:
         """Удаляет обработчик данных."""
         if processor in self._processors:
             self._processors.remove(processor)
+            self._processor_workers.pop(processor, None)
+            self._processor_params.pop(processor, None)
             return True
         return False
 
@@ -116,31 +241,497 @@ class TabunStat:
         if not self._processors:
             return False
         self._processors.clear()
+        self._processor_workers.clear()
+        self._processor_params.clear()
         return True
 
     def destroy(self) -> None:
         """Прибирает оперативку."""
+        self.users = types.UsersIndex()
         self._processors.clear()
+        self._processor_workers.clear()
+        self._processor_params.clear()
+        self._pool = None
+        self._sharded.clear()
+        self._shards_runner = None
+        self._checkpoint = None
+
+    def get_message_text(self, message: types.Post | types.Comment) -> MessageText:
+        """Возвращает разобранный текст поста или коммента (см. MessageText).
+        Разбор запоминается в самом сообщении, поэтому обработчики, которым
+        нужно одно и то же (например, ссылки на картинки), не разбирают
+        текст каждый по-своему.
+        """
+        text = message.text
+        if text is None:
+            text = message.text = MessageText(message.body)
+        return text
+
+    def get_usernames_by_ids(self, user_ids: Iterable[int]) -> dict[int, str]:
+        """Возвращает имена пользователей по их id. Имена берутся из уже
+        обработанных пользователей (``self.users``), а в источник данных
+        одним запросом уходят только оставшиеся (например, при продолжении
+        с контрольной точки, когда старые пользователи не обрабатываются).
+        Если пользователь не существует, то в итоговом словаре его не будет.
+        """
+        result: dict[int, str] = {}
+        missing: list[int] = []
+        for user_id in user_ids:
+            username = self.users.get_username(user_id)
+            if username is not None:
+                result[user_id] = username
+            else:
+                missing.append(user_id)
+
+        if missing:
+            result.update(self.source.get_usernames_by_ids(missing))
+        return result
+
+    def open_csv(self, filename: str, *, large: bool = False) -> RowWriter:
+        """Открывает csv-файл в каталоге destination для записи построчно
+        (первая строка — заголовок). С учётом настроек файл может быть сжат
+        или записан в формате Parquet, поэтому итоговое имя может отличаться.
+
+        :param filename: имя файла с расширением .csv
+        :param large: таблица может быть очень большой (в формате Parquet
+          пишутся только такие таблицы)
+        """
+        return open_writer(
+            self.destination,
+            filename,
+            compression=self.output_compression,
+            parquet=large and self.parquet_tables,
+        )
+
+    # Распределение обработчиков по процессам
+
+    def _make_assignment(self) -> list[list[int]]:
+        """Распределяет обработчики по процессам. Обработчики с явно
+        указанным номером процесса попадают в него, остальные по очереди
+        добавляются в процессы с наименьшим числом обработчиков.
+        """
+        assignment: list[list[int]] = [[] for _ in range(self.workers)]
+
+        auto_idx: list[int] = []
+        for idx, p in self._local_processors():
+            worker = self._processor_workers.get(p)
+            if worker is None:
+                auto_idx.append(idx)
+            else:
+                assignment[worker].append(idx)
+
+        for idx in auto_idx:
+            min(assignment, key=len).append(idx)
+
+        for worker_processors in assignment:
+            worker_processors.sort()
+        return assignment
+
+    def _get_worker_kwargs(self) -> dict[str, Any]:
+        # Прогресс-бары из нескольких процессов одновременно только мешают
+        return {
+            "source": self.source,
+            "destination": self.destination,
+            "verbosity": min(self.verbosity, 1),
+            "min_date": self.min_date,
+            "max_date": self.max_date,
+            "tz": self.tz,
+            "prefetch_threads": self.prefetch_threads,
+            "prefetch_queue_size": self.prefetch_queue_size,
+            "prefetch_rows": self.prefetch_rows,
+            "profile": self.profile,
+            "output_compression": self.output_compression,
+            "parquet_tables": self.parquet_tables,
+        }
+
+    def _local_processors(self) -> Iterator[tuple[int, BaseProcessor]]:
+        """Обработчики (с их индексами), которые получают данные
+        от основного цикла, то есть все, кроме обрабатываемых по кусочкам.
+        """
+        for idx, p in enumerate(self._processors):
+            if idx not in self._sharded:
+                yield idx, p
+
+    # Обработка по кусочкам
+
+    def _get_mergeable_processors(self) -> list[int]:
+        return [idx for idx, p in enumerate(self._processors) if isinstance(p, MergeableProcessor)]
+
+    def _get_resumable_processors(self) -> list[int]:
+        return [idx for idx, p in enumerate(self._processors) if can_resume(p)]
+
+    def _load_checkpoint(self) -> None:
+        """Загружает контрольную точку и проверяет, что она подходит
+        к текущим настройкам и обработчикам.
+        """
+        assert self.checkpoint_path is not None
+        if not self.checkpoint_path.exists():
+            self.log(0, f"WARNING: checkpoint {str(self.checkpoint_path)!r} not found, processing all data")
+            return
+
+        tm = time.monotonic()
+        checkpoint = load_checkpoint(self.checkpoint_path)
+        resumable = self._get_resumable_processors()
+        checkpoint.check_compatible(
+            self.min_date,
+            str(self.tz),
+            [get_processor_name(self._processors[idx]) for idx in resumable],
+            [self._processor_params[self._processors[idx]] for idx in resumable],
+        )
+        if self.max_date is not None and checkpoint.max_date > self.max_date:
+            raise ValueError(
+                f"Checkpoint max_date {checkpoint.max_date} is later than max_date {self.max_date}"
+            )
+        self._checkpoint = checkpoint
+        self._shards_merge_perf += time.monotonic() - tm
+
+        self.log(
+            1,
+            "Resuming from checkpoint: data before {} UTC is already processed".format(
+                checkpoint.max_date.strftime("%Y-%m-%d %H:%M:%S")
+            ),
+        )
+
+        # Остальные обработчики продолжать не умеют; пользователей
+        # перечитать недолго, а вот из-за обработчиков постов и комментов
+        # придётся заново читать всю историю
+        names = [type(p).__name__ for p in self._processors if not can_resume(p) and uses_messages(p)]
+        if names:
+            self.log(
+                0,
+                "WARNING: these processors can't be resumed, so all posts and comments will be read again: "
+                + ", ".join(names),
+            )
+
+    def _start_shards(self) -> None:
+        """Делит диапазон дат постов и комментов на куски и запускает
+        обработку каждого куска в отдельном процессе для обработчиков, поддерживающих слияние статистики.
+        """
+        # При продолжении с контрольной точки обработчики, которые продолжать
+        # не умеют, обрабатывают все данные в основном процессе
+        if self._checkpoint is not None:
+            sharded = self._get_resumable_processors()
+        else:
+            sharded = self._get_mergeable_processors()
+        if not sharded:
+            return
+        # Контрольная точка сохраняется при слиянии кусков, поэтому ради неё
+        # обрабатываем данные как минимум одним куском
+        shards_count = max(self.shards, 1)
+
+        self.log(1, "Splitting data into shards:", end=" ")
+        tm = time.monotonic()
+
+        # При продолжении с контрольной точки обрабатываем только
+        # написанное после неё
+        min_date = self.min_date
+        if self._checkpoint is not None:
+            min_date = self._checkpoint.max_date
+
+        # Пользователи нужны каждому куску целиком (обработчики смотрят
+        # рейтинг и дату регистрации авторов), но обработчикам передаются
+        # только в первом куске. У кусков свой max_date, поэтому границу
+        # регистрации пользователей передаём явно
+        users_filters: dict[str, Any] = {}
+        if self.max_date is not None:
+            users_filters["registered_at__lt"] = self.max_date
+
+        messages_filters: dict[str, Any] = {}
+        if min_date is not None:
+            messages_filters["created_at__gte"] = min_date
+        if self.max_date is not None:
+            messages_filters["created_at__lt"] = self.max_date
+        posts_limits = self.source.get_posts_limits(messages_filters)
+        comments_limits = self.source.get_comments_limits(messages_filters)
+
+        first_dates = [x for x in (posts_limits.first_created_at, comments_limits.first_created_at) if x]
+        last_dates = [x for x in (posts_limits.last_created_at, comments_limits.last_created_at) if x]
+
+        # Границы кусков по датам. Крайние границы берём из настроек, чтобы
+        # куски в сумме покрывали ровно тот же диапазон, что и без деления
+        date_bounds: list[datetime | None] = [min_date]
+        if first_dates and last_dates:
+            date_bounds.extend(
+                split_date_range(
+                    self.source,
+                    min(first_dates),
+                    max(last_dates) + timedelta(seconds=1),
+                    shards_count,
+                    total=posts_limits.count + comments_limits.count,
+                )
+            )
+        while len(date_bounds) < shards_count:
+            date_bounds.append(date_bounds[-1])
+        date_bounds.append(self.max_date)
+
+        shards: list[ShardInfo] = []
+        for i in range(shards_count):
+            stat_kwargs = self._get_worker_kwargs()
+            stat_kwargs["verbosity"] = 0
+            stat_kwargs["min_date"] = date_bounds[i]
+            stat_kwargs["max_date"] = date_bounds[i + 1]
+            shards.append(ShardInfo(stat_kwargs=stat_kwargs, users_filters=users_filters, feed_users=i == 0))
+
+        self._source_perf += time.monotonic() - tm
+
+        self._sharded = set(sharded)
+        self._shards_runner = ShardsRunner([self._processors[idx] for idx in sharded], shards)
+        self._shards_runner.start()
+
+        self.log(1, f"{shards_count} shards for {len(sharded)} processors.")
+
+    def _finish_shards(self, *, interrupted: bool) -> None:
+        """Дожидается обработки всех кусков и сливает их статистику
+        в обработчики основного процесса.
+        """
+        runner = self._shards_runner
+        if runner is None:
+            return
+
+        if interrupted:
+            runner.terminate()
+            self.log(1, "Shards are interrupted, their statistics will not be saved")
+            return
+
+        self.log(1, "Waiting for shards:", end="  ")
+        tm = time.monotonic()
+        try:
+            runner.finish()
+        finally:
+            self._shards_wait_perf += time.monotonic() - tm
+
+        sharded = sorted(self._sharded)
+        for shard in runner.shards:
+            for local_idx, duration in enumerate(shard.perf):
+                self._perf[sharded[local_idx]] += duration
+            for local_idx, details in enumerate(shard.perf_details):
+                self._perf_details[sharded[local_idx]].merge(details)
+            for local_idx, profile_stats in enumerate(shard.profile_stats):
+                self._profile_stats[sharded[local_idx]].append(profile_stats)
+
+        checkpoint_states: list[bytes] = []
+
+        for local_idx, idx in enumerate(sharded):
+            p = self._processors[idx]
+            assert isinstance(p, MergeableProcessor)
+
+            tm = time.monotonic()
+            with self._perfmon(idx, "merge"):
+                p.start(self)
+                # Состояние из контрольной точки самое старое, поэтому идёт первым
+                if self._checkpoint is not None:
+                    p.merge_state(pickle.loads(self._checkpoint.states[local_idx]))
+                for shard in runner.shards:
+                    assert shard.states is not None
+                    p.merge_state(shard.states[local_idx])
+                # stop может менять состояние обработчика, поэтому сериализуем
+                # его для контрольной точки заранее
+                if self.checkpoint_path is not None and can_resume(p):
+                    checkpoint_states.append(pickle.dumps(p.export_state(), protocol=pickle.HIGHEST_PROTOCOL))
+                p.stop(self)
+            self._shards_merge_perf += time.monotonic() - tm
+
+        self.log(1, "| Done.")
+
+        if self.checkpoint_path is not None:
+            if self.max_date is None:
+                # Бывает только при min_date из будущего, сохранять нечего
+                self.log(0, "WARNING: max_date is not set, checkpoint is not saved")
+                return
+
+            tm = time.monotonic()
+            resumable = [idx for idx in sharded if can_resume(self._processors[idx])]
+            save_checkpoint(
+                self.checkpoint_path,
+                Checkpoint(
+                    min_date=self.min_date,
+                    max_date=self.max_date,
+                    tz=str(self.tz),
+                    processors=[get_processor_name(self._processors[idx]) for idx in resumable],
+                    params=[self._processor_params[self._processors[idx]] for idx in resumable],
+                    states=checkpoint_states,
+                ),
+            )
+            self._shards_merge_perf += time.monotonic() - tm
+            self.log(1, f"Checkpoint saved to {str(self.checkpoint_path)!r}")
+
+    # Вызов обработчиков (в текущем процессе или в процессах пула)
+
+    def _call_processors(self, name: str, *args: object) -> None:
+        """Вызывает метод с указанным именем у всех обработчиков, передавая
+        ему stat и указанные аргументы.
+        """
+        if self._pool is not None:
+            self._pool.send("_call_processors", name, *args)
+            return
+
+        phase = PHASES.get(name, name)
+        for idx, p in self._local_processors():
+            with self._perfmon(idx, phase):
+                getattr(p, name)(self, *args)
+
+    def _feed_users(self, users: list[types.User]) -> None:
+        # Пользователи нужны и основному процессу: обработчики, работающие
+        # по кусочкам, пользуются ими в stop
+        self.users.add(users)
+
+        if self._pool is not None:
+            self._pool.send("_feed_users", users)
+            return
+
+        for idx, p in self._local_processors():
+            with self._perfmon(idx, "users"):
+                for user in users:
+                    p.process_user(self, user)
+
+    def _feed_blogs(self, blogs: list[types.Blog]) -> None:
+        if self._pool is not None:
+            self._pool.send("_feed_blogs", blogs)
+            return
+
+        for idx, p in self._local_processors():
+            with self._perfmon(idx, "blogs"):
+                for blog in blogs:
+                    p.process_blog(self, blog)
+
+    def _feed_messages(self, messages: list[types.Post | types.Comment]) -> None:
+        if self._pool is not None:
+            self._pool.send("_feed_messages", messages)
+            return
+
+        # Сообщения отсортированы по времени, поэтому сутки идут подряд;
+        # обработчики получают сообщения по суткам, чтобы время их работы
+        # можно было честно разложить по дням
+        days: list[tuple[date | None, int, int]] = []
+        for i, message in enumerate(messages):
+            day = message.created_at_local.date() if message.created_at_local else None
+            if days and days[-1][0] == day:
+                days[-1] = (day, days[-1][1], i + 1)
+            else:
+                days.append((day, i, i + 1))
+
+        # Пачки с колонками собираются один раз для всех обработчиков,
+        # которые их поддерживают
+        batches: list[types.MessagesBatch] | None = None
+
+        for idx, p in self._local_processors():
+            if uses_messages_batch(p):
+                if batches is None:
+                    batch = types.MessagesBatch.from_messages(messages)
+                    batches = [batch if len(days) == 1 else batch.slice(lo, hi) for _, lo, hi in days]
+                for (day, _, _), day_batch in zip(days, batches):
+                    with self._perfmon(idx, "messages", day):
+                        p.process_messages_batch(self, day_batch)
+                continue
+
+            for day, lo, hi in days:
+                with self._perfmon(idx, "messages", day):
+                    for message in messages[lo:hi]:
+                        if isinstance(message, types.Comment):
+                            p.process_comment(self, message)
+                        else:
+                            p.process_post(self, message)
+
+    def _stop_processors(self) -> None:
+        if self._pool is not None:
+            try:
+                self._pool.send("_stop_processors")
+            finally:
+                self._pool.finish()
+                for idx, duration in self._pool.perf.items():
+                    self._perf[idx] = duration
+                for idx, details in self._pool.perf_details.items():
+                    self._perf_details[idx] = details
+                for idx, profile_stats in self._pool.profile_stats.items():
+                    self._profile_stats[idx].append(profile_stats)
+            return
+
+        local_processors = list(self._local_processors())
+        drawer = utils.ProgressDrawer(len(local_processors)) if self.verbosity >= 2 else None
+        if drawer is not None:
+            drawer.update(0)
+
+        for idx, p in local_processors:
+            if drawer is not None:
+                drawer.add_progress(1)
+            with self._perfmon(idx, "stop"):
+                p.stop(self)
+
+        if drawer is not None:
+            drawer.add_progress(0, force=True)
 
     # Замерялка производительности
 
     def _perfmon_reset(self) -> None:
         self._perf = [0.0] * len(self._processors)
+        self._perf_details = [ProcessorPerf() for _ in self._processors]
+        self._profilers = [cProfile.Profile() if self.profile else None for _ in self._processors]
+        self._profile_stats = [[] for _ in self._processors]
+        self._phases_perf = {}
         self._source_perf = 0.0
         self._source_perf_threaded = 0.0
+        self._prefetch_stats = PrefetchStats()
+
+    @contextmanager
+    def _perfmon(self, idx: int, phase: str, day: date | None = None) -> Iterator[None]:
+        """Замеряет время работы обработчика с указанным индексом
+        (и профилирует его, если включено профилирование).
+        """
+        profiler = self._profilers[idx]
+        if profiler is not None:
+            profiler.enable()
+        tm = time.monotonic()
+        try:
+            yield
+        finally:
+            duration = time.monotonic() - tm
+            if profiler is not None:
+                profiler.disable()
+            self._perf[idx] += duration
+            self._perf_details[idx].put(phase, duration, day)
+
+    def _export_profile_stats(self) -> list[dict[Any, Any]]:
+        """Статистика профилировщиков этого процесса для передачи
+        в основной процесс (пустой словарь, если профилирование выключено).
+        """
+        return [get_profile_stats(x) if x is not None else {} for x in self._profilers]
+
+    def _phase_perfmon_put(self, phase: str, duration: float) -> None:
+        self._phases_perf[phase] = self._phases_perf.get(phase, 0.0) + duration
 
-    def _perfmon_put(self, idx: int, duration: float) -> None:
-        self._perf[idx] += duration
+    def _get_other_duration(self, full_duration: float) -> float:
+        """Сколько времени основной процесс потратил не на обработчики,
+        источник данных и ожидание других процессов.
+        """
+        if self._pool is not None:
+            etc_duration = full_duration - self._pool.send_time
+        else:
+            local_perf = sum(d for i, d in enumerate(self._perf) if i not in self._sharded)
+            etc_duration = full_duration - local_perf
+        etc_duration -= self._source_perf + self._shards_wait_perf + self._shards_merge_perf
+        return etc_duration
 
     def _generate_perf_info(self, full_duration: float | None = None) -> Iterator[str]:
         source_dur_str = f"{self._source_perf:.2f}"
         source_dur_thr_str = f"{self._source_perf_threaded:.2f}"
         rjust = max(len(source_dur_str), len(source_dur_thr_str))
 
+        # Если обработчики работают в других процессах, то их время
+        # не входит в общее время работы основного процесса, зато входит
+        # ожидание, пока процессы разгребут свои очереди
+        wait_dur_str: str | None = None
+        if self._pool is not None:
+            wait_dur_str = f"{self._pool.send_time:.2f}"
+            rjust = max(rjust, len(wait_dur_str))
+
+        shards_wait_dur_str: str | None = None
+        if self._shards_runner is not None:
+            shards_wait_dur_str = f"{self._shards_wait_perf:.2f}"
+            rjust = max(rjust, len(shards_wait_dur_str))
+
         etc_dur_str: str | None = None
         if full_duration is not None:
-            etc_duration = full_duration - sum(self._perf) - self._source_perf
-            etc_dur_str = f"{etc_duration:.2f}"
+            etc_dur_str = f"{self._get_other_duration(full_duration):.2f}"
 
         if etc_dur_str and len(etc_dur_str) > rjust:
             rjust = len(etc_dur_str)
@@ -154,15 +745,162 @@ class TabunStat:
             pname = type(p).__name__
             yield f"{dur_str}s {pname}"
 
+        if self._pool is not None:
+            for worker_idx, worker in enumerate(self._pool.workers):
+                dur_str = f"{worker.wall_time:.2f}".rjust(rjust)
+                yield (
+                    f"{dur_str}s worker #{worker_idx} (busy {worker.busy_time:.2f}s, "
+                    f"idle {worker.idle_time:.2f}s): {', '.join(worker.names)}"
+                )
+
+        if self._shards_runner is not None:
+            for shard_idx, shard in enumerate(self._shards_runner.shards):
+                dur_str = f"{shard.wall_time:.2f}".rjust(rjust)
+                shard_min_date = shard.stat_kwargs["min_date"]
+                shard_max_date = shard.stat_kwargs["max_date"]
+                yield "{}s shard #{} [{} .. {})".format(
+                    dur_str,
+                    shard_idx,
+                    shard_min_date.strftime("%Y-%m-%d %H:%M:%S") if shard_min_date is not None else "-inf",
+                    shard_max_date.strftime("%Y-%m-%d %H:%M:%S") if shard_max_date is not None else "+inf",
+                )
+
         source_dur_str = source_dur_str.rjust(rjust)
         source_dur_thr_str = source_dur_thr_str.rjust(rjust)
         yield f"{source_dur_str}s source queries"
         yield f"{source_dur_thr_str}s source queries (in a separate thread)"
 
+        # Если очередь часто пустая, то обработчики ждут источник данных
+        # (можно добавить потоков или увеличить пачки); если часто полная,
+        # то узкое место — обработчики
+        prefetch = self._prefetch_stats
+        if prefetch.items:
+            yield (
+                f"{'':>{rjust}}  prefetch: {prefetch.items} chunks, "
+                f"queue empty {prefetch.starved} times ({prefetch.starved * 100 / prefetch.items:.1f}%), "
+                f"full {prefetch.full} times ({prefetch.full * 100 / prefetch.items:.1f}%)"
+            )
+
+        # Много промахов означает много лишних запросов к источнику
+        for name, cache in self.source.get_cache_stats().items():
+            size_str = f"{cache.size}/{cache.capacity}" if cache.capacity is not None else str(cache.size)
+            hit_rate = cache.hit_rate
+            yield (
+                f"{'':>{rjust}}  source cache {name}: {cache.hits} hits, {cache.misses} misses"
+                + (f" ({hit_rate * 100:.1f}% hits)" if hit_rate is not None else "")
+                + f", {size_str} items"
+            )
+
+        if wait_dur_str is not None:
+            wait_dur_str = wait_dur_str.rjust(rjust)
+            yield f"{wait_dur_str}s waiting for workers"
+
+        if shards_wait_dur_str is not None:
+            shards_wait_dur_str = shards_wait_dur_str.rjust(rjust)
+            yield f"{shards_wait_dur_str}s waiting for shards"
+
         if etc_dur_str is not None:
             etc_dur_str = etc_dur_str.rjust(rjust)
             yield f"{etc_dur_str}s other"
 
+    def _generate_perf_json(
+        self, started_at: datetime, finished_at: datetime, full_duration: float
+    ) -> dict[str, Any]:
+        """Те же замеры, что и в _generate_perf_info, но подробнее
+        и в машиночитаемом виде (для perf.json).
+        """
+        processors: list[dict[str, Any]] = []
+        for idx, p in enumerate(self._processors):
+            if idx in self._sharded:
+                location = "shards"
+            elif self._pool is not None:
+                location = next(
+                    f"worker #{i}" for i, w in enumerate(self._pool.workers) if idx in w.processors
+                )
+            else:
+                location = "main"
+            processors.append(
+                {
+                    "index": idx,
+                    "name": type(p).__name__,
+                    "location": location,
+                    "total": self._perf[idx],
+                    **self._perf_details[idx].to_json(),
+                }
+            )
+
+        prefetch = self._prefetch_stats
+        result: dict[str, Any] = {
+            "started_at": started_at.isoformat(),
+            "finished_at": finished_at.isoformat(),
+            "min_date": self.min_date.isoformat() if self.min_date is not None else None,
+            "max_date": self.max_date.isoformat() if self.max_date is not None else None,
+            "duration": full_duration,
+            "phases": self._phases_perf,
+            "processors": processors,
+            "source": {
+                "queries": self._source_perf,
+                "queries_threaded": self._source_perf_threaded,
+                "caches": {
+                    name: {
+                        "hits": cache.hits,
+                        "misses": cache.misses,
+                        "size": cache.size,
+                        "capacity": cache.capacity,
+                    }
+                    for name, cache in self.source.get_cache_stats().items()
+                },
+            },
+            "prefetch": {
+                "chunks": prefetch.items,
+                "queue_empty": prefetch.starved,
+                "queue_full": prefetch.full,
+                "queue_wait": prefetch.wait,
+            },
+            "other": self._get_other_duration(full_duration),
+        }
+
+        if self._pool is not None:
+            result["waiting_for_workers"] = self._pool.send_time
+            result["workers"] = [
+                {
+                    "wall_time": w.wall_time,
+                    "busy_time": w.busy_time,
+                    "idle_time": w.idle_time,
+                    "processors": w.names,
+                }
+                for w in self._pool.workers
+            ]
+
+        if self._shards_runner is not None:
+            result["waiting_for_shards"] = self._shards_wait_perf
+            result["merging_shards"] = self._shards_merge_perf
+            result["shards"] = []
+            for shard in self._shards_runner.shards:
+                shard_min_date = shard.stat_kwargs["min_date"]
+                shard_max_date = shard.stat_kwargs["max_date"]
+                result["shards"].append(
+                    {
+                        "wall_time": shard.wall_time,
+                        "min_date": shard_min_date.isoformat() if shard_min_date is not None else None,
+                        "max_date": shard_max_date.isoformat() if shard_max_date is not None else None,
+                    }
+                )
+
+        return result
+
+    def _save_profiles(self) -> None:
+        """Сохраняет результаты профилирования обработчиков (из всех
+        процессов) в подкаталог profile.
+        """
+        path = self.destination / "profile"
+        path.mkdir(exist_ok=True)
+        local_stats = self._export_profile_stats()
+        for idx, p in enumerate(self._processors):
+            stats_list = [x for x in [local_stats[idx], *self._profile_stats[idx]] if x]
+            if stats_list:
+                dump_profile_stats(path / f"{idx:02d}_{type(p).__name__}.prof", stats_list)
+
     # Но сверху это всё вспомогательная вода, самая мякотка тут ↓
 
     def go(self) -> None:
@@ -211,18 +949,45 @@ class TabunStat:
         self.source.start(self)
         self._source_perf += time.monotonic() - tm
 
+        if self.resume:
+            self._load_checkpoint()
+
+        # Обработчики, которые умеют считать статистику по кусочкам,
+        # отправляем в отдельные процессы
+        if self.shards > 1 or self.checkpoint_path is not None:
+            self._start_shards()
+
+        # Если обработчики нужно распределить по процессам, то запускаем их
+        if self.workers > 1 and any(True for _ in self._local_processors()):
+            self._pool = ProcessorsPool(
+                self._processors,
+                self._make_assignment(),
+                self._get_worker_kwargs(),
+            )
+            self._pool.start()
+
         # И дальше просто обрабатываем по очереди
         finished_at: datetime | None = None
 
-        for idx, p in enumerate(self._processors):
-            tm = time.monotonic()
-            p.start(self)
-            self._perfmon_put(idx, time.monotonic() - tm)
+        self._call_processors("start")
 
         try:
+            # Пользователей немного, и они нужны всем обработчикам в stop,
+            # поэтому их основной процесс читает всегда
+            tm = time.monotonic()
             self._process_users()
-            self._process_blogs()
-            self._process_posts_and_comments()
+            self._phase_perfmon_put("users", time.monotonic() - tm)
+
+            # А если все обработчики постов и комментов работают
+            # по кусочкам, то читать их основному процессу незачем
+            if any(uses_messages(p) for _, p in self._local_processors()):
+                tm = time.monotonic()
+                self._process_blogs()
+                self._phase_perfmon_put("blogs", time.monotonic() - tm)
+
+                tm = time.monotonic()
+                self._process_posts_and_comments()
+                self._phase_perfmon_put("messages", time.monotonic() - tm)
 
             finished_at = datetime.now(timezone.utc)
 
@@ -231,20 +996,18 @@ class TabunStat:
 
         finally:
             self.log(1, "Finishing:", end="           ")
-            drawer = utils.ProgressDrawer(len(self._processors)) if self.verbosity >= 2 else None
-            if drawer is not None:
-                drawer.update(0)
+            tm = time.monotonic()
+            self._stop_processors()
+            self._phase_perfmon_put("stop", time.monotonic() - tm)
+            self.log(1, "| Done.")
 
-            for idx, p in enumerate(self._processors):
-                if drawer is not None:
-                    drawer.add_progress(1)
-                tm = time.monotonic()
-                p.stop(self)
-                self._perfmon_put(idx, time.monotonic() - tm)
+            tm = time.monotonic()
+            self._finish_shards(interrupted=finished_at is None)
+            if self._shards_runner is not None:
+                self._phase_perfmon_put("shards", time.monotonic() - tm)
 
-            if drawer is not None:
-                drawer.add_progress(0, force=True)
-            self.log(1, "| Done.")
+        if finished_at is not None and self._shards_runner is not None:
+            finished_at = datetime.now(timezone.utc)
 
         if finished_at is not None:
             finished_at_mono = time.monotonic()
@@ -257,18 +1020,37 @@ class TabunStat:
                 ),
             )
 
+            if self.profile:
+                self._save_profiles()
+
+            if self.perf_json:
+                write_perf_json(
+                    self.destination / "perf.json",
+                    self._generate_perf_json(started_at, finished_at, duration),
+                )
+
             if self.verbosity >= 1:
                 self.log(1, "\nPerformance info:")
                 for x in self._generate_perf_info(duration):
                     self.log(1, x)
 
-    def _process_users(self) -> None:
+    def _process_users(self, filters: dict[str, Any] | None = None, *, feed_processors: bool = True) -> None:
+        """Обрабатывает пользователей.
+
+        :param filters: дополнительные фильтры для источника данных
+          (используются при обработке по кусочкам)
+        :param feed_processors: если False, то пользователи только
+          загружаются в ``self.users``, а обработчикам не передаются
+          (используется при обработке по кусочкам)
+        """
         self.log(1, "Processing users:", end="    ")
 
         datefilters = {}
         # min_date не учитываем специально
         if self.max_date is not None:
             datefilters["registered_at__lt"] = self.max_date
+        if filters:
+            datefilters.update(filters)
 
         all_tm = time.monotonic()
         tm = all_tm
@@ -283,10 +1065,8 @@ class TabunStat:
         if drawer is not None:
             drawer.update(0)
 
-        for idx, p in enumerate(self._processors):
-            tm = time.monotonic()
-            p.begin_users(self, limits)
-            self._perfmon_put(idx, time.monotonic() - tm)
+        if feed_processors:
+            self._call_processors("begin_users", limits)
 
         tm = time.monotonic()
         for users in self.source.iter_users(datefilters):  # никакая сортировка не гарантируется
@@ -299,18 +1079,15 @@ class TabunStat:
             if drawer is not None:
                 drawer.add_progress(len(users))
 
-            for idx, p in enumerate(self._processors):
-                tm = time.monotonic()
-                for user in users:
-                    p.process_user(self, user)
-                self._perfmon_put(idx, time.monotonic() - tm)
+            if feed_processors:
+                self._feed_users(users)
+            else:
+                self.users.add(users)
 
             tm = time.monotonic()
 
-        for idx, p in enumerate(self._processors):
-            tm = time.monotonic()
-            p.end_users(self, limits)
-            self._perfmon_put(idx, time.monotonic() - tm)
+        if feed_processors:
+            self._call_processors("end_users", limits)
 
         if drawer is not None:
             drawer.add_progress(0, force=True)
@@ -334,10 +1111,7 @@ class TabunStat:
         if drawer is not None:
             drawer.update(0)
 
-        for idx, p in enumerate(self._processors):
-            tm = time.monotonic()
-            p.begin_blogs(self, limits)
-            self._perfmon_put(idx, time.monotonic() - tm)
+        self._call_processors("begin_blogs", limits)
 
         tm = time.monotonic()
         for blogs in self.source.iter_blogs():  # никакая сортировка не гарантируется
@@ -350,18 +1124,11 @@ class TabunStat:
             if drawer is not None:
                 drawer.add_progress(len(blogs))
 
-            for idx, p in enumerate(self._processors):
-                tm = time.monotonic()
-                for blog in blogs:
-                    p.process_blog(self, blog)
-                self._perfmon_put(idx, time.monotonic() - tm)
+            self._feed_blogs(blogs)
 
             tm = time.monotonic()
 
-        for idx, p in enumerate(self._processors):
-            tm = time.monotonic()
-            p.end_blogs(self, limits)
-            self._perfmon_put(idx, time.monotonic() - tm)
+        self._call_processors("end_blogs", limits)
 
         if drawer is not None:
             drawer.add_progress(0, force=True)
@@ -404,10 +1171,11 @@ class TabunStat:
             self.log(1, "nothing to do.")
             return
 
+        # В куске могут оказаться только посты или только комменты
         for k in ("first_created_at", "last_created_at"):
-            if getattr(posts_limits, k).tzinfo is None:
+            if not no_posts and getattr(posts_limits, k).tzinfo is None:
                 raise ValueError(f"PostsLimits.{k} must be aware datetime")
-            if getattr(comments_limits, k).tzinfo is None:
+            if not no_comments and getattr(comments_limits, k).tzinfo is None:
                 raise ValueError(f"CommentsLimits.{k} must be aware datetime")
 
         drawer = (
@@ -435,51 +1203,72 @@ class TabunStat:
         assert msg_min_date is not None
         assert msg_max_date is not None
 
-        for idx, p in enumerate(self._processors):
-            tm = time.monotonic()
-            p.begin_messages(self, posts_limits, comments_limits)
-            self._perfmon_put(idx, time.monotonic() - tm)
-
-        # И дальше забираем посты и комменты по дням, сортируя их строго по времени
-        for source_perf, source_perf_threaded, posts, comments in iter_messages_threaded(
-            msg_min_date, msg_max_date, self.source
-        ):
-            self._source_perf += source_perf
-            self._source_perf_threaded += source_perf_threaded
-
-            for post in posts:
-                if post.created_at.tzinfo is None:
-                    raise ValueError("Post.created_at must be aware datetime")
-                post.created_at_local = post.created_at.astimezone(self.tz)
-
-            for comment in comments:
-                if comment.created_at.tzinfo is None:
-                    raise ValueError("Comment.created_at must be aware datetime")
-                comment.created_at_local = comment.created_at.astimezone(self.tz)
-
-            messages: list[types.Post | types.Comment] = []
-            messages.extend(posts)
-            messages.extend(comments)
-
-            if messages:
-                messages.sort(key=lambda x: x.created_at)
-
-            for idx, p in enumerate(self._processors):
-                tm = time.monotonic()
+        self._call_processors("begin_messages", posts_limits, comments_limits)
+
+        # Если источник умеет отдавать посты и комменты одним потоком, уже
+        # отсортированными по времени, то используем его
+        try:
+            merged = self.source.iter_messages(filters=datefilters, chunk_size=self.prefetch_rows)
+        except NotImplementedError:
+            merged = None
+
+        if merged is not None:
+            for source_perf, source_perf_threaded, messages in iter_threaded(
+                merged, queue_size=self.prefetch_queue_size, stats=self._prefetch_stats
+            ):
+                self._source_perf += source_perf
+                self._source_perf_threaded += source_perf_threaded
+
                 for message in messages:
-                    if isinstance(message, types.Comment):
-                        p.process_comment(self, message)
-                    else:
-                        p.process_post(self, message)
-                self._perfmon_put(idx, time.monotonic() - tm)
+                    if message.created_at.tzinfo is None:
+                        raise ValueError(f"{type(message).__name__}.created_at must be aware datetime")
+                    message.created_at_local = message.created_at.astimezone(self.tz)
 
-            if drawer is not None:
-                drawer.add_progress(len(messages))
+                self._feed_messages(messages)
 
-        for idx, p in enumerate(self._processors):
+                if drawer is not None:
+                    drawer.add_progress(len(messages))
+
+        # Иначе забираем посты и комменты по интервалам времени, сортируя их
+        # строго по времени
+        else:
             tm = time.monotonic()
-            p.end_messages(self, posts_limits, comments_limits)
-            self._perfmon_put(idx, time.monotonic() - tm)
+            windows = plan_message_windows(self.source, msg_min_date, msg_max_date, rows=self.prefetch_rows)
+            self._source_perf += time.monotonic() - tm
+
+            for source_perf, source_perf_threaded, posts, comments in iter_messages_threaded(
+                self.source,
+                windows,
+                queue_size=self.prefetch_queue_size,
+                threads=self.prefetch_threads,
+                stats=self._prefetch_stats,
+            ):
+                self._source_perf += source_perf
+                self._source_perf_threaded += source_perf_threaded
+
+                for post in posts:
+                    if post.created_at.tzinfo is None:
+                        raise ValueError("Post.created_at must be aware datetime")
+                    post.created_at_local = post.created_at.astimezone(self.tz)
+
+                for comment in comments:
+                    if comment.created_at.tzinfo is None:
+                        raise ValueError("Comment.created_at must be aware datetime")
+                    comment.created_at_local = comment.created_at.astimezone(self.tz)
+
+                messages = []
+                messages.extend(posts)
+                messages.extend(comments)
+
+                if messages:
+                    messages.sort(key=lambda x: x.created_at)
+
+                self._feed_messages(messages)
+
+                if drawer is not None:
+                    drawer.add_progress(len(messages))
+
+        self._call_processors("end_messages", posts_limits, comments_limits)
 
         if drawer is not None:
             drawer.add_progress(0, force=True)
@@ -487,26 +1276,115 @@ class TabunStat:
         self.log(1, f"| Done in {utils.format_timedelta(time.monotonic() - all_tm)}.")
 
 
-def iter_messages(
+def split_date_range(
+    source: BaseDataSource,
     min_date: datetime,
     max_date: datetime,
+    parts: int,
+    *,
+    total: int | None = None,
+    precision: timedelta = timedelta(days=1),
+) -> list[datetime]:
+    """Делит диапазон дат [min_date, max_date) на указанное число частей так,
+    чтобы в каждую часть попало примерно одинаковое число постов
+    и комментов (активность на Табуне в разные годы сильно отличается,
+    поэтому делить время поровну бессмысленно). Возвращает внутренние границы
+    частей (то есть parts - 1 дат по возрастанию).
+    """
+
+    def count(date_from: datetime, date_to: datetime) -> int:
+        filters = {"created_at__gte": date_from, "created_at__lt": date_to}
+        return source.get_posts_limits(filters).count + source.get_comments_limits(filters).count
+
+    if total is None:
+        total = count(min_date, max_date)
+
+    bounds: list[datetime] = []
+    prev_bound = min_date
+    prev_count = 0  # Сколько сообщений до prev_bound
+
+    for i in range(1, parts):
+        target = total * i // parts - prev_count
+        # Бинпоиск по датам: ищем самую раннюю дату, до которой
+        # (начиная с prev_bound) набирается target сообщений
+        lo, hi = prev_bound, max_date
+        while hi - lo > precision:
+            mid = lo + (hi - lo) / 2
+            if count(prev_bound, mid) < target:
+                lo = mid
+            else:
+                hi = mid
+
+        prev_count += count(prev_bound, hi)
+        prev_bound = hi
+        bounds.append(hi)
+
+    return bounds
+
+
+def plan_message_windows(
     source: BaseDataSource,
+    min_date: datetime,
+    max_date: datetime,
     *,
-    interval_days: int = 1,
-) -> Iterator[tuple[float, list[types.Post], list[types.Comment]]]:
-    # Загружаем посты и комменты небольшими кусочками по дням
-    day = min_date
+    rows: int,
+    step: timedelta = timedelta(days=30),
+) -> list[dict[str, datetime]]:
+    """Делит интервал [min_date, max_date] на интервалы для загрузки постов
+    и комментов так, чтобы в каждом было примерно rows сообщений. Возвращает
+    фильтры для каждого интервала по порядку.
+
+    Число сообщений считается через get_*_limits по кусочкам длиной step,
+    внутри которых сообщения считаются распределёнными равномерно. Кусочки
+    без сообщений пропускаются целиком, поэтому в начале истории Табуна,
+    когда сообщений мало, интервалы получаются длинными, а в пиковые дни —
+    короткими.
+    """
+    windows: list[dict[str, datetime]] = []
+
+    range_from = min_date
     while True:
-        next_day = day + timedelta(days=interval_days)
+        range_to = range_from + step
+        last = range_to >= max_date
+
+        # max_date здесь это дата последнего поста/комментария, а не дата
+        # из настроек, поэтому для последнего кусочка lte вместо lt
+        end_key = "created_at__lt"
+        if last:
+            range_to = max_date
+            end_key = "created_at__lte"
+
+        filters = {"created_at__gte": range_from, end_key: range_to}
+        count = source.get_posts_limits(filters).count + source.get_comments_limits(filters).count
+
+        parts = math.ceil(count / rows)
+        for i in range(parts):
+            window_to = range_from + (range_to - range_from) * (i + 1) / parts if i + 1 < parts else range_to
+            windows.append(
+                {
+                    "created_at__gte": range_from + (range_to - range_from) * i / parts,
+                    end_key if i + 1 == parts else "created_at__lt": window_to,
+                }
+            )
+
+        if last:
+            break
+        range_from = range_to
+
+    return windows
 
-        filters = {"created_at__gte": day}
-        if next_day >= max_date:
-            # max_date здесь это дата последнего поста/комментария, а не дата
-            # из настроек, поэтому lte вместо lt
-            filters["created_at__lte"] = max_date
-        else:
-            filters["created_at__lt"] = next_day
 
+def iter_messages(
+    source: BaseDataSource,
+    windows: list[dict[str, datetime]],
+    *,
+    part: int = 0,
+    parts: int = 1,
+) -> Iterator[tuple[float, list[types.Post], list[types.Comment]]]:
+    # Загружаем посты и комменты небольшими кусочками по интервалам времени.
+    # Если кусочки загружаются в несколько потоков, то каждый поток берёт
+    # каждый parts-й кусочек, начиная с part
+    for filters in windows[part::parts]:
         tm = time.monotonic()
 
         # Опция burst, если реализована в источнике данных, позволяет ему не возиться
@@ -518,74 +1396,133 @@ def iter_messages(
 
         yield source_perf, posts, comments
 
-        if next_day >= max_date:
-            break
-        day = next_day
-
 
 def iter_messages_threaded(
-    min_date: datetime,
-    max_date: datetime,
     source: BaseDataSource,
+    windows: list[dict[str, datetime]],
     *,
-    interval_days: int = 1,
     queue_size: int = 4,
+    threads: int = 1,
+    stats: "PrefetchStats | None" = None,
 ) -> Iterator[tuple[float, float, list[types.Post], list[types.Comment]]]:
+    # Потоков больше, чем интервалов, не бывает (но хотя бы один нужен)
+    threads = max(1, min(threads, len(windows)))
+    iterators = [iter_messages(source, windows, part=i, parts=threads) for i in range(threads)]
+    for source_perf, _, (source_perf_threaded, posts, comments) in iter_threaded(
+        *iterators, queue_size=queue_size, stats=stats
+    ):
+        yield source_perf, source_perf_threaded, posts, comments
+
+
+@dataclass(slots=True)
+class PrefetchStats:
+    # Сколько элементов получено из очередей
+    items: int = 0
+    # Сколько раз очередь оказалась пустой и пришлось ждать поток
+    starved: int = 0
+    # Сколько раз очередь оказалась заполненной целиком
+    full: int = 0
+    # Сколько всего времени пришлось ждать элементы из очередей
+    wait: float = 0.0
+
+
+def iter_threaded(
+    *iterators: Iterator[T],
+    queue_size: int = 4,
+    stats: PrefetchStats | None = None,
+) -> Iterator[tuple[float, float, T]]:
+    """Забирает элементы из итераторов, каждый в своём отдельном потоке,
+    и yield'ит их по кругу (по одному элементу из каждого итератора, пока
+    какой-нибудь из них не закончится) вместе с двумя замерами времени:
+    сколько вызывающая сторона прождала этот элемент и сколько поток
+    потратил на его получение. Если передан stats, то в него добавляется
+    статистика заполненности очередей.
+    """
+
     # Поскольку куча времени тратится на ожидание данных от источника данных,
     # запуск этого ожидания в отдельном потоке позволяет ускорить работу
 
+    if not iterators:
+        raise ValueError("At least one iterator is required")
+
     tm = time.monotonic()
 
     # None в очереди означает завершение работы потока
-    queue: "Queue[tuple[float, list[types.Post], list[types.Comment]] | None]" = Queue(queue_size)
+    queues: "list[Queue[tuple[float, T] | None]]" = [Queue(queue_size) for _ in iterators]
+    done = [False] * len(iterators)
 
-    # Сигнал завершения для потока
+    # Сигнал завершения для потоков
     stopping = False
 
     # Ошибка, возникшая в потоке
     exc: BaseException | None = None
 
-    def thread_func() -> None:
+    def thread_func(iterator: Iterator[T], queue: "Queue[tuple[float, T] | None]") -> None:
         nonlocal exc
 
         try:
-            # Поток просто добавляет объекты из источника данных в очередь
-            for item in iter_messages(min_date, max_date, source, interval_days=interval_days):
-                if stopping:
+            # Поток просто добавляет объекты из итератора в очередь
+            while not stopping:
+                thread_tm = time.monotonic()
+                try:
+                    item = next(iterator)
+                except StopIteration:
                     break
-                queue.put(item)
+                queue.put((time.monotonic() - thread_tm, item))
 
         except BaseException as e:  # pylint: disable=broad-exception-caught
-            exc = e
+            exc = exc or e
 
         finally:
+            # Если итератор — генератор, который не дошёл до конца, то
+            # закрываем его, чтобы он освободил ресурсы (например, курсор)
+            close = getattr(iterator, "close", None)
+            if close is not None:
+                try:
+                    close()
+                except BaseException as e:  # pylint: disable=broad-exception-caught
+                    exc = exc or e
             # В конце всегда добавляем None как индикатор завершения работы потока
             queue.put(None)
 
-    t = Thread(target=thread_func)
-    t.start()
+    threads = [Thread(target=thread_func, args=x) for x in zip(iterators, queues)]
+    for t in threads:
+        t.start()
 
-    done = False
     try:
+        idx = 0
         while True:
             if exc is not None:
                 raise exc
 
-            item = queue.get()
-            if item is None:
-                done = True
+            was_empty, was_full = queues[idx].empty(), queues[idx].full()
+            wait_tm = time.monotonic()
+            queue_item = queues[idx].get()
+            if stats is not None:
+                stats.wait += time.monotonic() - wait_tm
+            if queue_item is None:
+                done[idx] = True
                 break
-            yield (time.monotonic() - tm,) + item
+
+            if stats is not None:
+                stats.items += 1
+                stats.starved += was_empty
+                stats.full += was_full
+            yield time.monotonic() - tm, queue_item[0], queue_item[1]
             tm = time.monotonic()
+            idx = (idx + 1) % len(queues)
 
         if exc is not None:
             raise exc
 
     finally:
-        # Отправляем потоку сигнал завершения работы
+        # Отправляем потокам сигнал завершения работы
         stopping = True
-        # Если поток ещё работает, нужно забирать данные из очереди, чтобы
+        # Если потоки ещё работают, нужно забирать данные из очередей, чтобы
         # случайно не словить зависание на переполненной очереди
-        while not done and queue.get() is not None:
-            pass
-        t.join()
+        for idx, queue in enumerate(queues):
+            while not done[idx] and queue.get() is not None:
+                pass
+            done[idx] = True
+        for t in threads:
+            t.join()
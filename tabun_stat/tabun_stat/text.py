@@ -0,0 +1,79 @@
+import re
+from typing import Callable, Hashable
+
+from tabun_stat import utils
+
+img_re = re.compile('<img[^>]+src="([^"]+)".*>', flags=re.U | re.I)
+
+DICE_MARKER = '<span class="dice">'
+
+
+class MessageText:
+    """Результаты разбора текста поста или коммента, общие для всех
+    обработчиков. Всё вычисляется лениво при первом обращении и запоминается,
+    так что сколько бы обработчиков ни было включено, каждый текст
+    разбирается не больше одного раза.
+
+    Получать следует через ``TabunStat.get_message_text``: объект хранится
+    в самом сообщении и живёт, пока живёт пачка сообщений.
+    """
+
+    __slots__ = ("body", "_stripped", "_unwrapped", "_images", "_dices_count", "_words")
+
+    def __init__(self, body: str):
+        self.body = body
+        self._stripped: str | None = None
+        self._unwrapped: str | None = None
+        self._images: list[str] | None = None
+        self._dices_count: int | None = None
+        self._words: dict[Hashable, list[bytes]] | None = None
+
+    @property
+    def stripped(self) -> str:
+        """Текст без пробельных символов по краям."""
+        if self._stripped is None:
+            self._stripped = self.body.strip()
+        return self._stripped
+
+    @property
+    def unwrapped(self) -> str:
+        """Текст без лишнего ``<div>`` вокруг, который добавляли старые версии
+        tbackup (пробельные символы по краям не убираются, если его нет).
+        """
+        if self._unwrapped is None:
+            body = self.body
+            if not body.startswith("<div ") and body.endswith("</div>"):
+                body = body[body.find(">") + 1 : body.rfind("<")].strip()
+            self._unwrapped = body
+        return self._unwrapped
+
+    @property
+    def images(self) -> list[str]:
+        """Ссылки на картинки без дубликатов в порядке появления в тексте."""
+        if self._images is None:
+            body = self.stripped
+            self._images = utils.drop_duplicates(img_re.findall(body)) if "<" in body else []
+        return self._images
+
+    @property
+    def dices_count(self) -> int:
+        """Сколько раз в сообщении брошены дайсы."""
+        if self._dices_count is None:
+            self._dices_count = self.body.count(DICE_MARKER)
+        return self._dices_count
+
+    def get_words(self, key: Hashable, split_words: Callable[[str], list[bytes]]) -> list[bytes]:
+        """Возвращает слова текста, поделённого функцией split_words.
+        Обработчики могут делить текст на слова по-разному, поэтому результат
+        запоминается отдельно для каждого ключа; обработчики с одинаковыми
+        настройками должны передавать одинаковый ключ.
+
+        Функции передаётся текст после ``unwrapped`` и ``strip``.
+        """
+        if self._words is None:
+            self._words = {}
+        try:
+            return self._words[key]
+        except KeyError:
+            words = self._words[key] = split_words(self.unwrapped.strip())
+            return words
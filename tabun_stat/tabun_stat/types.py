@@ -1,5 +1,13 @@
-from dataclasses import dataclass
+import array
+import math
+import typing
+from bisect import bisect_left, bisect_right
+from dataclasses import dataclass, field
 from datetime import date, datetime
+from typing import Iterable, Iterator
+
+if typing.TYPE_CHECKING:
+    from tabun_stat.text import MessageText
 
 # pylint: disable=too-many-instance-attributes
 
@@ -25,6 +33,89 @@ class User:
     description: str | None = None
 
 
+class UsersIndex:
+    """Основные данные всех пользователей в компактном виде: рейтинг, сила,
+    время регистрации и имя хранятся в массивах по id пользователя, а не
+    в словарях у каждого обработчика. Заполняется TabunStat при обработке
+    пользователей (до вызова ``process_user`` у обработчиков), доступен
+    как ``stat.users``.
+    """
+
+    def __init__(self) -> None:
+        # NaN в rating означает, что пользователя с таким id нет
+        self.rating = array.array("d")
+        self.skill = array.array("d")
+        self.registered_at = array.array("d")  # unix timestamp
+
+        # Имена лежат одной строкой, у каждого пользователя смещение и длина
+        self._username_offset = array.array("q")
+        self._username_length = array.array("l")
+        self._username_parts: list[str] = []
+        self._usernames_len = 0
+        self._usernames: str | None = ""
+
+        self._count = 0
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __contains__(self, user_id: int) -> bool:
+        return 0 <= user_id < len(self.rating) and not math.isnan(self.rating[user_id])
+
+    def _grow(self, size: int) -> None:
+        add = size - len(self.rating)
+        if add <= 0:
+            return
+        nans = array.array("d", [math.nan]) * add
+        self.rating.extend(nans)
+        self.skill.extend(nans)
+        self.registered_at.extend(nans)
+        self._username_offset.extend(array.array("q", [0]) * add)
+        self._username_length.extend(array.array("l", [0]) * add)
+
+    def add(self, users: Iterable[User]) -> None:
+        for user in users:
+            if user.id < 0:
+                raise ValueError(f"Invalid user id {user.id}")
+            self._grow(user.id + 1)
+            if math.isnan(self.rating[user.id]):
+                self._count += 1
+            self.rating[user.id] = user.rating
+            self.skill[user.id] = user.skill
+            self.registered_at[user.id] = user.registered_at.timestamp()
+            self._username_offset[user.id] = self._usernames_len
+            self._username_length[user.id] = len(user.username)
+            self._username_parts.append(user.username)
+            self._usernames_len += len(user.username)
+            self._usernames = None
+
+    def ids(self) -> Iterator[int]:
+        """Id всех известных пользователей по возрастанию."""
+        for user_id, rating in enumerate(self.rating):
+            if not math.isnan(rating):
+                yield user_id
+
+    def get_rating(self, user_id: int) -> float | None:
+        if user_id not in self:
+            return None
+        return self.rating[user_id]
+
+    def get_registered_at(self, user_id: int) -> float | None:
+        """Время регистрации пользователя (unix timestamp)."""
+        if user_id not in self:
+            return None
+        return self.registered_at[user_id]
+
+    def get_username(self, user_id: int) -> str | None:
+        if user_id not in self:
+            return None
+        if self._usernames is None:
+            self._usernames = "".join(self._username_parts)
+            self._username_parts = [self._usernames]
+        offset = self._username_offset[user_id]
+        return self._usernames[offset : offset + self._username_length[user_id]]
+
+
 @dataclass(slots=True)
 class BlogsLimits:
     count: int
@@ -71,6 +162,8 @@ class Post:
     created_at_local: datetime | None = None  # filled automatically by tabun_stat
 
     comments: list["Comment"] | None = None
+    # Разобранный текст, см. TabunStat.get_message_text
+    text: "MessageText | None" = field(default=None, repr=False, compare=False)
 
 
 @dataclass(slots=True)
@@ -95,3 +188,100 @@ class Comment:
     body: str
     favorites_count: int
     created_at_local: datetime | None = None  # filled automatically by tabun_stat
+
+    # Разобранный текст, см. TabunStat.get_message_text
+    text: "MessageText | None" = field(default=None, repr=False, compare=False)
+
+
+@dataclass(slots=True)
+class MessagesBatch:
+    """Пачка постов и комментов (примерно prefetch_rows штук, см. TabunStat),
+    отсортированных по времени, вместе с их основными полями, разложенными
+    по колонкам-массивам. Колонки позволяют обработчикам считать статистику
+    сразу по всей пачке, не вызывая Python-код для каждого сообщения. Пачка
+    может захватывать несколько суток (см. iter_days).
+
+    Неизвестные значения (None) в колонках blog_id, blog_status и post_id
+    хранятся как -1, а неизвестный рейтинг поста — как 0.
+    """
+
+    messages: list[Post | Comment]
+    is_comment: "array.array[int]"  # 0 — пост, 1 — коммент
+    id: "array.array[int]"
+    author_id: "array.array[int]"
+    created_at: "array.array[float]"  # unix timestamp
+    local_day: "array.array[int]"  # date.toordinal() от created_at_local
+    blog_id: "array.array[int]"
+    blog_status: "array.array[int]"
+    post_id: "array.array[int]"  # У постов — id самого поста
+    vote_value: "array.array[int]"
+    public: "array.array[int]"  # 1, если блог открытый или полузакрытый
+
+    @classmethod
+    def from_messages(cls, messages: list[Post | Comment]) -> "MessagesBatch":
+        batch = cls(
+            messages=messages,
+            is_comment=array.array("B"),
+            id=array.array("q"),
+            author_id=array.array("q"),
+            created_at=array.array("d"),
+            local_day=array.array("l"),
+            blog_id=array.array("q"),
+            blog_status=array.array("b"),
+            post_id=array.array("q"),
+            vote_value=array.array("q"),
+            public=array.array("B"),
+        )
+
+        for m in messages:
+            assert m.created_at_local is not None
+            if isinstance(m, Comment):
+                batch.is_comment.append(1)
+                batch.post_id.append(m.post_id if m.post_id is not None else -1)
+            else:
+                batch.is_comment.append(0)
+                batch.post_id.append(m.id)
+            batch.id.append(m.id)
+            batch.author_id.append(m.author_id)
+            batch.created_at.append(m.created_at.timestamp())
+            batch.local_day.append(m.created_at_local.toordinal())
+            batch.blog_id.append(m.blog_id if m.blog_id is not None else -1)
+            batch.blog_status.append(m.blog_status if m.blog_status is not None else -1)
+            batch.vote_value.append(m.vote_value or 0)
+            batch.public.append(m.blog_status in (0, 2))
+
+        return batch
+
+    def __len__(self) -> int:
+        return len(self.messages)
+
+    def slice(self, lo: int, hi: int) -> "MessagesBatch":
+        """Возвращает новую пачку из сообщений с индексами [lo, hi)."""
+        return MessagesBatch(
+            messages=self.messages[lo:hi],
+            is_comment=self.is_comment[lo:hi],
+            id=self.id[lo:hi],
+            author_id=self.author_id[lo:hi],
+            created_at=self.created_at[lo:hi],
+            local_day=self.local_day[lo:hi],
+            blog_id=self.blog_id[lo:hi],
+            blog_status=self.blog_status[lo:hi],
+            post_id=self.post_id[lo:hi],
+            vote_value=self.vote_value[lo:hi],
+            public=self.public[lo:hi],
+        )
+
+    def iter_days(self) -> Iterator[tuple[date, int, int]]:
+        """Делит пачку на куски по локальным суткам. Yield'ит дату и границы
+        куска [lo, hi) в колонках.
+        """
+        lo = 0
+        while lo < len(self.local_day):
+            day_ordinal = self.local_day[lo]
+            hi = bisect_right(self.local_day, day_ordinal, lo)
+            yield date.fromordinal(day_ordinal), lo, hi
+            lo = hi
+
+    def find_time(self, tm: datetime, lo: int = 0, hi: int | None = None) -> int:
+        """Возвращает индекс первого сообщения не раньше указанного времени."""
+        return bisect_left(self.created_at, tm.timestamp(), lo, len(self.created_at) if hi is None else hi)